@@ -2,23 +2,38 @@ import argparse
 import os
 import sys
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 from ntu_learn_downloader import (
-    authenticate,
+    BlobStore,
+    LinkCache,
+    TokenCache,
+    TokenManager,
+    configure_client,
     get_courses,
     get_download_dir,
-    get_file_download_link,
-    get_recorded_lecture_download_link,
+    get_metrics,
+    iter_course_download_dirs,
+    iter_download_dir,
 )
-from ntu_learn_downloader.utils import (
-    download,
-    get_filename_from_url,
-    get_video_download_size,
-    sanitise_filename,
-    create_dummy_file,
-    dummy_file_exists
+from ntu_learn_downloader.api import DEFAULT_COURSE_WORKERS
+from ntu_learn_downloader.auth import DEFAULT_TOKEN_CACHE_PATH
+from ntu_learn_downloader.batch import batch_sync, read_accounts
+from ntu_learn_downloader.client import DEFAULT_POOL_SIZE
+from ntu_learn_downloader.crawler import DEFAULT_MAX_WORKERS
+from ntu_learn_downloader.parsing import PARSER_BACKENDS, set_parser_backend
+from ntu_learn_downloader.ratelimit import DEFAULT_RATE
+from ntu_learn_downloader.scheduler import (
+    DEFAULT_FILE_WORKERS,
+    DEFAULT_LECTURE_WORKERS,
+    DEFAULT_LOOKAHEAD,
+    DownloadScheduler,
+    FileIndex,
+    get_download_jobs,
+    iter_download_jobs,
 )
+from ntu_learn_downloader.storage import STORAGE_BACKENDS, open_storage
+from ntu_learn_downloader.utils import sanitise_filename
 
 parser = argparse.ArgumentParser(description="CLI wrapper to NTULearn Downloader")
 
@@ -29,6 +44,24 @@ parser.add_argument(
     help="username including domain name (e.g. username@student.main.ntu.edu.sg)",
 )
 parser.add_argument("-password", type=str, help="password")
+parser.add_argument(
+    "--accounts",
+    type=str,
+    help="CSV file with rows of username,password,download_to to sync several accounts at once, courses and files shared between accounts are downloaded once and hard linked",
+)
+parser.add_argument(
+    "--token_cache",
+    type=str,
+    default=DEFAULT_TOKEN_CACHE_PATH,
+    help="File the authentication token of each username is saved to (readable only by you) and reused from until it is about to expire (default: {})".format(
+        DEFAULT_TOKEN_CACHE_PATH
+    ),
+)
+parser.add_argument(
+    "--no_token_cache",
+    action="store_true",
+    help="Authenticate on every run instead of reusing saved tokens",
+)
 
 # Other flags
 parser.add_argument(
@@ -61,77 +94,189 @@ parser.add_argument(
     action="store_true",
     help="Prompt whether to download lecture video or files above set (set with --max_size)",
 )
+parser.add_argument(
+    "--crawl_workers",
+    type=int,
+    default=DEFAULT_MAX_WORKERS,
+    help="Number of folders fetched concurrently when crawling a course (default: {})".format(
+        DEFAULT_MAX_WORKERS
+    ),
+)
+parser.add_argument(
+    "--course_workers",
+    type=int,
+    default=DEFAULT_COURSE_WORKERS,
+    help="Number of courses crawled concurrently. Courses are still downloaded one at a time in order, while later courses are crawled (default: {})".format(
+        DEFAULT_COURSE_WORKERS
+    ),
+)
+parser.add_argument(
+    "--pool_size",
+    type=int,
+    default=DEFAULT_POOL_SIZE,
+    help="Number of connections to each host shared by all requests. This is the connection budget: crawling and downloads (including every segment of a lecture) together never use more at once, whatever the number of workers (default: {})".format(
+        DEFAULT_POOL_SIZE
+    ),
+)
+parser.add_argument(
+    "--rate_limit",
+    type=float,
+    default=DEFAULT_RATE,
+    help="Maximum requests per second to each host, 0 for no limit. Concurrency is lowered and requests are retried after backing off when NTULearn throttles (default: {})".format(
+        DEFAULT_RATE
+    ),
+)
+parser.add_argument(
+    "--file_workers",
+    type=int,
+    default=DEFAULT_FILE_WORKERS,
+    help="Number of files downloaded concurrently (default: {})".format(
+        DEFAULT_FILE_WORKERS
+    ),
+)
+parser.add_argument(
+    "--lecture_workers",
+    type=int,
+    default=DEFAULT_LECTURE_WORKERS,
+    help="Number of recorded lectures downloaded concurrently (default: {})".format(
+        DEFAULT_LECTURE_WORKERS
+    ),
+)
+parser.add_argument(
+    "--segments",
+    type=int,
+    default=1,
+    help="Download each recorded lecture over this many parallel connections (default: 1)",
+)
+parser.add_argument(
+    "--lookahead",
+    type=int,
+    default=DEFAULT_LOOKAHEAD,
+    help="Number of upcoming recorded lectures whose download link and size are resolved in the background (default: {})".format(
+        DEFAULT_LOOKAHEAD
+    ),
+)
+parser.add_argument(
+    "--incremental",
+    action="store_true",
+    help="Reuse download links saved by previous syncs in the download destination",
+)
+parser.add_argument(
+    "--storage",
+    choices=STORAGE_BACKENDS,
+    default="json",
+    help="How --incremental saves the download directory, sqlite only rewrites what changed and suits large download destinations (default: json)",
+)
+parser.add_argument(
+    "--link_cache_days",
+    type=float,
+    default=7,
+    help="Days a resolved file download link is cached for, 0 disables the cache (default: 7)",
+)
+parser.add_argument(
+    "--dedup",
+    action="store_true",
+    help="Keep a content addressed store of downloaded files in the download destination, duplicate files are hard linked to it instead of downloaded again (edits to a file apply to all of its copies). Files removed from the download destination are removed from the store after each sync",
+)
+parser.add_argument(
+    "--verify",
+    action="store_true",
+    help="Download files again if they were truncated or changed on NTULearn since they were downloaded, costs a HEAD request per downloaded file. Works best with --incremental, which records the size, ETag and Last-Modified of every download",
+)
+parser.add_argument(
+    "--no_preflight",
+    action="store_true",
+    help="Check whether each file was already downloaded on disk instead of listing each course folder once before downloading it",
+)
+parser.add_argument(
+    "--parser",
+    choices=PARSER_BACKENDS,
+    default="bs4",
+    help="HTML parser used for NTULearn pages, lxml is faster on large courses (default: bs4)",
+)
+parser.add_argument(
+    "--metrics_out",
+    type=str,
+    help="Write request and parsing metrics to this file, as JSON if it ends with .json else in the Prometheus text format",
+)
 
 
 def download_files(
-    BbRouter: str,
+    scheduler: DownloadScheduler,
     obj: Dict,
     download_path: str,
     ignore_files: bool = False,
     ignore_recorded_lectures: bool = False,
-    to_prompt: bool = False,
 ):
-    if obj["type"] == "folder":
-        download_path = os.path.join(download_path, sanitise_filename(obj["name"]), "")
-        for c in obj["children"]:
-            download_files(
-                BbRouter,
-                c,
-                download_path,
-                ignore_files,
-                ignore_recorded_lectures,
-                to_prompt,
-            )
-    elif obj["type"] == "file":
-        if ignore_files:
-            return
-        download_link = get_file_download_link(BbRouter, obj["predownload_link"])
-        filename = get_filename_from_url(download_link)
-        if filename is None:
-            print("Unable to get filename from: {}".format(download_link))
-            return
-        full_file_path = os.path.join(download_path, sanitise_filename(filename))
-        # although we get the filename from the download link, some have the same name as in the
-        # download link so we can potentially save a network call here
-        if os.path.exists(full_file_path) :
-            return
-        print("- {}".format(full_file_path))
-        download(BbRouter, download_link, full_file_path)
-        return
-    elif obj["type"] == "recorded_lecture":
-        if ignore_recorded_lectures:
-            return
-        # can infer video name without expensive call to get download link
-        video_name = sanitise_filename(obj["name"] + ".mp4")
-        full_file_path = os.path.join(download_path, video_name)
-        if os.path.exists(full_file_path) or dummy_file_exists(download_path, video_name):
-            return
-        download_link = get_recorded_lecture_download_link(
-            BbRouter, obj["predownload_link"]
-        )
-        video_size = get_video_download_size(download_link)
-        to_download = True
-        if to_prompt:
-            to_download = (
-                query_yes_no(
-                    "Download {}, ({})? ['Enter' for Y]".format(video_name, video_size), default="yes"
-                )
-                == "yes"
-            )
-        if to_download:
-            print("- {} ({})".format(full_file_path, video_size or "Unknown"))
-            download(BbRouter, download_link, full_file_path)
-        else:
-            dummy_file_path = create_dummy_file(download_path, video_name)
-            print("Created dummy file:", dummy_file_path)
+    jobs = get_download_jobs(obj, download_path, ignore_files, ignore_recorded_lectures)
+    scheduler.run(jobs)
 
-        return
+
+def confirm_download(video_name: str, video_size: Optional[str]) -> bool:
+    return (
+        query_yes_no(
+            "Download {}, ({})? ['Enter' for Y]".format(video_name, video_size), default="yes"
+        )
+        == "yes"
+    )
 
 
 def in_ignored_modules(module, ignored_list):
     return any(x in module for x in ignored_list)
 
 
+def include_course(name: str, sem: Optional[str], ignored_modules: List[str]) -> bool:
+    if sem and not name.startswith(sem):
+        return False
+    return not in_ignored_modules(name, ignored_modules)
+
+
+def run_batch(args, ignored_modules: List[str]):
+    accounts = read_accounts(args.accounts)
+    blob_store = BlobStore(accounts[0].download_to) if args.dedup and accounts else None
+    link_cache = (
+        LinkCache(accounts[0].download_to, ttl=args.link_cache_days * 24 * 60 * 60)
+        if args.link_cache_days > 0 and accounts
+        else None
+    )
+    stats = batch_sync(
+        accounts,
+        include_course=lambda name: include_course(name, args.sem, ignored_modules),
+        crawl_workers=args.crawl_workers,
+        ignore_files=args.ignore_files,
+        ignore_recorded_lectures=not args.download_recorded_lectures,
+        file_workers=args.file_workers,
+        lecture_workers=args.lecture_workers,
+        confirm=confirm_download if args.prompt else None,
+        segments=args.segments,
+        lookahead=args.lookahead,
+        verify=args.verify,
+        blob_index=blob_store,
+        token_cache=get_token_cache(args),
+        link_cache=link_cache,
+        storage_backend=args.storage if args.incremental else None,
+    )
+    print(stats.summary())
+    if blob_store:
+        prune_blobs(blob_store)
+
+
+def prune_blobs(blob_store: BlobStore):
+    print("Removed {} unused blobs".format(blob_store.prune()))
+
+
+def get_token_cache(args) -> Optional[TokenCache]:
+    return None if args.no_token_cache else TokenCache(args.token_cache)
+
+
+def report_metrics(metrics_out: Optional[str]):
+    metrics = get_metrics()
+    print(metrics.summary())
+    if metrics_out:
+        metrics.dump(metrics_out)
+        print("Metrics written to {}".format(metrics_out))
+
+
 def query_yes_no(question, default="yes"):
     """Ask a yes/no question via raw_input() and return their answer.
     
@@ -165,7 +310,22 @@ def query_yes_no(question, default="yes"):
 
 if __name__ == "__main__":
     args = parser.parse_args()
-    bbrouter = authenticate(args.username, args.password)
+    configure_client(pool_size=args.pool_size, rate_limit=args.rate_limit)
+    set_parser_backend(args.parser)
+
+    ignored_modules: List[str] = []
+    if args.ignore:
+        ignored_modules = args.ignore.split(",")
+        ignored_modules = [s.upper() for s in ignored_modules]
+
+    if args.accounts:
+        run_batch(args, ignored_modules)
+        report_metrics(args.metrics_out)
+        print("DONE")
+        sys.exit()
+
+    token_manager = TokenManager(args.username, args.password, get_token_cache(args))
+    bbrouter = token_manager.get_token()
 
     print("you are taking the following courses:")
     courses = get_courses(bbrouter)
@@ -176,26 +336,82 @@ if __name__ == "__main__":
         print("\n\nDownloading to {}".format(args.download_to))
 
         ignore_recorded_lectures = False if args.download_recorded_lectures else True
-        ignored_modules: List[str] = []
-        if args.ignore:
-            ignored_modules = args.ignore.split(",")
-            ignored_modules = [s.upper() for s in ignored_modules]
-
-        for name, course_id in courses:
-            if args.sem and not name.startswith(args.sem):
-                continue
-            if in_ignored_modules(name, ignored_modules):
-                continue
-            print(name)
-            course_folder = get_download_dir(bbrouter, name, course_id)
-
-            download_files(
-                bbrouter,
-                course_folder,
-                args.download_to,
-                ignore_files=args.ignore_files,
-                ignore_recorded_lectures=not args.download_recorded_lectures,
-                to_prompt=args.prompt,
+
+        link_cache = (
+            LinkCache(args.download_to, ttl=args.link_cache_days * 24 * 60 * 60)
+            if args.link_cache_days > 0
+            else None
+        )
+        storage = open_storage(args.download_to, args.storage) if args.incremental else None
+        file_index = None if args.no_preflight else FileIndex()
+        blob_store = BlobStore(args.download_to) if args.dedup else None
+        scheduler = DownloadScheduler(
+            bbrouter,
+            file_workers=args.file_workers,
+            lecture_workers=args.lecture_workers,
+            confirm=confirm_download if args.prompt else None,
+            segments=args.segments,
+            lookahead=args.lookahead,
+            link_cache=link_cache,
+            blob_index=blob_store,
+            storage=storage,
+            file_index=file_index,
+            verify=args.verify,
+        )
+
+        selected = [
+            (name, course_id)
+            for name, course_id in courses
+            if include_course(name, args.sem, ignored_modules)
+        ]
+        if args.course_workers > 1:
+            # crawl the next courses while the current one downloads, every request shares the
+            # client's connection pool and rate limiter
+            course_folders = iter_course_download_dirs(
+                bbrouter, selected, args.crawl_workers, args.course_workers
             )
+        else:
+            course_folders = ((name, course_id, None) for name, course_id in selected)
+
+        for name, course_id, course_folder in course_folders:
+            print(name)
+            if file_index is not None:
+                file_index.scan(os.path.join(args.download_to, sanitise_filename(name)))
+            if not storage and course_folder is None:
+                # nothing to merge, start downloading while the course is being crawled
+                nodes = iter_download_dir(
+                    bbrouter, name, course_id, args.download_to, args.crawl_workers
+                )
+                scheduler.run(
+                    iter_download_jobs(
+                        nodes,
+                        ignore_files=args.ignore_files,
+                        ignore_recorded_lectures=not args.download_recorded_lectures,
+                    )
+                )
+            else:
+                if course_folder is None:
+                    course_folder = get_download_dir(
+                        bbrouter, name, course_id, max_workers=args.crawl_workers
+                    )
+                if storage:
+                    storage.merge_download_dir([course_folder])
+                download_files(
+                    scheduler,
+                    course_folder,
+                    args.download_to,
+                    ignore_files=args.ignore_files,
+                    ignore_recorded_lectures=not args.download_recorded_lectures,
+                )
+                if storage:
+                    storage.save_course(course_folder)
+            if link_cache:
+                link_cache.save()
+
+        print(scheduler.stats.summary())
+        if blob_store:
+            prune_blobs(blob_store)
 
+    token_manager.touch()
+    report_metrics(args.metrics_out)
     print("DONE")
@@ -3,8 +3,14 @@ from .api import (
     get_courses,
     get_content_ids,
     get_download_dir,
+    iter_course_download_dirs,
+    iter_download_dir,
     get_recorded_lecture_download_link,
     get_file_download_link,
 )
 
-from .storage import Storage
+from .auth import TokenCache, TokenManager
+from .client import Client, configure_client, get_client
+from .metrics import Metrics, get_metrics, set_metrics
+from .ratelimit import RateLimiter
+from .storage import BlobStore, LinkCache, SQLiteStorage, Storage
@@ -0,0 +1,277 @@
+"""
+Asyncio counterpart of api.py, requires aiohttp (pip install ntu_learn_downloader[async]).
+
+Every function takes an AsyncClient, which owns a single aiohttp session whose connector bounds the
+number of concurrent connections per host, so one event loop can drive many accounts and courses
+at once. Responses are parsed with the same functions in parsing.py as the blocking api.
+Downloaded files are written from the loop's default executor, so disk writes never block the
+event loop.
+"""
+import asyncio
+import os
+from typing import Dict, List, Tuple
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency
+    aiohttp = None
+
+from ntu_learn_downloader.constants import (
+    GET_CONTENT_IDS_URL,
+    GET_CONTENT_LIST_URL,
+    GET_COURSES_URL,
+    NTULEARN_URL,
+)
+from ntu_learn_downloader.crawler import get_unloaded_folders
+from ntu_learn_downloader.models import MODEL_TYPES, Folder, to_model
+from ntu_learn_downloader.parsing import (
+    parse_content_html,
+    parse_content_ids_html,
+    parse_courses_html,
+    parse_recorded_lecture_contents,
+)
+from ntu_learn_downloader.utils import (
+    DOWNLOAD_HEADERS,
+    GET_REQUEST_HEADERS,
+    PART_VALIDATORS_SUFFIX,
+    get_content_range_start,
+    get_content_range_total,
+    get_if_range,
+    get_part_file_path,
+    read_part_validators,
+    remove_part_files,
+    write_part_validators,
+)
+from ntu_learn_downloader.urls import get_ids_from_listContent_url
+
+DEFAULT_LIMIT_PER_HOST = 16
+CHUNK_SIZE = 64 * 1024
+# chunks are buffered up to this many bytes per write, each write is a hop to the executor
+WRITE_SIZE = 1024 * 1024
+# seconds, a request is not limited as a whole since lectures take long to download and requests
+# may wait for a connection, only connecting and every read are
+DEFAULT_SOCK_CONNECT_TIMEOUT = 30
+DEFAULT_SOCK_READ_TIMEOUT = 120
+
+
+class AsyncClient:
+    """owns the aiohttp session, create it inside a running event loop and close it when done
+    (or use it as an async context manager)"""
+
+    def __init__(
+        self,
+        limit_per_host: int = DEFAULT_LIMIT_PER_HOST,
+        limit: int = 0,
+        sock_connect_timeout: float = DEFAULT_SOCK_CONNECT_TIMEOUT,
+        sock_read_timeout: float = DEFAULT_SOCK_READ_TIMEOUT,
+    ):
+        """
+        Args:
+            limit_per_host (int): maximum number of concurrent connections to a single host
+            limit (int): maximum number of concurrent connections in total, 0 for no limit
+            sock_connect_timeout (float): seconds to connect to the server
+            sock_read_timeout (float): seconds to wait for each read from the server
+        """
+        if aiohttp is None:
+            raise ImportError(
+                "aiohttp is required for ntu_learn_downloader.aio, "
+                "install with: pip install ntu_learn_downloader[async]"
+            )
+        # BbRouter is passed explicitly with every request, don't store cookies from responses
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+            cookie_jar=aiohttp.DummyCookieJar(),
+            # aiohttp's default total timeout of 5 minutes aborts long downloads
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=sock_connect_timeout, sock_read=sock_read_timeout
+            ),
+        )
+
+    async def close(self):
+        await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+
+def get_headers(BbRouter: str, headers: Dict[str, str]) -> Dict[str, str]:
+    # set the cookie header directly, aiohttp would quote the BbRouter value as it contains commas
+    return dict(headers, Cookie="BbRouter=" + BbRouter)
+
+
+async def make_GET_request(
+    client: AsyncClient, BbRouter: str, path: str, params=None
+) -> bytes:
+    async with client.session.get(
+        path, headers=get_headers(BbRouter, GET_REQUEST_HEADERS), params=params
+    ) as response:
+        return await response.read()
+
+
+async def get_courses(client: AsyncClient, BbRouter: str) -> List[Tuple[str, str]]:
+    """see api.get_courses"""
+    params = {
+        "cmd": "view",
+        "serviceLevel": "blackboard.data.course.Course$ServiceLevel:FULL",
+    }
+    content = await make_GET_request(client, BbRouter, GET_COURSES_URL, params)
+    return parse_courses_html(content)
+
+
+async def get_content_ids(
+    client: AsyncClient, BbRouter: str, course_id: str
+) -> List[Tuple[str, str]]:
+    """see api.get_content_ids"""
+    params = {"method": "search", "context": "course_entry", "course_id": course_id}
+    content = await make_GET_request(client, BbRouter, GET_CONTENT_IDS_URL, params)
+    return parse_content_ids_html(content.decode())
+
+
+async def get_contents(
+    client: AsyncClient, BbRouter: str, course_id: str, content_id: str
+) -> List[MODEL_TYPES]:
+    """see api.get_contents"""
+    params = {"course_id": course_id, "content_id": content_id}
+    content = await make_GET_request(client, BbRouter, GET_CONTENT_LIST_URL, params)
+    return [to_model(c) for c in parse_content_html(content.decode())]
+
+
+async def load_folder(client: AsyncClient, BbRouter: str, folder: Folder):
+    """load the children of folder and, concurrently, of every folder under it"""
+    if folder.children is None:
+        course_content_id = (
+            get_ids_from_listContent_url(folder.link) if folder.link else None
+        )
+        folder.children = (
+            await get_contents(client, BbRouter, *course_content_id)
+            if course_content_id
+            else []
+        )
+    await asyncio.gather(
+        *[
+            load_folder(client, BbRouter, f)
+            for f in get_unloaded_folders(folder.children)
+        ]
+    )
+
+
+async def get_download_dir(
+    client: AsyncClient, BbRouter: str, course_name: str, course_id: str
+) -> Dict:
+    """see api.get_download_dir, every folder is fetched concurrently"""
+    content_names_ids = await get_content_ids(client, BbRouter, course_id)
+    contents = await asyncio.gather(
+        *[
+            get_contents(client, BbRouter, course_id, content_id)
+            for _content_name, content_id in content_names_ids
+        ]
+    )
+    children = [
+        Folder(
+            name=content_name,
+            link=None,
+            details="{} folder. Generated by NTULearn Downloader".format(content_name),
+            children=content,
+        )
+        for (content_name, _content_id), content in zip(content_names_ids, contents)
+    ]
+    folder = Folder(
+        name=course_name,
+        link=None,
+        details="Top level folder for {}. Generated by NTULearn Downloader".format(
+            course_name
+        ),
+        children=children,
+    )
+    await load_folder(client, BbRouter, folder)
+    return folder.serialize(BbRouter)
+
+
+async def get_recorded_lecture_download_link(
+    client: AsyncClient, BbRouter: str, predownload_link: str
+) -> str:
+    """see api.get_recorded_lecture_download_link"""
+    content = await make_GET_request(client, BbRouter, NTULEARN_URL + predownload_link)
+    return parse_recorded_lecture_contents(content.decode())
+
+
+async def get_file_download_link(client: AsyncClient, BbRouter: str, link: str) -> str:
+    """see api.get_file_download_link"""
+    async with client.session.head(
+        link, allow_redirects=True, headers=get_headers(BbRouter, {})
+    ) as response:
+        return str(response.url)
+
+
+async def download(
+    client: AsyncClient, BbRouter: str, url: str, destination: str
+) -> bool:
+    """see utils.download, resumes from {destination}.part with a Range and If-Range request if
+    present
+
+    Returns:
+        bool -- True if file was downloaded, False if destination already exists
+    """
+    dir_path = os.path.dirname(destination)
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    if os.path.isfile(destination):
+        return False
+
+    part_path = get_part_file_path(destination)
+    validators_path = destination + PART_VALIDATORS_SUFFIX
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    headers = get_headers(BbRouter, DOWNLOAD_HEADERS)
+    if offset:
+        headers["Range"] = "bytes={}-".format(offset)
+        if_range = get_if_range(read_part_validators(validators_path))
+        if if_range:
+            headers["If-Range"] = if_range
+
+    loop = asyncio.get_running_loop()
+    async with client.session.get(url, headers=headers) as response:
+        if offset and response.status == 416:
+            if get_content_range_total(response.headers.get("Content-Range")) == offset:
+                os.replace(part_path, destination)
+                remove_part_files(validators_path)
+                return True
+            # the connection is released before starting over
+            response.release()
+            remove_part_files(part_path, validators_path)
+            return await download(client, BbRouter, url, destination)
+        response.raise_for_status()
+        if response.status == 206 and (
+            get_content_range_start(response.headers.get("Content-Range")) != offset
+        ):
+            # not the rest of the part file, start over
+            # the connection is released before starting over
+            response.release()
+            remove_part_files(part_path, validators_path)
+            return await download(client, BbRouter, url, destination)
+        if response.status != 206:
+            offset = 0
+            validators = {
+                key: response.headers[header]
+                for key, header in (("etag", "ETag"), ("last_modified", "Last-Modified"))
+                if response.headers.get(header)
+            }
+            await loop.run_in_executor(None, write_part_validators, validators_path, validators)
+        f = await loop.run_in_executor(None, open, part_path, "ab" if offset else "wb")
+        try:
+            buffer = bytearray()
+            async for data in response.content.iter_chunked(CHUNK_SIZE):
+                buffer += data
+                if len(buffer) >= WRITE_SIZE:
+                    await loop.run_in_executor(None, f.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await loop.run_in_executor(None, f.write, bytes(buffer))
+        finally:
+            await loop.run_in_executor(None, f.close)
+
+    os.replace(part_path, destination)
+    remove_part_files(validators_path)
+    return True
@@ -1,13 +1,13 @@
-import re
-from typing import List, Tuple, Union, Dict
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Tuple, Union, Dict
 from urllib.parse import parse_qs, urlencode, urlparse
 import json
 
-import bs4
-import requests
 from bs4 import BeautifulSoup
 
 
+from ntu_learn_downloader.client import get_client
 from ntu_learn_downloader.constants import (
     GET_CONTENT_IDS_URL,
     GET_CONTENT_LIST_URL,
@@ -18,17 +18,27 @@ from ntu_learn_downloader.constants import (
     NTULEARN_URL,
     SAML_SSO_URL,
 )
-from ntu_learn_downloader.utils import (
-    get_content_id_from_listContent_url,
-    is_download_link,
-    make_GET_request,
+from ntu_learn_downloader.metrics import (
+    ACUSTUDIO,
+    AUTH,
+    CONTENT_IDS,
+    COURSES,
+    HEAD_REDIRECT,
+    LIST_CONTENT,
 )
+from ntu_learn_downloader.utils import make_GET_request, sanitise_filename
 from ntu_learn_downloader.models import MODEL_TYPES, to_model, Folder
+from ntu_learn_downloader.crawler import iter_folder_tree, load_folder_tree
 from ntu_learn_downloader.parsing import (
+    parse_content_html,
+    parse_content_ids_html,
     parse_content_page,
+    parse_courses_html,
     parse_recorded_lecture_contents,
 )
 
+DEFAULT_COURSE_WORKERS = 4
+
 
 def authenticate(username: str, password: str) -> str:
     """NTU SSO authentication flow to generate BbRouter (NTULearn access token)
@@ -51,7 +61,9 @@ def authenticate(username: str, password: str) -> str:
         expires:{int},id:{str},signature:{str},site:{str},timeout:{int},user:{str},v:{int},xsrf:{str}
         If there is no user field then authentication has failed
     """
-    sess = requests.Session()
+    # authentication relies on cookies set between requests, so use a separate session that still
+    # shares the client's connection pool, and send its requests through the client's rate limiter
+    sess = get_client().new_session()
     # endpoint 1
     __ntulearn(sess)
 
@@ -122,36 +134,16 @@ def get_courses(BbRouter: str) -> List[Tuple[str, str]]:
         ("cmd", "view"),
         ("serviceLevel", "blackboard.data.course.Course$ServiceLevel:FULL"),
     )
-    response = requests.get(
+    response = get_client().get(
         GET_COURSES_URL,
+        category=COURSES,
         headers=headers,
         params=params,  # type: ignore
         cookies=cookies,
     )
 
     # parse response
-    soup = BeautifulSoup(response.content, features="lxml")
-    links = soup.find_all("a")
-
-    courses: List[Tuple[str, str]] = []
-    for link in links:
-        name = link.contents[0]
-        if isinstance(name, bs4.element.Tag):
-            name = name.text
-        # expect fullLink to be of form:
-        # link javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url='); return false;
-        fullLink = link.get("onclick")
-        matches = re.search(r"type=Course&id=_(\S+)&url=", fullLink)
-        if matches is None:
-            print("Unable to parse link to get course id: {}".format(fullLink))
-            continue
-        groups = matches.groups()
-        if len(groups) != 1:
-            print("Unable to parse link to get course id: {}".format(fullLink))
-            continue
-        course_id = groups[0]
-        courses.append((name, course_id))
-    return courses
+    return parse_courses_html(response.content)
 
 
 def get_content_ids(BbRouter: str, course_id: str) -> List[Tuple[str, str]]:
@@ -169,39 +161,31 @@ def get_content_ids(BbRouter: str, course_id: str) -> List[Tuple[str, str]]:
         ("context", "course_entry"),
         ("course_id", course_id),
     )
-    response = make_GET_request(BbRouter, GET_CONTENT_IDS_URL, params)
-
-    soup = BeautifulSoup(response.content.decode(), features="lxml")
-    ll = soup.find("ul", {"id": "courseMenuPalette_contents"})
-    result: List[Tuple[str, str]] = []
-    for c in ll:
-        a = c.find("a")
-        if a is None:
-            continue
-        url = a.get("href")
-        name = a.text
-        content_id = get_content_id_from_listContent_url(url)
-        if content_id:
-            result.append((name, content_id))
-    return result
+    response = make_GET_request(BbRouter, GET_CONTENT_IDS_URL, params, CONTENT_IDS)
+
+    return parse_content_ids_html(response.content.decode())
 
 
 def get_contents(
     BbRouter: str, course_id: str, content_id: str
 ) -> List[MODEL_TYPES]:
     # NOTE e.g. "course_id": "_306327_1", "content_id": "_1790226_1"
-    soup = make_get_contents_request(BbRouter, course_id, content_id)
-    children = [to_model(c) for c in parse_content_page(soup)]
+    html = make_get_contents_html_request(BbRouter, course_id, content_id)
+    children = [to_model(c) for c in parse_content_html(html)]
     return children
 
 
+def make_get_contents_html_request(BbRouter: str, course_id: str, content_id: str) -> str:
+    params = (("course_id", course_id), ("content_id", content_id))
+    response = make_GET_request(BbRouter, GET_CONTENT_LIST_URL, params, LIST_CONTENT)
+    return response.content.decode()
+
+
 def make_get_contents_request(
     BbRouter: str, course_id: str, content_id: str
 ) -> BeautifulSoup:
-    params = (("course_id", course_id), ("content_id", content_id))
-    response = make_GET_request(BbRouter, GET_CONTENT_LIST_URL, params)
-    soup = BeautifulSoup(response.content.decode(), features="lxml")
-    return soup
+    html = make_get_contents_html_request(BbRouter, course_id, content_id)
+    return BeautifulSoup(html, features="lxml")
 
 
 def get_recorded_lecture_contents(BbRouter: str, link: str) -> str:
@@ -214,7 +198,7 @@ def get_recorded_lecture_contents(BbRouter: str, link: str) -> str:
     Returns:
         str -- html of page
     """
-    response = make_GET_request(BbRouter, NTULEARN_URL + link)
+    response = make_GET_request(BbRouter, NTULEARN_URL + link, category=ACUSTUDIO)
     return response.content.decode()
 
 
@@ -244,17 +228,22 @@ def get_file_download_link(BbRouter: str, link: str) -> str:
         str -- file download link
     """
     cookies = {"BbRouter": BbRouter}
-    headers = requests.head(link, allow_redirects=True, cookies=cookies)
+    headers = get_client().head(
+        link, category=HEAD_REDIRECT, allow_redirects=True, cookies=cookies
+    )
     return headers.url
 
 
-def get_download_dir(BbRouter: str, course_name: str, course_id: str):
+def get_download_dir(
+    BbRouter: str, course_name: str, course_id: str, max_workers: int = 1
+):
     """Return dict with directory structure of downloadable items (documents and lectures)
 
     Arguments:
         BbRouter {str} -- authentication token
         course_name {str} -- name of course
         course_id {str} -- course id
+        max_workers {int} -- number of folders fetched concurrently, 1 crawls serially (default: {1})
 
     Returns:
         Dict or JSON dump -- Folder dict object, attributes shown below:
@@ -276,27 +265,115 @@ def get_download_dir(BbRouter: str, course_name: str, course_id: str):
     """
 
     content_names_ids = get_content_ids(BbRouter, course_id)
-    children = [
-        Folder(
-            name=content_name,
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        contents = executor.map(
+            lambda name_id: get_contents(BbRouter, course_id, name_id[1]),
+            content_names_ids,
+        )
+        children = [
+            Folder(
+                name=content_name,
+                link=None,
+                details="{} folder. Generated by NTULearn Downloader".format(
+                    content_name
+                ),
+                children=content,
+            )
+            for (content_name, _content_id), content in zip(content_names_ids, contents)
+        ]
+
+        folder = Folder(
+            name=course_name,
             link=None,
-            details="{} folder. Generated by NTULearn Downloader".format(content_name),
-            children=get_contents(BbRouter, course_id, content_id),
+            details="Top level folder for {}. Generated by NTULearn Downloader".format(
+                course_name
+            ),
+            children=children,
         )
-        for content_name, content_id in content_names_ids
-    ]
-
-    folder = Folder(
-        name=course_name,
-        link=None,
-        details="Top level folder for {}. Generated by NTULearn Downloader".format(
-            course_name
-        ),
-        children=children,
-    )
+        load_folder_tree(BbRouter, folder, executor)
     return folder.serialize(BbRouter)
 
 
+def iter_course_download_dirs(
+    BbRouter: str,
+    courses: List[Tuple[str, str]],
+    max_workers: int = 1,
+    course_workers: int = DEFAULT_COURSE_WORKERS,
+) -> Iterator[Tuple[str, str, Dict]]:
+    """Crawl several courses concurrently with get_download_dir, yielding each in the order of
+    courses as soon as it and every course before it have been crawled. Later courses keep being
+    crawled while the caller handles (e.g. downloads) earlier ones
+
+    Arguments:
+        BbRouter {str} -- authentication token
+        courses {List[Tuple[str, str]]} -- list of (course name, course_id), see get_courses
+        max_workers {int} -- number of folders fetched concurrently per course (default: {1})
+        course_workers {int} -- number of courses crawled concurrently
+
+    Returns:
+        Iterator[Tuple[str, str, Dict]] -- (course name, course_id, Folder dict)
+    """
+    with ThreadPoolExecutor(max_workers=course_workers) as executor:
+        futures = [
+            executor.submit(get_download_dir, BbRouter, name, course_id, max_workers)
+            for name, course_id in courses
+        ]
+        try:
+            for (name, course_id), future in zip(courses, futures):
+                yield name, course_id, future.result()
+        finally:
+            # the caller stopped early, don't crawl courses it will not ask for
+            for future in futures:
+                future.cancel()
+
+
+def iter_download_dir(
+    BbRouter: str,
+    course_name: str,
+    course_id: str,
+    download_path: str,
+    max_workers: int = 1,
+) -> Iterator[Tuple[str, Dict]]:
+    """Streaming counterpart of get_download_dir, yields the files and recorded lectures of the
+    course as soon as the listContent.jsp page listing them has been parsed, while the remaining
+    folders are still being fetched
+
+    Arguments:
+        BbRouter {str} -- authentication token
+        course_name {str} -- name of course
+        course_id {str} -- course id
+        download_path {str} -- directory the course folder is downloaded to
+        max_workers {int} -- number of folders fetched concurrently (default: {1})
+
+    Returns:
+        Iterator[Tuple[str, Dict]] -- (directory the node is downloaded to, file or
+        recorded_lecture dict as in get_download_dir), the same nodes and directories as
+        scheduler.get_download_jobs of get_download_dir but in the order pages are loaded
+    """
+    content_names_ids = get_content_ids(BbRouter, course_id)
+    course_path = os.path.join(download_path, sanitise_filename(course_name), "")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # content areas are fetched with course_id as returned by get_courses, like
+        # get_download_dir, only sub folders are fetched from the links in their parent's page
+        contents = executor.map(
+            lambda name_id: get_contents(BbRouter, course_id, name_id[1]),
+            content_names_ids,
+        )
+        content_areas = [
+            Folder(
+                name=content_name,
+                link=None,
+                details="{} folder. Generated by NTULearn Downloader".format(content_name),
+                children=content,
+            )
+            for (content_name, _content_id), content in zip(content_names_ids, contents)
+        ]
+        for path, folder in iter_folder_tree(BbRouter, content_areas, course_path, executor):
+            for child in folder.children or []:
+                if not isinstance(child, Folder):
+                    yield path, child.serialize(BbRouter)
+
+
 def __ntulearn(session):
     headers = {
         "Connection": "keep-alive",
@@ -312,7 +389,9 @@ def __ntulearn(session):
         "Accept-Language": "en-SG,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
     }
 
-    response = session.get(NTULEARN_URL, headers=headers, allow_redirects=True)
+    response = get_client().get(
+        NTULEARN_URL, category=AUTH, session=session, headers=headers, allow_redirects=True
+    )
     return response
 
 
@@ -331,8 +410,12 @@ def __ntulearn_auth_saml(session):
         "Accept-Language": "en-SG,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
     }
 
-    response = session.get(
-        NTULEARN_AUTH_SAML_URL, headers=headers, allow_redirects=True
+    response = get_client().get(
+        NTULEARN_AUTH_SAML_URL,
+        category=AUTH,
+        session=session,
+        headers=headers,
+        allow_redirects=True,
     )
     return response
 
@@ -359,7 +442,9 @@ def __loginfs(session, saml_params):
         ("Signature", saml_params["Signature"]),
     )
 
-    response = requests.get(LOGINFS_URL, headers=headers, params=params)
+    response = get_client().get(
+        LOGINFS_URL, category=AUTH, session=session, headers=headers, params=params
+    )
     return response
 
 
@@ -394,7 +479,9 @@ def __post_loginfs(session, username, password, saml_params, login_url):
         "AuthMethod": "FormsAuthentication",
     }
 
-    response = session.post(LOGINFS_URL, headers=headers, params=params, data=data)
+    response = get_client().post(
+        LOGINFS_URL, category=AUTH, session=session, headers=headers, params=params, data=data
+    )
     return response
 
 
@@ -417,5 +504,7 @@ def __ntulearn_SSO(session, referer: str, SAMLResponse: str):
 
     data = {"SAMLResponse": SAMLResponse}
 
-    response = session.post(SAML_SSO_URL, headers=headers, data=data)
+    response = get_client().post(
+        SAML_SSO_URL, category=AUTH, session=session, headers=headers, data=data
+    )
     return response
@@ -0,0 +1,182 @@
+"""
+Auth: reuse of BbRouter tokens across runs.
+
+TokenCache keeps the BbRouter of each username in a file only readable by its owner, along with
+when it was issued and last used. A BbRouter is of the form
+expires:{int},id:{str},signature:{str},site:{str},timeout:{int},user:{str},v:{int},xsrf:{str}
+where expires is when the session ends and timeout the seconds it may be idle for. A cached token
+is reused until it is within margin seconds of either.
+
+TokenManager hands out the token of an account, authenticating only if the cache has none, and
+registers it with the shared client so that it is refreshed transparently once NTULearn logs it out
+(see client.py).
+"""
+import json
+import os
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Optional
+
+from ntu_learn_downloader.api import authenticate as api_authenticate
+from ntu_learn_downloader.client import get_client
+
+DEFAULT_TOKEN_CACHE_PATH = os.path.join(str(Path.home()), ".ntu_learn_downloader", "tokens.json")
+# seconds before expiring that a cached token stops being reused
+DEFAULT_EXPIRY_MARGIN = 5 * 60
+
+
+def parse_bbrouter(BbRouter: str) -> Dict[str, str]:
+    """split a BbRouter into its fields, e.g. {"expires": "1590000000", "timeout": "10800", ...}"""
+    fields: Dict[str, str] = {}
+    for field in BbRouter.split(","):
+        key, sep, value = field.partition(":")
+        if sep:
+            fields[key] = value
+    return fields
+
+
+def get_token_expiry(BbRouter: str, used_at: float) -> Optional[float]:
+    """return when a BbRouter last used at used_at expires, None if it has no expiry
+
+    Args:
+        BbRouter (str): authentication token
+        used_at (float): time the token was last used
+
+    Returns:
+        Optional[float]: earliest of the expires field and used_at + the timeout field
+    """
+    fields = parse_bbrouter(BbRouter)
+    expiries = []
+    try:
+        expires = int(fields["expires"])
+        # treat values too large to be seconds as milliseconds
+        expiries.append(expires / 1000 if expires > 10 ** 11 else expires)
+    except (KeyError, ValueError):
+        pass
+    try:
+        expiries.append(used_at + int(fields["timeout"]))
+    except (KeyError, ValueError):
+        pass
+    return min(expiries) if expiries else None
+
+
+class TokenCache:
+    def __init__(self, path: str = DEFAULT_TOKEN_CACHE_PATH, margin: float = DEFAULT_EXPIRY_MARGIN):
+        """Persistent cache of username to BbRouter. The file is created with mode 0600 in a
+        directory with mode 0700
+
+        Args:
+            path (str): cache file
+            margin (float): seconds before expiring that a token stops being returned
+        """
+        self.path = path
+        self.margin = margin
+        self.lock = Lock()
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                # unreadable cache, tokens are requested again
+                self.entries = {}
+
+    def get(self, username: str) -> Optional[str]:
+        """return the cached BbRouter of username if it is not about to expire"""
+        with self.lock:
+            entry = self.entries.get(username)
+        if entry is None:
+            return None
+        expiry = get_token_expiry(entry["BbRouter"], entry["used_at"])
+        if expiry is None or time.time() > expiry - self.margin:
+            return None
+        return entry["BbRouter"]
+
+    def put(self, username: str, BbRouter: str):
+        """cache a newly issued BbRouter and write the cache to disk"""
+        now = time.time()
+        with self.lock:
+            self.entries[username] = {"BbRouter": BbRouter, "issued_at": now, "used_at": now}
+            self.save()
+
+    def touch(self, username: str):
+        """record that the token of username was just used, which restarts its idle timeout"""
+        with self.lock:
+            if username in self.entries:
+                self.entries[username]["used_at"] = time.time()
+                self.save()
+
+    def remove(self, username: str):
+        with self.lock:
+            if self.entries.pop(username, None) is not None:
+                self.save()
+
+    def save(self):
+        # called with the lock held. Write to a temporary file created with mode 0600 and rename it,
+        # so the tokens are never readable by others, not even briefly
+        dir_path = os.path.dirname(self.path)
+        if dir_path:
+            Path(dir_path).mkdir(mode=0o700, parents=True, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+
+class TokenManager:
+    def __init__(
+        self,
+        username: str,
+        password: str,
+        token_cache: Optional[TokenCache] = None,
+        authenticate: Callable[[str, str], str] = api_authenticate,
+    ):
+        """Token of one account, reused from token_cache if possible and refreshed once logged out
+
+        Args:
+            username (str): username including domain name
+            password (str): password
+            token_cache (Optional[TokenCache]): cache shared across runs, tokens are not reused
+                across runs if None
+            authenticate (Callable[[str, str], str]): returns a new BbRouter given the username and
+                password, defaults to api.authenticate
+        """
+        self.username = username
+        self.password = password
+        self.token_cache = token_cache
+        self.authenticate = authenticate
+        self.token: Optional[str] = None
+        self.lock = Lock()
+
+    def get_token(self) -> str:
+        """return a BbRouter, authenticating only if there is no usable cached one"""
+        with self.lock:
+            if self.token is None:
+                token = self.token_cache.get(self.username) if self.token_cache else None
+                self.token = token if token is not None else self.login()
+                get_client().register_token(self.token, self.refresh)
+            return self.token
+
+    def refresh(self, BbRouter: str) -> str:
+        """return a new BbRouter once BbRouter is logged out. Concurrent requests that were logged
+        out with the same token only authenticate once"""
+        with self.lock:
+            if self.token is None or self.token == BbRouter:
+                if self.token_cache:
+                    self.token_cache.remove(self.username)
+                self.token = self.login()
+            return self.token
+
+    def touch(self):
+        """record in the cache that the token was just used"""
+        if self.token_cache and self.token is not None:
+            self.token_cache.touch(self.username)
+
+    def login(self) -> str:
+        token = self.authenticate(self.username, self.password)
+        if self.token_cache:
+            self.token_cache.put(self.username, token)
+        return token
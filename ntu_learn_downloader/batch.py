@@ -0,0 +1,214 @@
+"""
+Batch: syncs several accounts at once.
+
+Accounts are authenticated concurrently, reusing their cached tokens if a TokenCache is given. Every distinct course is crawled and downloaded once,
+using the token of the first account enrolled in it, into that account's download directory. The
+course directory is then hard linked into the download directory of every other account enrolled
+in it. Files shared between courses are downloaded once through a shared BlobIndex (or BlobStore).
+
+With a storage backend, each course is crawled in full and merged with the storage of the download
+directory it is downloaded into, so download links saved by previous syncs are reused as in an
+incremental sync of a single account.
+"""
+import csv
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from ntu_learn_downloader.api import (
+    authenticate,
+    get_courses,
+    get_download_dir,
+    iter_download_dir,
+)
+from ntu_learn_downloader.auth import TokenCache, TokenManager
+from ntu_learn_downloader.storage import (
+    BlobStore,
+    LinkCache,
+    SQLiteStorage,
+    Storage,
+    open_storage,
+)
+from ntu_learn_downloader.scheduler import (
+    BlobIndex,
+    DownloadScheduler,
+    DownloadStats,
+    get_download_jobs,
+    iter_download_jobs,
+)
+from ntu_learn_downloader.utils import (
+    PART_FILE_SUFFIX,
+    PART_VALIDATORS_SUFFIX,
+    SEGMENT_JOURNAL_SUFFIX,
+    link_file,
+    sanitise_filename,
+)
+
+DEFAULT_AUTH_WORKERS = 4
+
+Account = namedtuple("Account", "username password download_to")
+
+
+def read_accounts(path: str) -> List[Account]:
+    """read accounts from a csv file with rows of username,password,download_to
+
+    Args:
+        path (str): path to csv file
+
+    Returns:
+        List[Account]: accounts in file order
+    """
+    with open(path, newline="") as f:
+        return [
+            Account(*[value.strip() for value in row])
+            for row in csv.reader(f)
+            if row and not row[0].startswith("#")
+        ]
+
+
+def authenticate_accounts(
+    accounts: List[Account],
+    max_workers: int = DEFAULT_AUTH_WORKERS,
+    token_cache: Optional[TokenCache] = None,
+) -> List[Tuple[Account, str]]:
+    """authenticate accounts concurrently, accounts that fail to authenticate are reported and left
+    out. Tokens are refreshed transparently once logged out, see auth.TokenManager
+
+    Args:
+        accounts (List[Account]): accounts to authenticate
+        max_workers (int): accounts authenticated concurrently
+        token_cache (Optional[TokenCache]): reuse tokens cached by previous runs
+
+    Returns:
+        List[Tuple[Account, str]]: list of (account, BbRouter)
+    """
+
+    def auth(account: Account) -> Optional[str]:
+        try:
+            manager = TokenManager(account.username, account.password, token_cache, authenticate)
+            return manager.get_token()
+        except Exception as e:
+            print("Failed to authenticate {}: {}".format(account.username, e))
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        bbrouters = list(executor.map(auth, accounts))
+    return [(a, b) for a, b in zip(accounts, bbrouters) if b is not None]
+
+
+def mirror_tree(src_dir: str, dst_dir: str):
+    """hard link every downloaded file under src_dir into the same relative path under dst_dir.
+    Partial downloads and dummy files are skipped
+
+    Args:
+        src_dir (str): source directory
+        dst_dir (str): destination directory
+    """
+    for root, _dirs, files in os.walk(src_dir):
+        for name in files:
+            if (
+                name.startswith(".")
+                or name.endswith(PART_FILE_SUFFIX)
+                or name.endswith(PART_VALIDATORS_SUFFIX)
+                or name.endswith(SEGMENT_JOURNAL_SUFFIX)
+            ):
+                continue
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_dir, os.path.relpath(src, src_dir))
+            if not os.path.exists(dst):
+                link_file(src, dst)
+
+
+def batch_sync(
+    accounts: List[Account],
+    include_course: Callable[[str], bool] = lambda name: True,
+    crawl_workers: int = 1,
+    auth_workers: int = DEFAULT_AUTH_WORKERS,
+    ignore_files: bool = False,
+    ignore_recorded_lectures: bool = False,
+    blob_index: Optional[Union[BlobIndex, BlobStore]] = None,
+    token_cache: Optional[TokenCache] = None,
+    link_cache: Optional[LinkCache] = None,
+    storage_backend: Optional[str] = None,
+    **scheduler_kwargs
+) -> DownloadStats:
+    """sync every account, downloading each distinct course and file once
+
+    Args:
+        accounts (List[Account]): accounts to sync
+        include_course (Callable[[str], bool]): return False for course names to skip
+        crawl_workers (int): folders fetched concurrently per course, see api.iter_download_dir
+        auth_workers (int): accounts authenticated concurrently
+        ignore_files (bool): skip file nodes
+        ignore_recorded_lectures (bool): skip recorded_lecture nodes
+        blob_index (Union[BlobIndex, BlobStore]): index of downloaded files shared by every
+            course, defaults to a new in memory BlobIndex
+        token_cache (Optional[TokenCache]): reuse tokens cached by previous runs
+        link_cache (Optional[LinkCache]): resolved download links shared by every course, saved
+            after each course
+        storage_backend (Optional[str]): one of storage.STORAGE_BACKENDS, if set every course is
+            merged with and saved to the storage of its download directory
+        scheduler_kwargs: passed to DownloadScheduler
+
+    Returns:
+        DownloadStats: combined stats of every course
+    """
+    authenticated = authenticate_accounts(accounts, auth_workers, token_cache)
+
+    # course_id -> (course name, accounts enrolled with their BbRouter)
+    courses: Dict[str, Tuple[str, List[Tuple[Account, str]]]] = OrderedDict()
+    with ThreadPoolExecutor(max_workers=auth_workers) as executor:
+        account_courses = executor.map(lambda ab: get_courses(ab[1]), authenticated)
+        for (account, bbrouter), enrolled in zip(authenticated, account_courses):
+            for name, course_id in enrolled:
+                if include_course(name):
+                    courses.setdefault(course_id, (name, []))[1].append(
+                        (account, bbrouter)
+                    )
+
+    blob_index = blob_index or BlobIndex()
+    stats = DownloadStats()
+    # download directory -> its storage
+    storages: Dict[str, Union[Storage, SQLiteStorage]] = {}
+    for course_id, (name, enrolled) in courses.items():
+        (account, bbrouter), others = enrolled[0], enrolled[1:]
+        print("{} ({} accounts)".format(name, len(enrolled)))
+        storage = None
+        if storage_backend:
+            if account.download_to not in storages:
+                storages[account.download_to] = open_storage(account.download_to, storage_backend)
+            storage = storages[account.download_to]
+        scheduler = DownloadScheduler(
+            bbrouter,
+            blob_index=blob_index,
+            stats=stats,
+            link_cache=link_cache,
+            storage=storage,
+            **scheduler_kwargs
+        )
+        if storage:
+            course_folder = get_download_dir(bbrouter, name, course_id, max_workers=crawl_workers)
+            storage.merge_download_dir([course_folder])
+            scheduler.run(
+                get_download_jobs(
+                    course_folder, account.download_to, ignore_files, ignore_recorded_lectures
+                )
+            )
+            storage.save_course(course_folder)
+        else:
+            nodes = iter_download_dir(
+                bbrouter, name, course_id, account.download_to, crawl_workers
+            )
+            scheduler.run(iter_download_jobs(nodes, ignore_files, ignore_recorded_lectures))
+        if link_cache:
+            link_cache.save()
+
+        course_dir = os.path.join(account.download_to, sanitise_filename(name))
+        for other, _bbrouter in others:
+            mirror_tree(course_dir, os.path.join(other.download_to, sanitise_filename(name)))
+
+    if token_cache:
+        for account, _bbrouter in authenticated:
+            token_cache.touch(account.username)
+    return stats
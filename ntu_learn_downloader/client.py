@@ -0,0 +1,301 @@
+"""
+Client: shared HTTP client used by every request the package makes.
+
+A single requests.Session owns one keep-alive connection pool (and one retry policy), so repeated
+requests to NTULearn reuse connections instead of doing a fresh TCP + TLS handshake each time.
+Requests are authenticated by passing the BbRouter cookie explicitly, so the shared session does
+not store cookies from responses. Every request is recorded in the package level metrics under the
+endpoint category passed by the caller (see metrics.py).
+
+Tokens registered with register_token are refreshed transparently: when a request made with one
+comes back logged out, the token's refresh function is called and the request is sent again with
+the new token, which is then used in place of the stale one for every later request.
+
+With a RateLimiter, requests to each host are throttled (see ratelimit.py) and GET and HEAD requests
+that are throttled by the server (429 or 5xx) are sent again once the host's pause is over. A
+streamed response keeps its concurrency slot until it is closed, so configure_client's pool_size
+bounds the connections to each host used by crawling and downloading together. Streamed responses
+must therefore be closed (e.g. used as a context manager) before making another request.
+"""
+import time
+from http.cookiejar import DefaultCookiePolicy
+from threading import Lock
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from ntu_learn_downloader.metrics import OTHER, get_metrics
+from ntu_learn_downloader.ratelimit import DEFAULT_RATE, HostLimiter, RateLimiter, is_throttled
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+# times a throttled request is sent again
+DEFAULT_THROTTLE_RETRIES = 3
+RETRIED_METHODS = ("GET", "HEAD")
+
+# NTULearn redirects requests without a valid BbRouter to one of these
+LOGIN_PATHS = ("/webapps/login", "/auth-saml/saml/login")
+
+
+class Client:
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        retries: int = DEFAULT_RETRIES,
+        backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+        rate_limiter: Optional[RateLimiter] = None,
+        throttle_retries: int = DEFAULT_THROTTLE_RETRIES,
+    ):
+        """
+        Args:
+            pool_size (int): maximum number of connections kept alive per host
+            retries (int): number of times a failed connection is retried
+            backoff_factor (float): backoff factor between retries
+            rate_limiter (Optional[RateLimiter]): throttles requests per host, no throttling if None
+            throttle_retries (int): number of times a GET or HEAD request throttled by the server
+                is sent again, only with a rate_limiter
+        """
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        self.throttle_retries = throttle_retries
+        # with a rate limiter, Retry-After is honoured by the limiter so that it pauses the host
+        retry = Retry(
+            connect=retries,
+            backoff_factor=backoff_factor,
+            respect_retry_after_header=rate_limiter is None,
+        )
+        self.adapter = HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+        )
+        self.session = self.new_session()
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # token -> function returning a new token once it is logged out
+        self.token_refreshers: Dict[str, Callable[[str], str]] = {}
+        # stale token -> token it was refreshed to
+        self.refreshed_tokens: Dict[str, str] = {}
+        self.token_lock = Lock()
+
+    def new_session(self) -> requests.Session:
+        """create a session that keeps its own cookies but shares the connection pool, used for
+        the authentication flow which relies on cookies being set between requests. Pass it to
+        request as session so its requests are still rate limited and recorded
+
+        Returns:
+            requests.Session -- session mounted with the shared adapter
+        """
+        session = requests.Session()
+        session.mount("http://", self.adapter)
+        session.mount("https://", self.adapter)
+        return session
+
+    def register_token(self, BbRouter: str, refresh: Callable[[str], str]):
+        """refresh BbRouter with refresh(BbRouter) when a request made with it is logged out
+
+        Args:
+            BbRouter (str): authentication token
+            refresh (Callable[[str], str]): returns a new token given the logged out one
+        """
+        with self.token_lock:
+            self.token_refreshers[BbRouter] = refresh
+
+    def current_token(self, BbRouter: str) -> str:
+        """return the token BbRouter has been refreshed to, BbRouter itself if it has not been"""
+        with self.token_lock:
+            while BbRouter in self.refreshed_tokens:
+                BbRouter = self.refreshed_tokens[BbRouter]
+            return BbRouter
+
+    def refresh_token(self, BbRouter: str) -> Optional[str]:
+        """refresh a logged out token, None if it was not registered"""
+        with self.token_lock:
+            refresh = self.token_refreshers.get(BbRouter)
+        if refresh is None:
+            return None
+        new_token = refresh(BbRouter)
+        with self.token_lock:
+            if new_token != BbRouter:
+                self.refreshed_tokens[BbRouter] = new_token
+                self.token_refreshers.setdefault(new_token, refresh)
+        return new_token
+
+    def get(self, url: str, category: str = OTHER, **kwargs) -> requests.Response:
+        return self.request("GET", url, category, **kwargs)
+
+    def head(self, url: str, category: str = OTHER, **kwargs) -> requests.Response:
+        return self.request("HEAD", url, category, **kwargs)
+
+    def post(self, url: str, category: str = OTHER, **kwargs) -> requests.Response:
+        return self.request("POST", url, category, **kwargs)
+
+    def request(
+        self, method: str, url: str, category: str = OTHER, **kwargs
+    ) -> requests.Response:
+        """make a request with the shared session and record it in the metrics. A request made with
+        a registered BbRouter cookie that comes back logged out is sent again with a refreshed token
+
+        Args:
+            method (str): HTTP method
+            url (str): url
+            category (str): endpoint category the request is recorded under, see metrics.py
+            kwargs: passed to requests.Session.request, except session: a session from
+                new_session to send the request with instead of the shared one
+
+        Returns:
+            requests.Response: response, the body is not read if stream=True
+        """
+        cookies = kwargs.get("cookies")
+        token = cookies.get("BbRouter") if cookies else None
+        if token is None:
+            return self.send(method, url, category, **kwargs)
+
+        token = self.current_token(token)
+        kwargs["cookies"] = dict(cookies, BbRouter=token)
+        response = self.send(method, url, category, **kwargs)
+        if not is_logged_out(response):
+            return response
+        new_token = self.refresh_token(token)
+        if new_token is None or new_token == token:
+            return response
+        response.close()
+        kwargs["cookies"] = dict(cookies, BbRouter=new_token)
+        return self.send(method, url, category, **kwargs)
+
+    def send(self, method: str, url: str, category: str = OTHER, **kwargs) -> requests.Response:
+        if self.rate_limiter is None:
+            return self.send_once(method, url, category, **kwargs)
+        limiter = self.rate_limiter.get_host_limiter(url)
+        attempt = 0
+        while True:
+            started = limiter.acquire()
+            try:
+                response = self.send_once(method, url, category, **kwargs)
+            except requests.RequestException:
+                limiter.release(started, None)
+                raise
+            done = (
+                not is_throttled(response.status_code)
+                or method not in RETRIED_METHODS
+                or attempt >= self.throttle_retries
+            )
+            if done and kwargs.get("stream"):
+                limiter.release(started, response, keep_slot=True)
+                release_slot_on_close(response, limiter)
+                return response
+            limiter.release(started, response)
+            if done:
+                return response
+            # the host is paused until the response's Retry-After, acquire waits it out
+            response.close()
+            attempt += 1
+
+    def send_once(
+        self, method: str, url: str, category: str = OTHER, **kwargs
+    ) -> requests.Response:
+        session = kwargs.pop("session", None) or self.session
+        metrics = get_metrics()
+        if metrics is None:
+            return session.request(method, url, **kwargs)
+        start = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            metrics.record_request(category, time.perf_counter() - start, None)
+            raise
+        seconds = time.perf_counter() - start
+        # bytes of streamed bodies are recorded by the caller once read
+        num_bytes = 0 if kwargs.get("stream") else len(response.content)
+        metrics.record_request(
+            category, seconds, response.status_code, num_bytes, get_retries(response)
+        )
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+def release_slot_on_close(response: requests.Response, limiter: HostLimiter):
+    """free the concurrency slot of a streamed response once it is closed"""
+    close = response.close
+    lock = Lock()
+    released = []
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            with lock:
+                if not released:
+                    released.append(True)
+                    limiter.release_slot()
+
+    response.close = close_and_release  # type: ignore
+
+
+def is_logged_out(response: requests.Response) -> bool:
+    """whether NTULearn rejected the BbRouter a request was made with"""
+    if response.status_code == 401:
+        return True
+    if response.is_redirect:
+        location = urlparse(response.headers.get("Location", "")).path
+        if location.startswith(LOGIN_PATHS):
+            return True
+    # followed redirects end on the login page
+    return urlparse(response.url).path.startswith(LOGIN_PATHS)
+
+
+def get_retries(response: requests.Response) -> int:
+    # urllib3 keeps the retries made for a request on its raw response, count them for every
+    # redirect followed too
+    return sum(
+        len(r.raw.retries.history)
+        for r in response.history + [response]
+        if getattr(r.raw, "retries", None) is not None
+    )
+
+
+_client: Optional[Client] = None
+_client_lock = Lock()
+
+
+def get_client() -> Client:
+    """return the package level client, creating it with default settings if needed"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client()
+        return _client
+
+
+def set_client(client: Client):
+    """replace the package level client, the previous client is closed"""
+    global _client
+    with _client_lock:
+        if _client is not None and _client is not client:
+            _client.close()
+        _client = client
+
+
+def configure_client(
+    pool_size: int = DEFAULT_POOL_SIZE,
+    retries: int = DEFAULT_RETRIES,
+    backoff_factor: float = DEFAULT_BACKOFF_FACTOR,
+    rate_limit: Optional[float] = DEFAULT_RATE,
+) -> Client:
+    """create a client with the given settings and use it for all subsequent requests
+
+    Args:
+        rate_limit (Optional[float]): requests per second to each host, None or 0 to only adapt
+            concurrency and back off when throttled, see ratelimit.RateLimiter
+    """
+    client = Client(
+        pool_size=pool_size,
+        retries=retries,
+        backoff_factor=backoff_factor,
+        rate_limiter=RateLimiter(rate=rate_limit, max_concurrency=pool_size),
+    )
+    set_client(client)
+    return client
@@ -0,0 +1,100 @@
+"""
+Crawler: loads the content tree of a course concurrently.
+
+Folder.serialize loads sub folders one at a time (depth first). The crawler instead submits every
+unloaded folder to a bounded thread pool as soon as its parent has been loaded, so sibling folders
+are fetched concurrently and a course takes roughly as long as its longest chain of folders. The
+resulting tree is identical, so Folder.serialize afterwards makes no further network calls.
+
+iter_folder_tree yields every folder as soon as its page has been parsed, so callers can start
+downloading its files while the rest of the course is still being crawled.
+"""
+import os
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+from typing import Iterator, List, Tuple
+
+from ntu_learn_downloader.models import Folder, MODEL_TYPES
+from ntu_learn_downloader.utils import sanitise_filename
+
+DEFAULT_MAX_WORKERS = 8
+
+
+def get_unloaded_folders(nodes: List[MODEL_TYPES]) -> List[Folder]:
+    """return folders (searching recursively through already loaded folders) whose children have
+    not been fetched yet
+
+    Arguments:
+        nodes {List[MODEL_TYPES]} -- list of Folder, Doc and RecordedLecture objects
+
+    Returns:
+        List[Folder] -- folders with children set to None
+    """
+    result: List[Folder] = []
+    for node in nodes:
+        if not isinstance(node, Folder):
+            continue
+        if node.children is None:
+            result.append(node)
+        else:
+            result.extend(get_unloaded_folders(node.children))
+    return result
+
+
+def load_folder_tree(BbRouter: str, folder: Folder, executor: Executor):
+    """load every folder under folder using the executor, sibling folders are loaded concurrently
+
+    Arguments:
+        BbRouter {str} -- authentication token
+        folder {Folder} -- root folder, mutated in place
+        executor {Executor} -- bounded pool used to fetch folders
+    """
+
+    for _path, _folder in iter_folder_tree(BbRouter, [folder], "", executor):
+        pass
+
+
+def iter_folder_tree(
+    BbRouter: str, folders: List[Folder], download_path: str, executor: Executor
+) -> Iterator[Tuple[str, Folder]]:
+    """load every folder under folders using the executor, yielding each folder (including folders
+    and their sub folders) once its children are loaded
+
+    Arguments:
+        BbRouter {str} -- authentication token
+        folders {List[Folder]} -- root folders, mutated in place
+        download_path {str} -- directory the root folders are downloaded to
+        executor {Executor} -- bounded pool used to fetch folders
+
+    Returns:
+        Iterator[Tuple[str, Folder]] -- (directory the folder is downloaded to, loaded folder), in
+        the order pages are loaded, see scheduler.get_download_jobs for the directory layout
+    """
+    pending = set()
+
+    def load(parent_path: str, f: Folder) -> Tuple[str, Folder]:
+        f.load_children(BbRouter)
+        return parent_path, f
+
+    def visit(parent_path: str, f: Folder) -> List[Tuple[str, Folder]]:
+        # submit unloaded sub folders, return f and its already loaded sub folders
+        path = os.path.join(parent_path, sanitise_filename(f.name), "")
+        result = [(path, f)]
+        for c in f.children or []:
+            if not isinstance(c, Folder):
+                continue
+            if c.children is None:
+                pending.add(executor.submit(load, path, c))
+            else:
+                result.extend(visit(path, c))
+        return result
+
+    for f in folders:
+        if f.children is None:
+            pending.add(executor.submit(load, download_path, f))
+        else:
+            yield from visit(download_path, f)
+    while pending:
+        done, _not_done = wait(pending, return_when=FIRST_COMPLETED)
+        pending.difference_update(done)
+        for future in done:
+            yield from visit(*future.result())
@@ -0,0 +1,246 @@
+"""
+Metrics: latency, bytes, status codes and retries of every request by endpoint category, and time
+spent parsing pages.
+
+Client records each request it makes under the category passed by the caller, streamed downloads add
+their bytes once the body has been written. Parsing functions record their time with timed_parse.
+The package level Metrics can be replaced with set_metrics, e.g. with a subclass that forwards to
+another monitoring system, or None to stop recording.
+"""
+import functools
+import json
+import time
+from collections import defaultdict
+from threading import Lock
+from typing import Callable, Dict, List, Optional
+
+# endpoint categories
+COURSES = "courses"
+CONTENT_IDS = "content_ids"
+LIST_CONTENT = "list_content"
+HEAD_REDIRECT = "head_redirect"
+ACUSTUDIO = "acustudio"
+BLOB_DOWNLOAD = "blob_download"
+AUTH = "auth"
+OTHER = "other"
+
+# upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf")]
+
+METRIC_PREFIX = "ntu_learn"
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.statuses: Dict[int, int] = defaultdict(int)
+        self.buckets: List[int] = [0] * len(LATENCY_BUCKETS)
+
+    def to_dict(self) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "retries": self.retries,
+            "bytes": self.bytes,
+            "seconds": self.seconds,
+            "mean_seconds": self.seconds / self.count if self.count else 0.0,
+            "max_seconds": self.max_seconds,
+            "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+        }
+
+
+class ParseMetrics:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def to_dict(self) -> Dict:
+        return {"count": self.count, "seconds": self.seconds}
+
+
+class Metrics:
+    """thread safe store of request and parse metrics"""
+
+    def __init__(self):
+        self.requests: Dict[str, RequestMetrics] = defaultdict(RequestMetrics)
+        self.parses: Dict[str, ParseMetrics] = defaultdict(ParseMetrics)
+        self.lock = Lock()
+
+    def record_request(
+        self,
+        category: str,
+        seconds: float,
+        status: Optional[int],
+        num_bytes: int = 0,
+        retries: int = 0,
+    ):
+        """
+        Args:
+            category (str): endpoint category, e.g. LIST_CONTENT
+            seconds (float): time until the response headers (and body, unless streamed) arrived
+            status (Optional[int]): status code, None if no response was received
+            num_bytes (int): size of the response body, if already read
+            retries (int): number of times the request was retried
+        """
+        with self.lock:
+            m = self.requests[category]
+            m.count += 1
+            m.seconds += seconds
+            m.max_seconds = max(m.max_seconds, seconds)
+            m.bytes += num_bytes
+            m.retries += retries
+            if status is None or status >= 400:
+                m.errors += 1
+            m.statuses[status or 0] += 1
+            for i, upper_bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= upper_bound:
+                    m.buckets[i] += 1
+                    break
+
+    def record_bytes(self, category: str, num_bytes: int):
+        """add bytes of a streamed response body once it has been read"""
+        with self.lock:
+            self.requests[category].bytes += num_bytes
+
+    def record_parse(self, page: str, seconds: float):
+        with self.lock:
+            m = self.parses[page]
+            m.count += 1
+            m.seconds += seconds
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "requests": {k: v.to_dict() for k, v in sorted(self.requests.items())},
+                "parses": {k: v.to_dict() for k, v in sorted(self.parses.items())},
+            }
+
+    def to_prometheus(self) -> str:
+        """metrics in the Prometheus text exposition format"""
+        lines: List[str] = []
+
+        def metric(name: str, metric_type: str, help_text: str):
+            lines.append("# HELP {}_{} {}".format(METRIC_PREFIX, name, help_text))
+            lines.append("# TYPE {}_{} {}".format(METRIC_PREFIX, name, metric_type))
+
+        def sample(name: str, labels: Dict[str, str], value):
+            label_str = ",".join('{}="{}"'.format(k, v) for k, v in labels.items())
+            lines.append("{}_{}{{{}}} {}".format(METRIC_PREFIX, name, label_str, value))
+
+        with self.lock:
+            requests = sorted(self.requests.items())
+            parses = sorted(self.parses.items())
+
+            metric("requests_total", "counter", "Requests by endpoint category and status code")
+            for category, m in requests:
+                for status, count in sorted(m.statuses.items()):
+                    sample("requests_total", {"category": category, "status": str(status)}, count)
+
+            metric("request_duration_seconds", "histogram", "Request latency by endpoint category")
+            for category, m in requests:
+                cumulative = 0
+                for upper_bound, count in zip(LATENCY_BUCKETS, m.buckets):
+                    cumulative += count
+                    le = "+Inf" if upper_bound == float("inf") else str(upper_bound)
+                    sample(
+                        "request_duration_seconds_bucket",
+                        {"category": category, "le": le},
+                        cumulative,
+                    )
+                sample("request_duration_seconds_sum", {"category": category}, m.seconds)
+                sample("request_duration_seconds_count", {"category": category}, m.count)
+
+            metric("response_bytes_total", "counter", "Response body bytes by endpoint category")
+            for category, m in requests:
+                sample("response_bytes_total", {"category": category}, m.bytes)
+
+            metric("request_retries_total", "counter", "Retried requests by endpoint category")
+            for category, m in requests:
+                sample("request_retries_total", {"category": category}, m.retries)
+
+            metric("parse_duration_seconds", "summary", "Time spent parsing pages")
+            for page, p in parses:
+                sample("parse_duration_seconds_sum", {"page": page}, p.seconds)
+                sample("parse_duration_seconds_count", {"page": page}, p.count)
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """write metrics to path, as JSON if it ends with .json else in the Prometheus format"""
+        with open(path, "w") as f:
+            if path.endswith(".json"):
+                json.dump(self.to_dict(), f, indent=4)
+            else:
+                f.write(self.to_prometheus())
+
+    def summary(self) -> str:
+        data = self.to_dict()
+        lines = [
+            "{:<18} {:>8} {:>7} {:>8} {:>12} {:>10} {:>10}".format(
+                "category", "requests", "errors", "retries", "bytes", "mean (s)", "max (s)"
+            )
+        ]
+        for category, m in data["requests"].items():
+            lines.append(
+                "{:<18} {:>8} {:>7} {:>8} {:>12} {:>10.3f} {:>10.3f}".format(
+                    category,
+                    m["count"],
+                    m["errors"],
+                    m["retries"],
+                    m["bytes"],
+                    m["mean_seconds"],
+                    m["max_seconds"],
+                )
+            )
+        for page, p in data["parses"].items():
+            lines.append(
+                "{:<18} {:>8} {:>29} {:>10.3f}".format(
+                    "parse " + page, p["count"], "", p["seconds"] / p["count"]
+                )
+            )
+        return "\n".join(lines)
+
+
+_metrics: Optional[Metrics] = Metrics()
+
+
+def get_metrics() -> Optional[Metrics]:
+    """return the package level metrics, None if recording is disabled"""
+    return _metrics
+
+
+def set_metrics(metrics: Optional[Metrics]):
+    """replace the package level metrics, None stops recording"""
+    global _metrics
+    _metrics = metrics
+
+
+def record_bytes(category: str, num_bytes: int):
+    """add bytes of a streamed response body to the package level metrics, if recording"""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.record_bytes(category, num_bytes)
+
+
+def timed_parse(page: str) -> Callable:
+    """decorator recording the time taken by a parsing function under page"""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics = get_metrics()
+                if metrics is not None:
+                    metrics.record_parse(page, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
@@ -1,27 +1,30 @@
 from typing import List, Union, Dict
 
 from ntu_learn_downloader import api
-from ntu_learn_downloader.parsing import parse_content_page
-from ntu_learn_downloader.utils import (
-    get_ids_from_listContent_url,
-    get_predownload_link,
-)
+from ntu_learn_downloader.parsing import parse_content_html
+from ntu_learn_downloader.smodels import SDoc, SFolder, SLecture
+from ntu_learn_downloader.urls import get_ids_from_listContent_url
+from ntu_learn_downloader.utils import get_predownload_link
 
 
 class Base:
+    # nodes have no __dict__, a course tree holds one of these per file and folder
+    __slots__ = ()
+
     def __repr__(self):
         return (
             self.__class__.__name__
             + "("
             + ",\n\t".join(
-                ["{}= {}".format(k, v.__repr__()) for k, v in self.__dict__.items()]
+                ["{}= {}".format(k, getattr(self, k).__repr__()) for k in self.__slots__]
             )
             + ")"
         )
 
     def __eq__(self, other):
-        return self.__class__.__name__ == other.__class__.__name__ and all(
-            other.__dict__[k] == v for k, v in self.__dict__.items()
+        # children are compared by list equality, which recurses into them
+        return self.__class__ is other.__class__ and all(
+            getattr(other, k) == getattr(self, k) for k in self.__slots__
         )
 
     def serialize(self, BbRouter: str) -> Dict:
@@ -29,6 +32,8 @@ class Base:
 
 
 class Folder(Base):
+    __slots__ = ("name", "link", "details", "children")
+
     def __init__(self, name, link, details, children=None):
         self.name = name
         self.link = link
@@ -44,8 +49,8 @@ class Folder(Base):
         children: List[MODEL_TYPES] = []
         if course_content_id is not None:
             course_id, content_id = course_content_id
-            soup = api.make_get_contents_request(BbRouter, course_id, content_id)
-            children = [to_model(c) for c in parse_content_page(soup)]
+            html = api.make_get_contents_html_request(BbRouter, course_id, content_id)
+            children = [to_model(c) for c in parse_content_html(html)]
         self.children = children
 
     def serialize(self, BbRouter: str) -> Dict:
@@ -60,15 +65,10 @@ class Folder(Base):
             else [],
         }
 
-    def __eq__(self, other):
-        # compare atttribute and recursively check the children
-        return Base.__eq__(self, other) and (
-            (self.children is None and other.children is None)
-            or all(c1 == c2 for c1, c2 in zip(self.children, other.children))
-        )
-
 
 class Doc(Base):
+    __slots__ = ("name", "link")
+
     def __init__(self, name, link):
         # links come in as a relative path, so when serializing, need to convert to full path to
         # predownload link (need redirect to get final download link)
@@ -81,6 +81,8 @@ class Doc(Base):
 
 
 class RecordedLecture(Base):
+    __slots__ = ("name", "predownload_link")
+
     def __init__(self, name, predownload_link):
         self.name = name
         self.predownload_link = predownload_link
@@ -96,19 +98,26 @@ class RecordedLecture(Base):
 MODEL_TYPES = Union[Folder, Doc, RecordedLecture]
 
 
+def folder_from_smodel(smodel: SFolder) -> Folder:
+    return Folder(
+        smodel.name,
+        smodel.link,
+        smodel.details,
+        [to_model(c) for c in smodel.children] if smodel.children else None,
+    )
+
+
+# parse result type -> constructor of its model, the parse results of a page are dropped once
+# converted so a crawled tree is only held as models
+SMODEL_CONVERTERS = {
+    SFolder: folder_from_smodel,
+    SDoc: lambda smodel: Doc(smodel.name, smodel.link),
+    SLecture: lambda smodel: RecordedLecture(smodel.name, smodel.link),
+}
+
+
 def to_model(smodel) -> MODEL_TYPES:
-    classname = smodel.__class__.__name__
-    if classname == "SFolder":
-        return Folder(
-            name=smodel.name,
-            link=smodel.link,
-            details=smodel.details,
-            children=[to_model(c) for c in smodel.children]
-            if smodel.children
-            else None,
-        )
-    elif classname == "SDoc":
-        return Doc(name=smodel.name, link=smodel.link)
-    elif classname == "SLecture":
-        return RecordedLecture(name=smodel.name, predownload_link=smodel.link)
-    raise Exception("unexpcted type")
+    converter = SMODEL_CONVERTERS.get(type(smodel))
+    if converter is None:
+        raise Exception("unexpcted type")
+    return converter(smodel)
@@ -1,19 +1,98 @@
 from ntu_learn_downloader.smodels import SDoc, SFolder, SLecture
+import bs4
 from bs4 import BeautifulSoup
-import re
-from typing import List, Union
-from ntu_learn_downloader.utils import is_download_link
+import lxml.html
+from typing import List, Optional, Tuple, Union
+from ntu_learn_downloader.urls import (
+    get_content_id_from_listContent_url,
+    get_course_id_from_link,
+    is_download_link,
+    parse_acustudio_page,
+)
 from ntu_learn_downloader.constants import GET_CONTENT_LIST_URL
+from ntu_learn_downloader.metrics import ACUSTUDIO, CONTENT_IDS, COURSES, LIST_CONTENT, timed_parse
 
-def parse_recorded_lecture_contents(html: str) -> str:
-    m1 = re.search(r'var gsUserId\s+= "(\S+)";', html)
-    m2 = re.search(r'var gsModuleId\s+= "(\S+)";', html)
-    m3 = re.search(r'addStreamInfo\("\S+", "(\S+)", "", "", "", "as"\)', html)
+# "bs4" builds a BeautifulSoup tree (default), "lxml" extracts the same results directly from an
+# lxml.html tree which is considerably faster on large listContent pages
+PARSER_BACKENDS = ["bs4", "lxml"]
+parser_backend = "bs4"
+
+
+def set_parser_backend(backend: str):
+    """select the backend used by the parse_*_html functions
+
+    Args:
+        backend (str): one of PARSER_BACKENDS
+    """
+    global parser_backend
+    if backend not in PARSER_BACKENDS:
+        raise ValueError(
+            "unknown parser backend: {}, expected one of {}".format(backend, PARSER_BACKENDS)
+        )
+    parser_backend = backend
+
+
+@timed_parse(COURSES)
+def parse_courses_html(html: Union[str, bytes]) -> List[Tuple[str, str]]:
+    if parser_backend == "lxml":
+        return lxml_parse_courses_page(lxml.html.document_fromstring(html))
+    return parse_courses_page(BeautifulSoup(html, features="lxml"))
+
+
+@timed_parse(CONTENT_IDS)
+def parse_content_ids_html(html: Union[str, bytes]) -> List[Tuple[str, str]]:
+    if parser_backend == "lxml":
+        return lxml_parse_content_ids_page(lxml.html.document_fromstring(html))
+    return parse_content_ids_page(BeautifulSoup(html, features="lxml"))
+
+
+@timed_parse(LIST_CONTENT)
+def parse_content_html(html: Union[str, bytes]) -> List[Union[SDoc, SFolder, SLecture]]:
+    if parser_backend == "lxml":
+        return lxml_parse_content_page(lxml.html.document_fromstring(html))
+    return parse_content_page(BeautifulSoup(html, features="lxml"))
+
+
+def parse_courses_page(soup) -> List[Tuple[str, str]]:
+    links = soup.find_all("a")
+
+    courses: List[Tuple[str, str]] = []
+    for link in links:
+        name = link.contents[0]
+        if isinstance(name, bs4.element.Tag):
+            name = name.text
+        # expect fullLink to be of form:
+        # link javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url='); return false;
+        fullLink = link.get("onclick")
+        course_id = get_course_id_from_link(fullLink)
+        if course_id is None:
+            print("Unable to parse link to get course id: {}".format(fullLink))
+            continue
+        courses.append((name, course_id))
+    return courses
 
-    if m1 is None or m2 is None or m3 is None:
+
+def parse_content_ids_page(soup) -> List[Tuple[str, str]]:
+    ll = soup.find("ul", {"id": "courseMenuPalette_contents"})
+    result: List[Tuple[str, str]] = []
+    for c in ll:
+        a = c.find("a")
+        if a is None:
+            continue
+        url = a.get("href")
+        name = a.text
+        content_id = get_content_id_from_listContent_url(url)
+        if content_id:
+            result.append((name, content_id))
+    return result
+
+
+@timed_parse(ACUSTUDIO)
+def parse_recorded_lecture_contents(html: str) -> str:
+    found = parse_acustudio_page(html)
+    if found is None:
         raise ValueError('Unable to get mp4 download link')
-    gsUserId, gsModuleId = m1.groups()[0], m2.groups()[0]
-    domain = m3.groups()[0]
+    gsUserId, gsModuleId, domain = found
     url = "https://" + domain + "/content/" + gsUserId + "/" + gsModuleId + "/media/1.mp4"
 
     return url
@@ -87,4 +166,114 @@ def __item_to_folder(item):
         children.append(SDoc(name=name.strip(), link=link))
     if children:
         return SFolder(name=folder_name.strip(), link=None, details="", children=children)
-    return None
\ No newline at end of file
+    return None
+
+
+# lxml backend, each function returns exactly what its BeautifulSoup counterpart above returns
+
+
+def _lxml_find(element, path: str):
+    found = element.xpath(path)
+    return found[0] if found else None
+
+
+_ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+
+
+def _lxml_text(element) -> str:
+    # same as Tag.text, BeautifulSoup collapses whitespace only strings to a newline or a space
+    return "".join(
+        t if t.strip(_ASCII_SPACES) else ("\n" if "\n" in t else " ")
+        for t in element.itertext()
+    )
+
+
+def _lxml_has_class(class_name: str) -> str:
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(class_name)
+
+
+def lxml_parse_courses_page(root) -> List[Tuple[str, str]]:
+    courses: List[Tuple[str, str]] = []
+    for link in root.iter("a"):
+        # first child of link, either text or a tag
+        if link.text is not None:
+            name = link.text
+        else:
+            first_child = next(link.iterchildren(), None)
+            name = _lxml_text(first_child) if first_child is not None else ""
+        fullLink = link.get("onclick")
+        course_id = get_course_id_from_link(fullLink)
+        if course_id is None:
+            print("Unable to parse link to get course id: {}".format(fullLink))
+            continue
+        courses.append((name, course_id))
+    return courses
+
+
+def lxml_parse_content_ids_page(root) -> List[Tuple[str, str]]:
+    ll = _lxml_find(root, '//ul[@id="courseMenuPalette_contents"]')
+    result: List[Tuple[str, str]] = []
+    for c in ll.iterchildren(tag=lxml.etree.Element):
+        a = _lxml_find(c, ".//a")
+        if a is None:
+            continue
+        content_id = get_content_id_from_listContent_url(a.get("href"))
+        if content_id:
+            result.append((_lxml_text(a), content_id))
+    return result
+
+
+def lxml_parse_content_page(root) -> List[Union[SDoc, SFolder, SLecture]]:
+    contentList = _lxml_find(root, '//ul[@id="content_listContainer"]')
+    if contentList is None:
+        return []
+
+    result: List[Union[SDoc, SFolder, SLecture]] = []
+    for c in contentList.iterchildren(tag=lxml.etree.Element):
+        img = _lxml_find(c, ".//img")
+        alt: Optional[str] = img.get("alt") if img is not None else None
+        if alt == "Content Folder":
+            hyperlink = _lxml_find(c, ".//a")
+            details = _lxml_find(c, ".//div[{}]".format(_lxml_has_class("details")))
+            result.append(
+                SFolder(
+                    _lxml_text(hyperlink).strip(),
+                    hyperlink.get("href").strip(),
+                    _lxml_text(details).strip(),
+                    None,
+                )
+            )
+        elif alt == "Item" or (
+            alt == "" and _lxml_find(c, './/div[@class="item clearfix"]') is not None
+        ):
+            folder = _lxml_item_to_folder(c)
+            if folder:
+                result.append(folder)
+        elif alt == "AcuStudio":
+            hyperlink = _lxml_find(c, ".//a")
+            result.append(SLecture(_lxml_text(hyperlink).strip(), hyperlink.get("href")))
+        elif alt == "File":
+            hyperlink = _lxml_find(c, ".//a")
+            # sometimes file link is broken, in that case no href tag is rendered
+            if hyperlink is None:
+                continue
+            result.append(SDoc(_lxml_text(hyperlink).strip(), hyperlink.get("href")))
+
+    return result
+
+
+def _lxml_item_to_folder(item):
+    folder_name = _lxml_text(_lxml_find(item, ".//h3"))
+    details = _lxml_find(
+        item,
+        ".//div[{} or {}]".format(_lxml_has_class("class"), _lxml_has_class("details")),
+    )
+
+    children = [
+        SDoc(name=_lxml_text(a).strip(), link=a.get("href"))
+        for a in details.iter("a")
+        if is_download_link(a.get("href") or "")
+    ]
+    if children:
+        return SFolder(name=folder_name.strip(), link=None, details="", children=children)
+    return None
@@ -0,0 +1,196 @@
+"""
+RateLimit: per host throttling of the requests made by Client.
+
+Every host gets a HostLimiter combining
+- a token bucket, allowing rate requests per second on average with bursts of up to burst requests
+- an adaptive limit on concurrent requests (AIMD): every successful request raises the limit by
+  1 / limit, i.e. by about one per round of requests, up to max_concurrency, and every throttled
+  request (429 or 5xx) halves it, down to min_concurrency. Only requests started after the last
+  decrease can decrease it again, so a burst of throttled responses halves it once
+- a pause after a throttled response, for as long as its Retry-After header asks or else an
+  exponential backoff, during which no request to the host is started
+
+A request holds its concurrency slot until its response is read, a streamed response (a download)
+until it is closed (see Client.send). max_concurrency, set from --pool_size, is therefore the budget
+of connections to a host shared by crawling and downloading, whatever the number of workers.
+"""
+import time
+from email.utils import parsedate_to_datetime
+from threading import Condition, Lock
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+import requests
+
+DEFAULT_RATE = 20.0
+DEFAULT_BURST = 20
+DEFAULT_MIN_CONCURRENCY = 1
+# backoff after a throttled response without Retry-After, doubled for every consecutive one
+DEFAULT_BACKOFF = 1.0
+MAX_BACKOFF = 60.0
+# longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 600.0
+
+THROTTLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def is_throttled(status: Optional[int]) -> bool:
+    return status in THROTTLE_STATUSES
+
+
+def get_retry_after(response: requests.Response) -> Optional[float]:
+    """return seconds to wait as asked by the Retry-After header, either a number of seconds or an
+    HTTP date, None if absent or malformed"""
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return min(max(0.0, retry_at.timestamp() - time.time()), MAX_RETRY_AFTER)
+
+
+class HostLimiter:
+    def __init__(
+        self,
+        rate: Optional[float] = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_concurrency: int = 10,
+        min_concurrency: int = DEFAULT_MIN_CONCURRENCY,
+        backoff: float = DEFAULT_BACKOFF,
+    ):
+        """
+        Args:
+            rate (Optional[float]): requests per second, None or 0 for no limit
+            burst (int): requests that can be made at once after being idle
+            max_concurrency (int): upper bound of the concurrency limit, which starts there
+            min_concurrency (int): lower bound of the concurrency limit
+            backoff (float): pause after the first throttled response without Retry-After
+        """
+        self.rate = rate or None
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.backoff = backoff
+        self.limit = float(max_concurrency)
+        self.active = 0
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.consecutive_throttles = 0
+        self.cond = Condition(Lock())
+
+    def acquire(self) -> float:
+        """block until a request can be started
+
+        Returns:
+            float: time the request was allowed to start, to pass to release
+        """
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.rate:
+                    self.tokens = min(
+                        float(self.burst), self.tokens + (now - self.updated) * self.rate
+                    )
+                    self.updated = now
+                wait = self.get_wait(now)
+                if wait is not None and wait <= 0:
+                    break
+                # woken up early by release if a slot frees up or the limit changes
+                self.cond.wait(wait)
+            self.active += 1
+            if self.rate:
+                self.tokens -= 1
+            return now
+
+    def get_wait(self, now: float) -> Optional[float]:
+        # seconds until a request may start, None if it has to wait for a running one to finish
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.active >= int(self.limit):
+            return None
+        if self.rate and self.tokens < 1:
+            return (1 - self.tokens) / self.rate
+        return 0
+
+    def release(
+        self, started: float, response: Optional[requests.Response], keep_slot: bool = False
+    ) -> Optional[float]:
+        """update the limits with the outcome of a request started by acquire
+
+        Args:
+            started (float): returned by acquire
+            response (Optional[requests.Response]): response, None if the request failed
+            keep_slot (bool): the response body is still being read, the request keeps its
+                concurrency slot until release_slot is called
+
+        Returns:
+            Optional[float]: seconds the host is paused for if the response was throttled, None
+                otherwise
+        """
+        status = response.status_code if response is not None else None
+        retry_after = get_retry_after(response) if response is not None else None
+        with self.cond:
+            if not keep_slot:
+                self.active -= 1
+            delay: Optional[float] = None
+            if status is None or is_throttled(status):
+                if started >= self.last_decrease:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self.last_decrease = time.monotonic()
+                if status is not None:
+                    self.consecutive_throttles += 1
+                    delay = retry_after
+                    if delay is None:
+                        delay = min(
+                            self.backoff * 2 ** (self.consecutive_throttles - 1), MAX_BACKOFF
+                        )
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+            else:
+                self.consecutive_throttles = 0
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            self.cond.notify_all()
+            return delay
+
+    def release_slot(self):
+        """free the concurrency slot kept by release(..., keep_slot=True)"""
+        with self.cond:
+            self.active -= 1
+            self.cond.notify_all()
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: Optional[float] = DEFAULT_RATE,
+        burst: int = DEFAULT_BURST,
+        max_concurrency: int = 10,
+        min_concurrency: int = DEFAULT_MIN_CONCURRENCY,
+        backoff: float = DEFAULT_BACKOFF,
+    ):
+        """HostLimiter per host, created with these arguments on the first request to the host"""
+        self.kwargs = dict(
+            rate=rate,
+            burst=burst,
+            max_concurrency=max_concurrency,
+            min_concurrency=min_concurrency,
+            backoff=backoff,
+        )
+        self.hosts: Dict[str, HostLimiter] = {}
+        self.lock = Lock()
+
+    def get_host_limiter(self, url: str) -> HostLimiter:
+        host = urlparse(url).netloc.lower()
+        with self.lock:
+            limiter = self.hosts.get(host)
+            if limiter is None:
+                limiter = self.hosts[host] = HostLimiter(**self.kwargs)
+            return limiter
@@ -0,0 +1,685 @@
+"""
+Scheduler: downloads the files and recorded lectures of a download dir (see api.get_download_dir)
+concurrently.
+
+The tree is flattened into a list of jobs which are run by two pools of workers, one for files and
+one for recorded lectures, so that a few large lectures do not hold up the many small files. Jobs
+can also be streamed from api.iter_download_dir (see iter_download_jobs), in which case transfers
+start while the course is still being crawled. When downloads need to be confirmed, the prompts
+are gathered up front before any transfers start.
+
+Resolving a recorded lecture (fetching its AcuStudio page, then HEADing the video for its size) is
+slow, so LectureResolver resolves the next few lectures in the background while earlier ones are
+prompted for or downloaded.
+
+Checking whether every node was already downloaded (or declined, see utils.create_dummy_file) costs
+one or two stats per node, each a round trip on a network filesystem. FileIndex instead lists the
+destination tree once with os.scandir and answers those checks from memory.
+
+A file that exists counts as downloaded. With verify, it is only skipped if its size still matches
+the size recorded when it was downloaded (see Storage), and a HEAD of its download link reports
+the same size, ETag and Last-Modified. Otherwise it is downloaded again, which catches truncated
+and updated files. Recorded lectures are only checked by size.
+"""
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Lock
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from ntu_learn_downloader.api import (
+    get_file_download_link,
+    get_recorded_lecture_download_link,
+)
+from ntu_learn_downloader.storage import BlobStore, LinkCache, SQLiteStorage, Storage
+from ntu_learn_downloader.urls import get_blob_id
+from ntu_learn_downloader.utils import (
+    convert_size,
+    create_dummy_file,
+    download,
+    download_segmented,
+    dummy_file_exists,
+    get_dummy_file_path,
+    get_download_info,
+    get_file_validators,
+    get_filename_from_url,
+    get_remote_validators,
+    link_file,
+    sanitise_filename,
+)
+
+DEFAULT_FILE_WORKERS = 8
+DEFAULT_LECTURE_WORKERS = 2
+DEFAULT_LOOKAHEAD = 4
+
+# node: file or recorded_lecture dict, download_path: directory the node is downloaded to,
+# download_link, size (bytes) and accepts_ranges are set if the recorded lecture was resolved
+# while prompting
+DownloadJob = namedtuple(
+    "DownloadJob", "node download_path download_link size accepts_ranges"
+)
+
+
+def get_download_jobs(
+    obj: Dict,
+    download_path: str,
+    ignore_files: bool = False,
+    ignore_recorded_lectures: bool = False,
+) -> List[DownloadJob]:
+    """flatten download dir into a list of download jobs
+
+    Args:
+        obj (Dict): folder, file or recorded_lecture dict from api.get_download_dir
+        download_path (str): directory to download obj to
+        ignore_files (bool): skip file nodes
+        ignore_recorded_lectures (bool): skip recorded_lecture nodes
+
+    Returns:
+        List[DownloadJob]: jobs in the same order as the tree is traversed
+    """
+    if obj["type"] == "folder":
+        download_path = os.path.join(download_path, sanitise_filename(obj["name"]), "")
+        jobs: List[DownloadJob] = []
+        for c in obj["children"]:
+            jobs.extend(
+                get_download_jobs(c, download_path, ignore_files, ignore_recorded_lectures)
+            )
+        return jobs
+    elif obj["type"] == "file":
+        return [] if ignore_files else [DownloadJob(obj, download_path, None, None, False)]
+    elif obj["type"] == "recorded_lecture":
+        if ignore_recorded_lectures:
+            return []
+        return [DownloadJob(obj, download_path, None, None, False)]
+    return []
+
+
+def iter_download_jobs(
+    nodes: Iterable[Tuple[str, Dict]],
+    ignore_files: bool = False,
+    ignore_recorded_lectures: bool = False,
+) -> Iterator[DownloadJob]:
+    """convert (download path, node) pairs, e.g. from api.iter_download_dir, into download jobs
+
+    Args:
+        nodes (Iterable[Tuple[str, Dict]]): directory and file or recorded_lecture dict
+        ignore_files (bool): skip file nodes
+        ignore_recorded_lectures (bool): skip recorded_lecture nodes
+
+    Returns:
+        Iterator[DownloadJob]: jobs in the same order as nodes
+    """
+    for download_path, node in nodes:
+        if node["type"] == "file" and ignore_files:
+            continue
+        if node["type"] == "recorded_lecture" and ignore_recorded_lectures:
+            continue
+        yield DownloadJob(node, download_path, None, None, False)
+
+
+def get_video_name(node: Dict) -> str:
+    # can infer video name without expensive call to get download link
+    return sanitise_filename(node["name"] + ".mp4")
+
+
+# download link, size (bytes, None if not available) and whether the server accepts byte ranges
+ResolvedLecture = namedtuple("ResolvedLecture", "download_link size accepts_ranges")
+
+
+class LectureResolver:
+    """resolves recorded lectures in the background, at most lookahead lectures ahead of those
+    claimed with get. Lectures are queued with add in the order they will be downloaded"""
+
+    def __init__(
+        self,
+        BbRouter: str,
+        lookahead: int = DEFAULT_LOOKAHEAD,
+        link_cache: Optional[LinkCache] = None,
+    ):
+        """
+        Args:
+            BbRouter (str): authentication token
+            lookahead (int): maximum number of lectures resolved but not yet claimed, 0 resolves
+                each lecture only when it is claimed
+            link_cache (LinkCache): if set, resolved lectures are cached in it
+        """
+        self.BbRouter = BbRouter
+        self.lookahead = lookahead
+        self.link_cache = link_cache
+        # queued nodes not yet submitted, and ids of those claimed before they were submitted
+        self.queue: Deque[Dict] = deque()
+        self.claimed: Set[int] = set()
+        # id of node -> resolution submitted but not yet claimed
+        self.prefetched: Dict[int, Future] = {}
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.lock = Lock()
+
+    def add(self, node: Dict):
+        """queue recorded_lecture node to be resolved once it is within the lookahead window"""
+        with self.lock:
+            self.queue.append(node)
+            self.fill()
+
+    def get(self, node: Dict) -> ResolvedLecture:
+        """claim node, waiting for it to be resolved if it was prefetched else resolving it now"""
+        future = self.claim(node)
+        return future.result() if future is not None else self.resolve(node)
+
+    def discard(self, node: Dict):
+        """claim node without resolving it, e.g. if it no longer needs to be downloaded"""
+        future = self.claim(node)
+        if future is not None:
+            future.cancel()
+
+    def claim(self, node: Dict) -> Optional[Future]:
+        # remove node from the window (or queue), making room for the next queued node
+        with self.lock:
+            future = self.prefetched.pop(id(node), None)
+            if future is None and any(n is node for n in self.queue):
+                self.claimed.add(id(node))
+            self.fill()
+        return future
+
+    def fill(self):
+        # submit queued nodes until the window is full, call with lock held
+        while self.queue and len(self.prefetched) < self.lookahead:
+            node = self.queue.popleft()
+            if id(node) in self.claimed:
+                self.claimed.discard(id(node))
+                continue
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.lookahead)
+            self.prefetched[id(node)] = self.executor.submit(self.resolve, node)
+
+    def shutdown(self):
+        """drop queued nodes and wait for submitted ones"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            self.queue.clear()
+            self.claimed.clear()
+            self.prefetched.clear()
+        if executor is not None:
+            executor.shutdown()
+
+    def resolve(self, node: Dict) -> ResolvedLecture:
+        """resolve download link and size of node, reusing the download link stored on the node
+        (merged from Storage) or in the link cache. The size is always HEADed again, the video
+        behind a download link may have changed since it was stored and download_segmented relies
+        on the size. The results are stored on the node, so they are saved with the course by
+        Storage"""
+        predownload_link = node["predownload_link"]
+        download_link = node.get("download_link")
+        if download_link is None and self.link_cache:
+            entry = self.link_cache.get_entry(predownload_link)
+            if entry is not None:
+                download_link = entry["download_link"]
+
+        resolved = False
+        if download_link is None:
+            download_link = get_recorded_lecture_download_link(self.BbRouter, predownload_link)
+            resolved = True
+        size, accepts_ranges = get_download_info(download_link)
+        resolved = resolved or (size, accepts_ranges) != (
+            node.get("size"),
+            node.get("accepts_ranges", False),
+        )
+
+        node["download_link"], node["filename"] = download_link, get_video_name(node)
+        node["size"], node["accepts_ranges"] = size, accepts_ranges
+        if resolved and self.link_cache:
+            self.link_cache.put(
+                predownload_link, download_link, node["filename"], size, accepts_ranges
+            )
+        return ResolvedLecture(download_link, size, accepts_ranges)
+
+
+class DownloadStats:
+    """thread safe counter of completed downloads"""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+        self.lock = Lock()
+
+    def add(self, num_bytes: int):
+        with self.lock:
+            self.files += 1
+            self.bytes += num_bytes
+
+    def summary(self) -> str:
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        return "Downloaded {} files ({}) in {:.1f}s, {}/s".format(
+            self.files,
+            convert_size(self.bytes),
+            elapsed,
+            convert_size(int(self.bytes / elapsed)),
+        )
+
+
+class BlobIndex:
+    """in memory index of downloaded files keyed by content rid (see utils.get_blob_id), shared by
+    schedulers so a file linked from several folders, courses or accounts is downloaded once and
+    hard linked everywhere else"""
+
+    def __init__(self):
+        self.paths: Dict[str, str] = {}
+        self.key_locks: Dict[str, Lock] = {}
+        self.lock = Lock()
+
+    def lock_for(self, key: str) -> Lock:
+        with self.lock:
+            return self.key_locks.setdefault(key, Lock())
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            path = self.paths.get(key)
+        return path if path is not None and os.path.isfile(path) else None
+
+    def add(self, key: Optional[str], path: str):
+        if key is None:
+            return
+        with self.lock:
+            self.paths[key] = path
+
+
+class FileIndex:
+    """in memory index of the files and directories under the scanned directories, thread safe.
+    Paths outside every scanned directory are checked on disk"""
+
+    def __init__(self):
+        self.roots: List[str] = []
+        # path -> DirEntry from the scan (which stats lazily, once) or size of a file added since
+        self.files: Dict[str, Union[os.DirEntry, int, None]] = {}
+        self.dirs: Set[str] = set()
+        self.lock = Lock()
+
+    def scan(self, root: str):
+        """list every file and directory under root, replacing what was indexed there before.
+        Symlinked directories are indexed but not descended into
+
+        Args:
+            root (str): directory, need not exist
+        """
+        root = os.path.abspath(root)
+        files: Dict[str, Union[os.DirEntry, int, None]] = {}
+        dirs: Set[str] = set()
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                entries = os.scandir(path)
+            except OSError:
+                continue
+            dirs.add(path)
+            with entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if entry.is_symlink():
+                            dirs.add(entry.path)
+                        else:
+                            stack.append(entry.path)
+                    else:
+                        files[entry.path] = entry
+        with self.lock:
+            if root not in self.roots:
+                self.roots.append(root)
+            prefix = os.path.join(root, "")
+            self.files = {p: e for p, e in self.files.items() if not p.startswith(prefix)}
+            self.dirs = {d for d in self.dirs if d != root and not d.startswith(prefix)}
+            self.files.update(files)
+            self.dirs.update(dirs)
+
+    def covers(self, path: str) -> bool:
+        return any(path == r or path.startswith(os.path.join(r, "")) for r in self.roots)
+
+    def exists(self, path: str) -> bool:
+        """same as os.path.exists, answered from the index if path is under a scanned directory"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if self.covers(path):
+                return path in self.files or path in self.dirs
+        return os.path.exists(path)
+
+    def get_size(self, path: str) -> Optional[int]:
+        """size of file, None if it does not exist or its size is unknown"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if not self.covers(path):
+                return os.path.getsize(path) if os.path.isfile(path) else None
+            entry = self.files.get(path)
+        if isinstance(entry, os.DirEntry):
+            try:
+                return entry.stat().st_size
+            except OSError:
+                return None
+        return entry
+
+    def add(self, path: str, size: Optional[int] = None):
+        """index a file created since the scan, with its parent directories"""
+        path = os.path.abspath(path)
+        with self.lock:
+            if not self.covers(path):
+                return
+            self.files[path] = size
+            parent = os.path.dirname(path)
+            while parent not in self.dirs and self.covers(parent):
+                self.dirs.add(parent)
+                parent = os.path.dirname(parent)
+
+
+class DownloadScheduler:
+    def __init__(
+        self,
+        BbRouter: str,
+        file_workers: int = DEFAULT_FILE_WORKERS,
+        lecture_workers: int = DEFAULT_LECTURE_WORKERS,
+        confirm: Optional[Callable[[str, Optional[str]], bool]] = None,
+        segments: int = 1,
+        link_cache: Optional[LinkCache] = None,
+        blob_index: Optional[Union[BlobIndex, BlobStore]] = None,
+        stats: Optional[DownloadStats] = None,
+        lookahead: int = DEFAULT_LOOKAHEAD,
+        storage: Optional[Union[Storage, SQLiteStorage]] = None,
+        file_index: Optional[FileIndex] = None,
+        verify: bool = False,
+    ):
+        """
+        Args:
+            BbRouter (str): authentication token
+            file_workers (int): maximum number of files downloaded concurrently
+            lecture_workers (int): maximum number of recorded lectures downloaded concurrently
+            confirm (Callable[[str, Optional[str]], bool]): if set, called with the video name and
+                size of each recorded lecture before downloading it, the lecture is skipped (and a
+                dummy file created) if it returns False
+            segments (int): number of connections used to download each recorded lecture, 1
+                downloads over a single stream
+            link_cache (LinkCache): if set, consulted before HEADing a file for its download link
+                or resolving a recorded lecture
+            blob_index (Union[BlobIndex, BlobStore]): if set, files already downloaded
+                elsewhere are hard linked instead of downloaded again
+            stats (DownloadStats): counter to add completed downloads to, pass the same stats to
+                several schedulers to report their combined throughput
+            lookahead (int): number of upcoming recorded lectures resolved in the background, see
+                LectureResolver
+            storage (Union[Storage, SQLiteStorage]): if set, every completed download is journaled
+                with storage.record_download, so an interrupted sync keeps the links it resolved
+            file_index (FileIndex): if set, answers whether files and dummy files exist, scan the
+                destination before running jobs. Files downloaded are added to it
+            verify (bool): download existing files again if they differ from the server, see
+                is_outdated
+        """
+        self.BbRouter = BbRouter
+        self.file_workers = file_workers
+        self.lecture_workers = lecture_workers
+        self.confirm = confirm
+        self.segments = segments
+        self.link_cache = link_cache
+        self.blob_index = blob_index
+        self.stats = stats or DownloadStats()
+        self.storage = storage
+        self.file_index = file_index
+        self.verify = verify
+        self.resolver = LectureResolver(BbRouter, lookahead, link_cache)
+        # destinations of the current run, a second job saving to the same path (e.g. two files
+        # of the same name in a folder) would write to the same part file concurrently
+        self.claimed: Set[str] = set()
+        self.claimed_lock = Lock()
+
+    def run(self, jobs: Iterable[DownloadJob]):
+        """download all jobs, returns once every job has completed. Jobs are submitted as they are
+        iterated, unless downloads need to be confirmed in which case every job is gathered first
+
+        Args:
+            jobs (Iterable[DownloadJob]): jobs from get_download_jobs or iter_download_jobs
+        """
+        with self.claimed_lock:
+            self.claimed.clear()
+        try:
+            self.run_jobs(jobs)
+        finally:
+            self.resolver.shutdown()
+
+    def run_jobs(self, jobs: Iterable[DownloadJob]):
+        if self.confirm is not None:
+            jobs = list(jobs)
+            file_jobs = [j for j in jobs if j.node["type"] == "file"]
+            all_lecture_jobs = [j for j in jobs if j.node["type"] == "recorded_lecture"]
+            lecture_jobs = [j for j in all_lecture_jobs if not self.recorded_lecture_exists(j)]
+            # downloaded lectures are not asked about again, only checked
+            verified_jobs = [
+                j
+                for j in all_lecture_jobs
+                if self.verify
+                and self.recorded_lecture_exists(j)
+                and not self.recorded_lecture_declined(j)
+            ]
+            # resolve upcoming lectures while the user answers earlier prompts
+            for j in lecture_jobs:
+                self.resolver.add(j.node)
+            lecture_jobs = [
+                j for j in map(self.confirm_recorded_lecture, lecture_jobs) if j is not None
+            ]
+            jobs = file_jobs + lecture_jobs + verified_jobs
+
+        with ThreadPoolExecutor(max_workers=self.file_workers) as file_pool:
+            with ThreadPoolExecutor(max_workers=self.lecture_workers) as lecture_pool:
+                futures = []
+                for j in jobs:
+                    if j.node["type"] == "file":
+                        futures.append((j, file_pool.submit(self.download_file, j)))
+                    elif j.node["type"] == "recorded_lecture":
+                        if j.download_link is None and not self.recorded_lecture_exists(j):
+                            self.resolver.add(j.node)
+                        futures.append(
+                            (j, lecture_pool.submit(self.download_recorded_lecture, j))
+                        )
+                for job, future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        print("Failed to download {}: {}".format(job.node["name"], e))
+
+    def confirm_recorded_lecture(self, job: DownloadJob) -> Optional[DownloadJob]:
+        """resolve download link and size of recorded lecture and ask whether to download it
+
+        Returns:
+            Optional[DownloadJob]: job with download link and size set, None if the lecture
+                should not be downloaded
+        """
+        video_name = get_video_name(job.node)
+        if self.recorded_lecture_exists(job):
+            return None
+        download_link, size, accepts_ranges = self.resolver.get(job.node)
+        if self.confirm(video_name, convert_size(size) if size else None):
+            return job._replace(
+                download_link=download_link, size=size, accepts_ranges=accepts_ranges
+            )
+        dummy_file_path = create_dummy_file(job.download_path, video_name)
+        if self.file_index is not None:
+            self.file_index.add(dummy_file_path, 0)
+        print("Created dummy file:", dummy_file_path)
+        return None
+
+    def recorded_lecture_exists(self, job: DownloadJob) -> bool:
+        video_name = get_video_name(job.node)
+        full_file_path = os.path.join(job.download_path, video_name)
+        if self.file_index is None:
+            return os.path.exists(full_file_path) or dummy_file_exists(
+                job.download_path, video_name
+            )
+        return self.file_index.exists(full_file_path) or self.file_index.exists(
+            get_dummy_file_path(job.download_path, video_name)
+        )
+
+    def recorded_lecture_declined(self, job: DownloadJob) -> bool:
+        return self.exists(get_dummy_file_path(job.download_path, get_video_name(job.node)))
+
+    def exists(self, path: str) -> bool:
+        if self.file_index is None:
+            return os.path.exists(path)
+        return self.file_index.exists(path)
+
+    def get_size(self, path: str) -> Optional[int]:
+        if self.file_index is None:
+            return os.path.getsize(path) if os.path.isfile(path) else None
+        return self.file_index.get_size(path)
+
+    def is_outdated(self, node: Dict, download_link: str, path: str) -> bool:
+        """whether the downloaded file at path differs from the one on the server. Its size is
+        compared with the recorded size first, which needs no request, then the download link is
+        HEADed and compared by size, ETag and Last-Modified. Validators not recorded yet are stored
+        on node, so they are saved with the course by Storage"""
+        local_size = self.get_size(path)
+        if node.get("size") is not None and node["size"] != local_size:
+            return True
+        remote = get_file_validators(self.BbRouter, download_link)
+        if remote.get("size") is not None and remote["size"] != local_size:
+            return True
+        if any(
+            node.get(field) and remote.get(field) and node[field] != remote[field]
+            for field in ("etag", "last_modified")
+        ):
+            return True
+        node.update(remote)
+        return False
+
+    def claim(self, path: str) -> bool:
+        """claim destination path for the calling job, False if another job of this run has"""
+        path = os.path.abspath(path)
+        with self.claimed_lock:
+            if path in self.claimed:
+                return False
+            self.claimed.add(path)
+            return True
+
+    def download_file(self, job: DownloadJob):
+        node = job.node
+        # download link and filename are present if merged from Storage, no need to HEAD again
+        download_link, filename = node.get("download_link"), node.get("filename")
+        if download_link is None or filename is None:
+            cached = self.link_cache.get(node["predownload_link"]) if self.link_cache else None
+            if cached is not None:
+                download_link, filename = cached
+            else:
+                download_link = get_file_download_link(self.BbRouter, node["predownload_link"])
+                filename = get_filename_from_url(download_link)
+                if filename is None:
+                    print("Unable to get filename from: {}".format(download_link))
+                    return
+                if self.link_cache:
+                    self.link_cache.put(node["predownload_link"], download_link, filename)
+            node["download_link"], node["filename"] = download_link, filename
+        full_file_path = os.path.join(job.download_path, sanitise_filename(filename))
+        if not self.claim(full_file_path):
+            print("Skipped {}, another file is saved to {}".format(node["name"], full_file_path))
+            return
+        overwrite = False
+        if self.exists(full_file_path):
+            if not self.verify or not self.is_outdated(node, download_link, full_file_path):
+                return
+            overwrite = True
+        if self.blob_index is None:
+            print("- {}{}".format(full_file_path, " (changed)" if overwrite else ""))
+            if self.download(download_link, full_file_path, node, overwrite):
+                self.record_download(node)
+            return
+        blob_id = get_blob_id(node["predownload_link"])
+        with self.blob_index.lock_for(blob_id or full_file_path):
+            if overwrite:
+                # an outdated file is downloaded again in place, not linked to the stored copy of
+                # its rid, which then points to the new content
+                print("- {} (changed)".format(full_file_path))
+                if self.download(download_link, full_file_path, node, overwrite):
+                    self.record_download(node)
+                    self.blob_index.add(blob_id, full_file_path)
+                return
+            existing_path = self.blob_index.get(blob_id) if blob_id else None
+            if existing_path is not None:
+                print("- {} (linked)".format(full_file_path))
+                link_file(existing_path, full_file_path)
+                if self.file_index is not None:
+                    self.file_index.add(full_file_path)
+                self.record_download(node)
+                return
+            print("- {}".format(full_file_path))
+            if self.download(download_link, full_file_path, node):
+                self.record_download(node)
+                self.blob_index.add(blob_id, full_file_path)
+
+    def download_recorded_lecture(self, job: DownloadJob):
+        full_file_path = os.path.join(job.download_path, get_video_name(job.node))
+        if not self.claim(full_file_path):
+            self.resolver.discard(job.node)
+            print(
+                "Skipped {}, another lecture is saved to {}".format(
+                    job.node["name"], full_file_path
+                )
+            )
+            return
+        download_link, size, accepts_ranges = job.download_link, job.size, job.accepts_ranges
+        overwrite = False
+        if download_link is None:
+            if self.recorded_lecture_exists(job):
+                if not self.verify or self.recorded_lecture_declined(job):
+                    self.resolver.discard(job.node)
+                    return
+                download_link, size, accepts_ranges = self.resolver.get(job.node)
+                if size is None or size == self.get_size(full_file_path):
+                    return
+                overwrite = True
+            else:
+                download_link, size, accepts_ranges = self.resolver.get(job.node)
+        print(
+            "- {} ({}){}".format(
+                full_file_path,
+                convert_size(size) if size else "Unknown",
+                " (changed)" if overwrite else "",
+            )
+        )
+        if self.segments > 1:
+            downloaded = download_segmented(
+                self.BbRouter,
+                download_link,
+                full_file_path,
+                self.segments,
+                size,
+                accepts_ranges,
+                overwrite,
+            )
+        else:
+            downloaded = download(
+                self.BbRouter, download_link, full_file_path, overwrite=overwrite
+            )
+        self.record(downloaded, full_file_path)
+        if downloaded:
+            self.record_download(job.node)
+        if downloaded and self.blob_index is not None:
+            # recorded lectures have no rid, only deduplicated by content
+            self.blob_index.add(None, full_file_path)
+
+    def download(
+        self, url: str, destination: str, node: Dict, overwrite: bool = False
+    ) -> bool:
+        # size, ETag and Last-Modified of the response are recorded on node for verify
+        downloaded = download(
+            self.BbRouter,
+            url,
+            destination,
+            overwrite=overwrite,
+            on_response=lambda response: node.update(get_remote_validators(response)),
+        )
+        self.record(downloaded, destination)
+        return downloaded
+
+    def record(self, downloaded: bool, destination: str):
+        if downloaded:
+            size = os.path.getsize(destination)
+            self.stats.add(size)
+            if self.file_index is not None:
+                self.file_index.add(destination, size)
+
+    def record_download(self, node: Dict):
+        if self.storage is not None:
+            self.storage.record_download(node)
@@ -2,18 +2,135 @@
 Storage: handles retrieving and updating data that is saved in the download directory. 
 
 Currently the following data is stored:
-- download_dir
+- download_dir: as a single JSON file (Storage) or one SQLite row per node (SQLiteStorage)
+- link_cache: predownload link to resolved download link and filename (and size of recorded
+  lectures), see LinkCache
+- blobs: content addressed copies of downloaded files, see BlobStore
 
 Note that saved Folder object has the new attribute mapping of type Dict[str, int] that maps objects 
 name to its index in Folder.children. This is to speed up merging
+
+Storage writes download_dir.json to a temporary file that is renamed over the previous snapshot, so
+a crash never leaves a partially written index. Each completed download is also appended to
+journal.jsonl as it finishes (see record_download). On load the journal is replayed onto the
+snapshot, and merging applies it to nodes the snapshot does not have yet, so a sync that was killed
+reuses the links of every file it completed. Saving a snapshot drops the events it includes.
+
+SQLiteStorage keys every node by its path (the names from the course down to the node) so merging
+looks nodes up directly, and saving a course only writes the rows that changed.
 """
+import hashlib
 import json
+import sqlite3
+import time
 from pathlib import Path
 import os
-from typing import Dict, List
+from threading import Lock
+from typing import Dict, Iterator, List, Optional, Tuple
 
 STORAGE_DIR = ".ntu_learn_downloader"
 DOWNLOAD_DIR_FILENAME = "download_dir.json"
+DOWNLOAD_DIR_DB_FILENAME = "download_dir.sqlite3"
+JOURNAL_FILENAME = "journal.jsonl"
+# node fields recorded in the journal once a download completes
+JOURNAL_FIELDS = ["download_link", "filename", "size", "accepts_ranges", "etag", "last_modified"]
+STORAGE_BACKENDS = ["json", "sqlite"]
+LINK_CACHE_FILENAME = "link_cache.json"
+BLOBS_DIR = "blobs"
+HASH_CHUNK_SIZE = 1024 * 1024
+DEFAULT_LINK_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+DEFAULT_LINK_CACHE_SIZE = 20000
+
+
+def hard_link(src: str, dst: str) -> bool:
+    """hard link src to dst, return False if hard links are not supported (e.g. dst is on another
+    filesystem)"""
+    try:
+        os.link(src, dst)
+    except FileExistsError:
+        raise
+    except OSError:
+        return False
+    return True
+
+
+def write_json_atomic(path: str, obj):
+    """write obj as JSON to a temporary file then rename it to path, so path always holds either the
+    previous or the new content"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(obj, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def get_journal_event(node: Dict) -> Dict:
+    """journal event of a downloaded file or recorded_lecture node"""
+    event = {"predownload_link": node["predownload_link"], "time": time.time()}
+    for field in JOURNAL_FIELDS:
+        if node.get(field) is not None:
+            event[field] = node[field]
+    return event
+
+
+def read_journal(path: str) -> Dict[str, Dict]:
+    """return predownload link -> latest event of a journal, a line torn by a crash is skipped"""
+    events: Dict[str, Dict] = {}
+    if not os.path.exists(path):
+        return events
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            events[event["predownload_link"]] = event
+    return events
+
+
+def truncate_torn_line(path: str):
+    """cut a journal back to its last complete line, so the next event appended is not joined to
+    a line torn by a crash"""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb+") as f:
+        content = f.read()
+        if content and not content.endswith(b"\n"):
+            f.truncate(content.rfind(b"\n") + 1)
+
+
+def iter_leaves(nodes: List[Dict]) -> Iterator[Dict]:
+    """iterate over every file and recorded_lecture node in nodes"""
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node["type"] == "folder":
+            stack.extend(node["children"])
+        else:
+            yield node
+
+
+def apply_journal(nodes: List[Dict], events: Dict[str, Dict]) -> int:
+    """set the recorded fields of every file and recorded_lecture node in nodes that has an event
+
+    Args:
+        nodes (List[Dict]): serialized folders, files and recorded lectures
+        events (Dict[str, Dict]): see read_journal
+
+    Returns:
+        int: number of nodes updated
+    """
+    updated = 0
+    for node in iter_leaves(nodes):
+        event = events.get(node.get("predownload_link"))
+        if event is None:
+            continue
+        for field in JOURNAL_FIELDS:
+            if field in event:
+                node[field] = event[field]
+        updated += 1
+    return updated
 
 
 class Storage:
@@ -34,31 +151,49 @@ class Storage:
         else:
             self.download_dir = []
 
+        # downloads completed since the snapshot was saved
+        self.journal_path = os.path.join(self.dir, JOURNAL_FILENAME)
+        truncate_torn_line(self.journal_path)
+        self.journal = read_journal(self.journal_path)
+        apply_journal(self.download_dir, self.journal)
+        self.journal_lock = Lock()
+
+    def record_download(self, node: Dict):
+        """append a completed download to the journal, called by DownloadScheduler from its workers
+
+        Args:
+            node (Dict): file or recorded_lecture node with its download link and filename set
+        """
+        event = get_journal_event(node)
+        line = json.dumps(event) + "\n"
+        with self.journal_lock:
+            self.journal[event["predownload_link"]] = event
+            with open(self.journal_path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
     def merge_download_dir(self, incoming_dir: List[Dict]):
         """mutate incoming_dir by merging it with saved download_dir, either adding download_links to file 
         and recorded_lecture objects if previously computed or initializing it with None. Assumed that 
         the topology of incoming dir is a superset of saved download_dir
 
+        Stored download links are only reused if the predownload link is unchanged.
+
         Args:
             incoming_dir (Dict): return value of api.get_download_dir
         """
 
-        def traverse(saved_node: Dict, new_node: Dict):
-            if saved_node is None:
+        def traverse(saved_node: Optional[Dict], new_node: Dict):
+            if saved_node is None or saved_node["type"] != new_node["type"]:
                 return
             node_type = new_node["type"]
-            assert (
-                saved_node["type"] == node_type
-            ), "node type mismatch, LHS: {}, RHS: {}".format(
-                saved_node["type"], node_type
-            )
 
             if node_type in ["file", "recorded_lecture"]:
-                new_node["download_link"] = saved_node.get("download_link")
-                new_node["filename"] = saved_node.get("filename")
+                merge_node(saved_node, new_node)
             elif node_type == "folder":
-                mapping = saved_node["mapping"]
                 saved_children = saved_node["children"]
+                mapping = saved_node["mapping"]
                 for new_child in new_node["children"]:
                     name = new_child["name"]
                     old_child = saved_children[mapping[name]] if name in mapping else None
@@ -75,6 +210,8 @@ class Storage:
                 else None
             )
             traverse(l_node, r_node)
+        with self.journal_lock:
+            apply_journal(incoming_dir, self.journal)
 
     def save_download_dir(self, download_dir: Dict):
         """first compute child name to index mappings and then save updated download_dir to storage
@@ -99,5 +236,488 @@ class Storage:
 
         download_dir_full_path = os.path.join(self.dir, DOWNLOAD_DIR_FILENAME)
         self.download_dir = download_dir
-        with open(download_dir_full_path, "w") as f:
-            json.dump(download_dir, f)
+        write_json_atomic(download_dir_full_path, download_dir)
+        self.compact_journal()
+
+    def compact_journal(self):
+        """drop the journal events the saved snapshot already includes"""
+        saved = {
+            node["predownload_link"]: node
+            for node in iter_leaves(self.download_dir)
+            if node.get("download_link") is not None
+        }
+        with self.journal_lock:
+            pending = {
+                link: event
+                for link, event in self.journal.items()
+                if link not in saved
+                or any(saved[link].get(f) != event.get(f) for f in JOURNAL_FIELDS if f in event)
+            }
+            if len(pending) == len(self.journal):
+                return
+            self.journal = pending
+            tmp_path = self.journal_path + ".tmp"
+            with open(tmp_path, "w") as f:
+                for event in pending.values():
+                    f.write(json.dumps(event) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.journal_path)
+
+    def save_course(self, course_dir: Dict):
+        """save a single course folder (return value of api.get_download_dir), replacing the saved
+        course of the same name if present and keeping all other saved courses
+
+        Args:
+            course_dir (Dict): course folder, see save_download_dir
+        """
+        download_dir = [
+            node for node in self.download_dir if node["name"] != course_dir["name"]
+        ]
+        download_dir.append(course_dir)
+        self.save_download_dir(download_dir)
+
+
+def merge_node(saved_node: Dict, new_node: Dict):
+    """copy the stored download link and filename (and size, ETag and Last-Modified the file was
+    downloaded with) of a file or recorded_lecture node, if its predownload link is unchanged"""
+    # saved links are stale if the predownload link has changed
+    is_same = saved_node.get("predownload_link") == new_node["predownload_link"]
+    new_node["download_link"] = saved_node.get("download_link") if is_same else None
+    new_node["filename"] = saved_node.get("filename") if is_same else None
+    if not is_same:
+        return
+    if new_node["type"] == "recorded_lecture" and "size" in saved_node:
+        new_node["accepts_ranges"] = saved_node.get("accepts_ranges", False)
+    for field in ("size", "etag", "last_modified"):
+        if field in saved_node:
+            new_node[field] = saved_node[field]
+
+
+# separates the names in a SQLiteStorage path, the next character bounds the range of descendants
+PATH_SEP = "\x1f"
+PATH_END = chr(ord(PATH_SEP) + 1)
+
+
+# separates a name from the number of earlier siblings with that name, sorts before PATH_SEP so a
+# node's descendants stay in its own range
+DUPLICATE_SEP = "\x1e"
+
+
+def join_path(parent: str, name: str) -> str:
+    return parent + PATH_SEP + name if parent else name
+
+
+def get_child_keys(children: List[Dict]) -> List[str]:
+    """path component of each child, its name or, for the n-th (from 1) later sibling of the same
+    name, name + DUPLICATE_SEP + n. Siblings named alike (e.g. two "Lecture 1" items) are common"""
+    seen: Dict[str, int] = {}
+    keys = []
+    for child in children:
+        n = seen.get(child["name"], 0)
+        seen[child["name"]] = n + 1
+        keys.append(child["name"] + DUPLICATE_SEP + str(n) if n else child["name"])
+    return keys
+
+
+def get_rows(
+    node: Dict, parent: str = "", position: int = 0, key: Optional[str] = None
+) -> Iterator[Tuple]:
+    """flatten a serialized node into (path, parent, position, type, name, data) rows, where data
+    is the JSON of every field except type, name, children and mapping"""
+    path = join_path(parent, node["name"] if key is None else key)
+    data = {k: v for k, v in node.items() if k not in ("type", "name", "children", "mapping")}
+    yield path, parent, position, node["type"], node["name"], json.dumps(data, sort_keys=True)
+    children = node.get("children") or []
+    for idx, (child, child_key) in enumerate(zip(children, get_child_keys(children))):
+        yield from get_rows(child, path, idx, child_key)
+
+
+class SQLiteStorage:
+    def __init__(self, download_dir: str):
+        """Same interface as Storage, with download_dir stored in SQLite with one row per node
+        keyed by its path. A download_dir.json saved by Storage is imported the first time.
+
+        Later siblings with the same name as an earlier one get a numbered path, see get_child_keys,
+        and are merged with the saved sibling of the same name and number. Completed downloads are
+        journaled in their own table until the course is saved, see Storage.record_download
+
+        Args:
+            download_dir (str): download directory
+        """
+        self.dir = os.path.join(download_dir, STORAGE_DIR, "")
+        Path(self.dir).mkdir(parents=True, exist_ok=True)
+        # record_download is called from the scheduler's workers
+        self.conn = sqlite3.connect(
+            os.path.join(self.dir, DOWNLOAD_DIR_DB_FILENAME), check_same_thread=False
+        )
+        self.lock = Lock()
+        with self.conn:
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS nodes (
+                    path TEXT PRIMARY KEY,
+                    parent TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    type TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    data TEXT NOT NULL
+                )"""
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS nodes_parent ON nodes (parent, position)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS journal (predownload_link TEXT PRIMARY KEY, event TEXT)"
+            )
+
+        json_path = os.path.join(self.dir, DOWNLOAD_DIR_FILENAME)
+        is_empty = self.conn.execute("SELECT 1 FROM nodes LIMIT 1").fetchone() is None
+        if is_empty and os.path.exists(json_path):
+            with open(json_path, "r") as f:
+                for course_dir in json.load(f):
+                    self.save_course(course_dir)
+
+    def record_download(self, node: Dict):
+        """journal a completed download, see Storage.record_download"""
+        event = get_journal_event(node)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO journal VALUES (?, ?)",
+                (event["predownload_link"], json.dumps(event)),
+            )
+
+    def get_journal(self) -> Dict[str, Dict]:
+        with self.lock:
+            rows = self.conn.execute("SELECT predownload_link, event FROM journal").fetchall()
+        return {link: json.loads(event) for link, event in rows}
+
+    def get_node(self, path: List[str]) -> Optional[Dict]:
+        """return the stored node at path without its children, None if there is none
+
+        Args:
+            path (List[str]): names from the course to the node, e.g. ["CE3007", "Content"]
+        """
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT type, name, data FROM nodes WHERE path = ?", (PATH_SEP.join(path),)
+            ).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row[2]), type=row[0], name=row[1])
+
+    def get_subtree_rows(self, path: str) -> Dict[str, Tuple]:
+        """return path -> (parent, position, type, name, data) of the node at path and all of its
+        descendants"""
+        with self.lock:
+            rows = self.conn.execute(
+                """SELECT path, parent, position, type, name, data FROM nodes
+                WHERE path = ? OR (path > ? AND path < ?)""",
+                (path, path + PATH_SEP, path + PATH_END),
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def merge_download_dir(self, incoming_dir: List[Dict]):
+        """mutate incoming_dir by merging it with the saved download_dir, see
+        Storage.merge_download_dir
+
+        Args:
+            incoming_dir (Dict): return value of api.get_download_dir
+        """
+        for course_dir in incoming_dir:
+            saved = self.get_subtree_rows(course_dir["name"])
+            if not saved:
+                continue
+
+            def traverse(node: Dict, path: str):
+                row = saved.get(path)
+                if row is None or row[2] != node["type"]:
+                    return
+                if node["type"] in ["file", "recorded_lecture"]:
+                    merge_node(json.loads(row[4]), node)
+                elif node["type"] == "folder":
+                    children = node["children"]
+                    for child, key in zip(children, get_child_keys(children)):
+                        traverse(child, join_path(path, key))
+
+            traverse(course_dir, course_dir["name"])
+        apply_journal(incoming_dir, self.get_journal())
+
+    def save_course(self, course_dir: Dict):
+        """save a single course folder, replacing the saved course of the same name. Only rows that
+        were added, changed or removed are written
+
+        Args:
+            course_dir (Dict): course folder, see Storage.save_download_dir
+        """
+        saved = self.get_subtree_rows(course_dir["name"])
+        journal = self.get_journal()
+        apply_journal([course_dir], journal)
+        rows = {row[0]: row[1:] for row in get_rows(course_dir)}
+        links = {node["predownload_link"] for node in iter_leaves([course_dir])}
+        saved_links = [(link,) for link in journal if link in links]
+        with self.lock, self.conn:
+            # the course rows now include these downloads
+            self.conn.executemany("DELETE FROM journal WHERE predownload_link = ?", saved_links)
+            self.conn.executemany(
+                "DELETE FROM nodes WHERE path = ?",
+                [(path,) for path in saved if path not in rows],
+            )
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO nodes VALUES (?, ?, ?, ?, ?, ?)",
+                [(path,) + row for path, row in rows.items() if saved.get(path) != row],
+            )
+
+    def save_download_dir(self, download_dir: List[Dict]):
+        """save every course of download_dir and remove saved courses not in it
+
+        Args:
+            download_dir (List[Dict]): see Storage.save_download_dir
+        """
+        names = {course_dir["name"] for course_dir in download_dir}
+        for course_dir in download_dir:
+            self.save_course(course_dir)
+        with self.lock:
+            courses = self.conn.execute("SELECT name FROM nodes WHERE parent = ''").fetchall()
+        for (name,) in courses:
+            if name not in names:
+                with self.lock, self.conn:
+                    self.conn.execute(
+                        "DELETE FROM nodes WHERE path = ? OR (path > ? AND path < ?)",
+                        (name, name + PATH_SEP, name + PATH_END),
+                    )
+
+    @property
+    def download_dir(self) -> List[Dict]:
+        """the whole saved download_dir, in the format saved by Storage"""
+        # parent path -> [(path, node)]
+        children: Dict[str, List[Tuple[str, Dict]]] = {}
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, parent, position, type, name, data FROM nodes "
+                "ORDER BY parent, position"
+            ).fetchall()
+        for path, parent, _position, node_type, name, data in rows:
+            node = dict(json.loads(data), type=node_type, name=name)
+            children.setdefault(parent, []).append((path, node))
+
+        def build(path: str, node: Dict) -> Dict:
+            if node["type"] == "folder":
+                node["children"] = [build(*child) for child in children.get(path, [])]
+                node["mapping"] = {
+                    child["name"]: idx for idx, child in enumerate(node["children"])
+                }
+            return node
+
+        return [build(*course) for course in children.get("", [])]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_storage(download_dir: str, backend: str = "json"):
+    """return Storage or SQLiteStorage of download_dir
+
+    Args:
+        download_dir (str): download directory
+        backend (str): one of STORAGE_BACKENDS
+    """
+    if backend == "sqlite":
+        return SQLiteStorage(download_dir)
+    if backend == "json":
+        return Storage(download_dir)
+    raise ValueError(
+        "unknown storage backend: {}, expected one of {}".format(backend, STORAGE_BACKENDS)
+    )
+
+
+class LinkCache:
+    def __init__(
+        self,
+        download_dir: str,
+        ttl: float = DEFAULT_LINK_CACHE_TTL,
+        max_entries: int = DEFAULT_LINK_CACHE_SIZE,
+    ):
+        """Persistent cache of predownload link to the download link (and filename) it redirects to,
+        so that files do not have to be HEADed again on every sync. Entries older than ttl are
+        ignored, and only the max_entries most recently resolved entries are kept when saving.
+
+        Args:
+            download_dir (str): download directory
+            ttl (float): seconds before an entry expires
+            max_entries (int): maximum number of entries saved
+        """
+        storage_dir = os.path.join(download_dir, STORAGE_DIR, "")
+        Path(storage_dir).mkdir(parents=True, exist_ok=True)
+        self.path = os.path.join(storage_dir, LINK_CACHE_FILENAME)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = Lock()
+        self.entries: Dict[str, Dict] = {}
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+
+    def get(self, predownload_link: str) -> Optional[Tuple[str, str]]:
+        """return (download_link, filename) if cached and not expired"""
+        entry = self.get_entry(predownload_link)
+        if entry is None:
+            return None
+        return entry["download_link"], entry["filename"]
+
+    def get_entry(self, predownload_link: str) -> Optional[Dict]:
+        """return entry with download_link, filename, and size and accepts_ranges if recorded, if
+        cached and not expired"""
+        with self.lock:
+            entry = self.entries.get(predownload_link)
+        if entry is None or time.time() - entry["time"] > self.ttl:
+            return None
+        return dict(entry)
+
+    def put(
+        self,
+        predownload_link: str,
+        download_link: str,
+        filename: str,
+        size: Optional[int] = None,
+        accepts_ranges: Optional[bool] = None,
+    ):
+        entry = {"download_link": download_link, "filename": filename, "time": time.time()}
+        if size is not None:
+            entry["size"] = size
+            entry["accepts_ranges"] = bool(accepts_ranges)
+        with self.lock:
+            # reinsert so that ties in time are evicted in insertion order
+            self.entries.pop(predownload_link, None)
+            self.entries[predownload_link] = entry
+
+    def save(self):
+        """evict expired entries and the oldest entries above max_entries, then write to disk"""
+        now = time.time()
+        with self.lock:
+            fresh = [
+                (link, entry)
+                for link, entry in self.entries.items()
+                if now - entry["time"] <= self.ttl
+            ]
+            fresh.sort(key=lambda item: item[1]["time"])
+            self.entries = dict(fresh[len(fresh) - self.max_entries :] if self.max_entries else [])
+            write_json_atomic(self.path, self.entries)
+
+
+class BlobStore:
+    def __init__(self, download_dir: str):
+        """Content addressed store of downloaded files. Every file is hard linked to
+        blobs/sha256/{content hash}, and files from NTULearn also to blobs/rid/{rid} (see
+        utils.get_blob_id), so files with the same rid are only downloaded once and files with the
+        same content only take up disk space once. The visible download tree is made of hard links
+        into the store. Same interface as scheduler.BlobIndex
+
+        Blobs are never copied, if the file system does not support hard links the store is skipped
+        and files are only deduplicated by rid within a sync. Blobs no longer linked from the
+        download tree are removed by prune
+
+        Args:
+            download_dir (str): download directory
+        """
+        self.dir = os.path.join(download_dir, STORAGE_DIR, BLOBS_DIR, "")
+        self.rid_dir = os.path.join(self.dir, "rid")
+        self.hash_dir = os.path.join(self.dir, "sha256")
+        Path(self.rid_dir).mkdir(parents=True, exist_ok=True)
+        Path(self.hash_dir).mkdir(parents=True, exist_ok=True)
+        self.key_locks: Dict[str, Lock] = {}
+        self.lock = Lock()
+        # set to False once a hard link fails, files are then left out of the store
+        self.linkable = True
+        # rid -> path of files added while the store is skipped
+        self.paths: Dict[str, str] = {}
+
+    def lock_for(self, key: str) -> Lock:
+        with self.lock:
+            return self.key_locks.setdefault(key, Lock())
+
+    def get(self, key: str) -> Optional[str]:
+        """return path of blob with rid key if stored"""
+        path = os.path.join(self.rid_dir, key)
+        if os.path.isfile(path):
+            return path
+        path = self.paths.get(key)
+        return path if path is not None and os.path.isfile(path) else None
+
+    def add(self, key: Optional[str], path: str):
+        """add downloaded file to the store. If a blob with the same content is already stored, path
+        is replaced with a link to it. A stored blob of the same rid with other content is replaced
+
+        Args:
+            key (Optional[str]): rid of file, None if not known (e.g. recorded lectures)
+            path (str): downloaded file
+        """
+        if not self.linkable:
+            if key is not None:
+                self.paths[key] = path
+            return
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for data in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+                digest.update(data)
+        hash_path = os.path.join(self.hash_dir, digest.hexdigest())
+
+        with self.lock_for(hash_path):
+            if os.path.isfile(hash_path):
+                if not os.path.samefile(hash_path, path):
+                    tmp_path = path + ".blob"
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)  # left by an interrupted add
+                    if hard_link(hash_path, tmp_path):
+                        os.replace(tmp_path, path)
+                    else:
+                        self.skip(key, path)
+                        return
+            elif not hard_link(path, hash_path):
+                self.skip(key, path)
+                return
+        if key is not None:
+            rid_path = os.path.join(self.rid_dir, key)
+            if not os.path.isfile(rid_path):
+                hard_link(hash_path, rid_path)
+            elif not os.path.samefile(rid_path, hash_path):
+                # the file of rid changed on NTULearn and was downloaded again
+                tmp_path = rid_path + ".tmp"
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                if hard_link(hash_path, tmp_path):
+                    os.replace(tmp_path, rid_path)
+
+    def skip(self, key: Optional[str], path: str):
+        """stop adding files to the store, hard links from the download tree are not supported"""
+        print("Hard links are not supported in {}, not deduplicating by content".format(self.dir))
+        self.linkable = False
+        if key is not None:
+            self.paths[key] = path
+
+    def prune(self) -> int:
+        """remove blobs that are no longer linked from the download tree, i.e. every link to them is
+        in the store
+
+        Returns:
+            int: number of blobs removed
+        """
+        rid_paths: Dict[Tuple[int, int], List[str]] = {}
+        with os.scandir(self.rid_dir) as entries:
+            for entry in entries:
+                st = entry.stat()
+                rid_paths.setdefault((st.st_dev, st.st_ino), []).append(entry.path)
+        removed = 0
+        with os.scandir(self.hash_dir) as entries:
+            for entry in entries:
+                st = entry.stat()
+                links = rid_paths.pop((st.st_dev, st.st_ino), [])
+                if st.st_nlink > 1 + len(links):
+                    continue
+                for path in [entry.path] + links:
+                    os.remove(path)
+                removed += 1
+        # rid entries whose content blob is gone
+        for links in rid_paths.values():
+            for path in links:
+                if os.stat(path).st_nlink == 1:
+                    os.remove(path)
+        return removed
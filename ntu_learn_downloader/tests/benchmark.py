@@ -0,0 +1,431 @@
+"""
+Benchmark: times crawling, link resolution and downloading against the mock server.
+
+A synthetic course of configurable width, depth and file size is generated as mock server fixtures
+and served on a free port. Each stage is run with the package's own functions (api.get_download_dir,
+api.get_file_download_link and utils.download) and reported as wall time, requests/sec, MB/s and
+per request latency percentiles, along with the peak RSS of the process. A final stream stage runs
+the whole sync as main.py does, crawling with api.iter_download_dir while DownloadScheduler is
+already downloading. Results are printed and optionally written as JSON, pass an earlier result
+with --baseline to compare against it.
+
+    python -m ntu_learn_downloader.tests.benchmark --width 4 --depth 2 --files 8 --out run.json
+
+Recorded lectures are not part of the synthetic course, their download links point to AcuStudio
+over https which the mock server cannot stand in for.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+from unittest.mock import patch
+
+from ntu_learn_downloader.api import (
+    get_download_dir,
+    get_file_download_link,
+    iter_download_dir,
+)
+from ntu_learn_downloader.parsing import PARSER_BACKENDS, set_parser_backend
+from ntu_learn_downloader.scheduler import DownloadScheduler, iter_download_jobs
+from ntu_learn_downloader.tests.mock_server import (
+    MockServerRequestHandler,
+    get_free_port,
+    index_fixtures,
+    start_mock_server,
+)
+from ntu_learn_downloader.utils import download, get_filename_from_url, make_GET_request
+
+BbRouter = "expires:1583963361,id:1A633268311FA435A6HT7K968346A658,signature:benchmark,site:5ecaf6aa-60ca-4431-89e7-6ed4c720440d,timeout:10800,user:benchmark,v:2,xsrf:benchmark"
+
+COURSE_ID = "_900000_1"
+COURSE_NAME = "BENCH-COURSE"
+
+CONTENT_IDS_PATH = "/webapps/blackboard/execute/announcement"
+CONTENT_LIST_PATH = "/webapps/blackboard/content/listContent.jsp"
+
+PAGE_TEMPLATE = "<!DOCTYPE HTML><html><head><title>{title}</title></head><body>{body}</body></html>"
+
+FOLDER_ITEM_TEMPLATE = """<li class="clearfix liItem read">
+ <img alt="Content Folder" src="/images/ci/sets/set12/folder_on.svg" class="item_icon">
+ <div class="item clearfix"><h3><a href="{link}"><span>{name}</span></a></h3></div>
+ <div class="details"><div class="vtbegenerated">Synthetic folder {name}</div></div>
+</li>"""
+
+FILE_ITEM_TEMPLATE = """<li class="clearfix liItem read">
+ <img alt="File" src="/images/ci/sets/set12/document_on.svg" class="item_icon">
+ <div class="item clearfix"><h3><a href="{link}"><span>{name}</span></a></h3></div>
+</li>"""
+
+
+def get_mock_constants(port: int) -> Dict[str, str]:
+    base_url = "http://localhost:{}".format(port)
+    return {
+        "GET_COURSES_URL": base_url + "/webapps/blackboard/execute/globalCourseNavMenuSection",
+        "GET_CONTENT_IDS_URL": base_url + CONTENT_IDS_PATH,
+        "GET_CONTENT_LIST_URL": base_url + CONTENT_LIST_PATH,
+        "NTULEARN_URL": base_url,
+    }
+
+
+def get_listContent_link(content_id: str, course_id: str = COURSE_ID) -> str:
+    return "{}?course_id={}&content_id={}".format(CONTENT_LIST_PATH, course_id, content_id)
+
+
+def get_fixture(method: str, path: str, response: Dict, query: Optional[Dict] = None) -> Dict:
+    return {
+        "request": {"method": method, "request_path": path, "query": query or {}},
+        "response": dict({"body": "", "status_code": 200}, **response),
+    }
+
+
+def generate_course(
+    base_url: str,
+    width: int,
+    depth: int,
+    files: int,
+    file_size: int,
+    course_id: str = COURSE_ID,
+) -> Tuple[List[Dict], int]:
+    """generate mock server fixtures for a synthetic course
+
+    Args:
+        base_url (str): url of the mock server, file links are absolute
+        width (int): number of content areas, and of sub folders in every folder
+        depth (int): levels of sub folders below each content area
+        files (int): number of files in every folder
+        file_size (int): size of every file in bytes
+        course_id (str): course id as returned by get_courses, links in the pages always have
+            the leading underscore
+
+    Returns:
+        Tuple[List[Dict], int]: fixtures and the number of files in the course
+    """
+    fixtures: List[Dict] = []
+    link_course_id = course_id if course_id.startswith("_") else "_" + course_id
+    ids = iter(range(1, sys.maxsize))
+    num_files = 0
+
+    def add_folder(content_id: str, level: int):
+        nonlocal num_files
+        items = []
+        for _ in range(files):
+            i = next(ids)
+            rid = "{}_1".format(i)
+            predownload_path = "/bbcswebdav/pid-{}-dt-content-rid-{}/xid-{}".format(i, rid, rid)
+            download_path = "/bbcswebdav/pid-{}-dt-content-rid-{}/courses/{}/file_{}.bin".format(
+                i, rid, COURSE_NAME, i
+            )
+            items.append(
+                FILE_ITEM_TEMPLATE.format(link=base_url + predownload_path, name="file_{}".format(i))
+            )
+            # predownload link redirects to the download link which contains the file name
+            fixtures.append(
+                get_fixture("HEAD", predownload_path, {"status_code": 302, "url": download_path})
+            )
+            # file content is generated and streamed by the mock server
+            synthetic = {
+                "headers": {"Content-Type": "application/octet-stream"},
+                "synthetic_size": file_size,
+            }
+            fixtures.append(get_fixture("HEAD", download_path, synthetic))
+            fixtures.append(get_fixture("GET", download_path, synthetic))
+            num_files += 1
+        if level < depth:
+            for _ in range(width):
+                sub_content_id = "_{}_1".format(next(ids))
+                items.append(
+                    FOLDER_ITEM_TEMPLATE.format(
+                        link=get_listContent_link(sub_content_id, link_course_id),
+                        name="folder{}".format(sub_content_id),
+                    )
+                )
+                add_folder(sub_content_id, level + 1)
+        body = '<ul id="content_listContainer" class="contentList">{}</ul>'.format("".join(items))
+        fixtures.append(
+            get_fixture(
+                "GET",
+                CONTENT_LIST_PATH,
+                {"body": PAGE_TEMPLATE.format(title=content_id, body=body)},
+                # content areas are requested with the id from get_courses, sub folders with the
+                # id in their link
+                {"course_id": course_id if level == 0 else link_course_id, "content_id": content_id},
+            )
+        )
+
+    menu_items = []
+    for area in range(width):
+        content_id = "_{}_1".format(next(ids))
+        menu_items.append(
+            '<li><a href="{}"><span title="Area {}">Area {}</span></a></li>'.format(
+                get_listContent_link(content_id, link_course_id), area, area
+            )
+        )
+        add_folder(content_id, 0)
+    body = '<ul id="courseMenuPalette_contents">{}</ul>'.format("".join(menu_items))
+    fixtures.append(
+        get_fixture(
+            "GET",
+            CONTENT_IDS_PATH,
+            {"body": PAGE_TEMPLATE.format(title=COURSE_NAME, body=body)},
+            {"method": "search", "context": "course_entry", "course_id": course_id},
+        )
+    )
+    return fixtures, num_files
+
+
+def get_handler(fixtures: List[Dict]):
+    """return a mock server request handler serving fixtures which counts requests served"""
+
+    class BenchmarkRequestHandler(MockServerRequestHandler):
+        requests_served = 0
+        lock = Lock()
+
+        def handle_HEAD_GET_request(self, method=str):
+            with BenchmarkRequestHandler.lock:
+                BenchmarkRequestHandler.requests_served += 1
+            super().handle_HEAD_GET_request(method)
+
+        def log_message(self, format, *args):
+            pass
+
+    BenchmarkRequestHandler.index = index_fixtures(fixtures)
+    return BenchmarkRequestHandler
+
+
+def get_files(obj: Dict) -> List[Dict]:
+    if obj["type"] == "folder":
+        return [f for c in obj["children"] for f in get_files(c)]
+    return [obj] if obj["type"] == "file" else []
+
+
+def get_latency_summary(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    return {
+        "mean_ms": 1000 * sum(latencies) / len(latencies),
+        "p50_ms": 1000 * percentile(0.5),
+        "p95_ms": 1000 * percentile(0.95),
+        "max_ms": 1000 * latencies[-1],
+    }
+
+
+def get_peak_rss_kb() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+class Stage:
+    """times a stage of the benchmark, requests are counted by the mock server handler"""
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.latencies: List[float] = []
+        self.bytes = 0
+        self.lock = Lock()
+
+    def timed(self, fn: Callable, *args, **kwargs):
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+        return result
+
+    def run(self, fn: Callable, *args):
+        requests_served = self.handler.requests_served
+        start = time.perf_counter()
+        result = fn(*args)
+        self.seconds = time.perf_counter() - start
+        self.requests = self.handler.requests_served - requests_served
+        return result
+
+    def summary(self) -> Dict:
+        seconds = max(self.seconds, 1e-9)
+        result = {
+            "seconds": self.seconds,
+            "requests": self.requests,
+            "requests_per_sec": self.requests / seconds,
+            "latency": get_latency_summary(self.latencies),
+        }
+        if self.bytes:
+            result["bytes"] = self.bytes
+            result["mb_per_sec"] = self.bytes / seconds / (1024 * 1024)
+        return result
+
+
+def run_benchmark(
+    width: int = 3,
+    depth: int = 2,
+    files: int = 4,
+    file_size: int = 256 * 1024,
+    crawl_workers: int = 8,
+    file_workers: int = 8,
+    parser: str = "bs4",
+) -> Dict:
+    """generate a synthetic course, serve it and time every stage
+
+    Returns:
+        Dict: JSON serializable results, see the module docstring
+    """
+    port = get_free_port()
+    constants = get_mock_constants(port)
+    fixtures, num_files = generate_course(
+        constants["NTULEARN_URL"], width, depth, files, file_size
+    )
+    handler = get_handler(fixtures)
+    server = start_mock_server(port, handler)
+    set_parser_backend(parser)
+
+    crawl, resolve, fetch, stream = (Stage(handler) for _ in range(4))
+    try:
+        with patch.dict(
+            "ntu_learn_downloader.api.__dict__", constants
+        ), tempfile.TemporaryDirectory() as tmp_dir:
+            # time every page fetched while crawling
+            with patch(
+                "ntu_learn_downloader.api.make_GET_request",
+                lambda *args: crawl.timed(make_GET_request, *args),
+            ):
+                course = crawl.run(
+                    get_download_dir, BbRouter, COURSE_NAME, COURSE_ID, crawl_workers
+                )
+            nodes = get_files(course)
+
+            def resolve_all() -> List[str]:
+                with ThreadPoolExecutor(max_workers=file_workers) as executor:
+                    return list(
+                        executor.map(
+                            lambda node: resolve.timed(
+                                get_file_download_link, BbRouter, node["predownload_link"]
+                            ),
+                            nodes,
+                        )
+                    )
+
+            links = resolve.run(resolve_all)
+
+            def download_one(link: str):
+                destination = os.path.join(tmp_dir, get_filename_from_url(link))
+                fetch.timed(download, BbRouter, link, destination)
+                with fetch.lock:
+                    fetch.bytes += os.path.getsize(destination)
+
+            def download_all():
+                with ThreadPoolExecutor(max_workers=file_workers) as executor:
+                    list(executor.map(download_one, links))
+
+            fetch.run(download_all)
+
+            def stream_all():
+                # crawl, resolve and download overlapped, as main.py does
+                scheduler = DownloadScheduler(BbRouter, file_workers=file_workers)
+                stream_dir = os.path.join(tmp_dir, "stream")
+                course_nodes = iter_download_dir(
+                    BbRouter, COURSE_NAME, COURSE_ID, stream_dir, crawl_workers
+                )
+                with redirect_stdout(io.StringIO()):
+                    scheduler.run(iter_download_jobs(course_nodes))
+                stream.bytes = scheduler.stats.bytes
+
+            stream.run(stream_all)
+    finally:
+        server.shutdown()
+        server.server_close()
+        set_parser_backend("bs4")
+
+    if len(nodes) != num_files:
+        raise Exception("expected {} files, crawled {}".format(num_files, len(nodes)))
+    stages = {
+        "crawl": crawl.summary(),
+        "resolve": resolve.summary(),
+        "download": fetch.summary(),
+        "stream": stream.summary(),
+    }
+    return {
+        "config": {
+            "width": width,
+            "depth": depth,
+            "files": files,
+            "file_size": file_size,
+            "crawl_workers": crawl_workers,
+            "file_workers": file_workers,
+            "parser": parser,
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "folders": sum(
+            1 for f in fixtures if f["request"]["request_path"] == CONTENT_LIST_PATH
+        ),
+        "files": num_files,
+        "stages": stages,
+        # stages run one after another, stream repeats all of them overlapped
+        "total_seconds": sum(stages[name]["seconds"] for name in ["crawl", "resolve", "download"]),
+        "peak_rss_kb": get_peak_rss_kb(),
+    }
+
+
+def compare(result: Dict, baseline: Dict) -> List[str]:
+    """describe how each stage of result compares to baseline"""
+    lines = []
+    for name, stage in result["stages"].items():
+        base = baseline["stages"].get(name)
+        if not base or not base["seconds"]:
+            continue
+        lines.append(
+            "{:<9} {:8.3f}s vs {:8.3f}s ({:+.1f}%)".format(
+                name,
+                stage["seconds"],
+                base["seconds"],
+                100 * (stage["seconds"] - base["seconds"]) / base["seconds"],
+            )
+        )
+    return lines
+
+
+parser = argparse.ArgumentParser(description="Benchmark NTULearn Downloader against the mock server")
+parser.add_argument("--width", type=int, default=3, help="Content areas and sub folders per folder")
+parser.add_argument("--depth", type=int, default=2, help="Levels of sub folders")
+parser.add_argument("--files", type=int, default=4, help="Files per folder")
+parser.add_argument("--file_size", type=int, default=256 * 1024, help="File size in bytes")
+parser.add_argument("--crawl_workers", type=int, default=8)
+parser.add_argument("--file_workers", type=int, default=8)
+parser.add_argument("--parser", choices=PARSER_BACKENDS, default="bs4")
+parser.add_argument("--out", type=str, help="Write results as JSON to this file")
+parser.add_argument("--baseline", type=str, help="JSON results of an earlier run to compare with")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    result = run_benchmark(
+        width=args.width,
+        depth=args.depth,
+        files=args.files,
+        file_size=args.file_size,
+        crawl_workers=args.crawl_workers,
+        file_workers=args.file_workers,
+        parser=args.parser,
+    )
+    print(json.dumps(result, indent=4))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\n".join(compare(result, json.load(f))))
@@ -0,0 +1,200 @@
+"""
+Microbenchmark: times the link classification and AcuStudio parsing functions of urls.py.
+
+Every function is run over the anchors of the listContent.jsp fixtures (or the recorded lecture
+fixture for parse_acustudio_page) and compared with the implementation it replaced, which looked
+up its pattern in the re module cache on every call and ran every AcuStudio pattern over the whole
+page. Results are reported in
+nanoseconds per call, written as JSON with --out and compared with an earlier run with --baseline.
+
+parse_acustudio_page_alternation times a one pass extractor, a single finditer over the alternation
+of the three AcuStudio patterns, against the same legacy implementation. It is the reason
+urls.parse_acustudio_page searches for each value's literal start instead: the alternation has no
+literal prefix for the regex engine to skip ahead to, so it is slower than even the legacy version.
+
+    python -m ntu_learn_downloader.tests.microbenchmark --number 20 --out micro.json
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import timeit
+from typing import Callable, Dict, List, Optional, Tuple
+
+import lxml.html
+
+from ntu_learn_downloader import urls
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+# implementations before urls.py, kept as the reference the new ones are compared with
+
+
+def legacy_is_download_link(url):
+    return re.search(r"bbcswebdav\/pid-\d+-dt-content-rid-\d+", url) is not None
+
+
+def legacy_get_content_id_from_listContent_url(url: str) -> Optional[str]:
+    m = re.search(
+        r"\/webapps\/blackboard\/content\/listContent\.jsp\?course_id=(_\d+_\d+)&content_id=(_\d+_\d+)",
+        url,
+    )
+    return None if m is None else m.groups()[1]
+
+
+def legacy_get_course_id_from_link(link: str) -> Optional[str]:
+    m = re.search(r"type=Course&id=_(\S+)&url=", link)
+    return None if m is None else m.groups()[0]
+
+
+def legacy_parse_acustudio_page(html: str) -> Optional[Tuple[str, str, str]]:
+    m1 = re.search(r'var gsUserId\s+= "(\S+)";', html)
+    m2 = re.search(r'var gsModuleId\s+= "(\S+)";', html)
+    m3 = re.search(r'addStreamInfo\("\S+", "(\S+)", "", "", "", "as"\)', html)
+    if m1 is None or m2 is None or m3 is None:
+        return None
+    return m1.groups()[0], m2.groups()[0], m3.groups()[0]
+
+
+ACUSTUDIO_ALTERNATION_RE = re.compile(
+    r'var gsUserId\s+= "(?P<user_id>\S+)";'
+    r'|var gsModuleId\s+= "(?P<module_id>\S+)";'
+    r'|addStreamInfo\("\S+", "(?P<domain>\S+)", "", "", "", "as"\)'
+)
+
+
+def alternation_parse_acustudio_page(html: str) -> Optional[Tuple[str, str, str]]:
+    # one scan filling the three values, stops once all are found
+    found: Dict[str, str] = {}
+    for m in ACUSTUDIO_ALTERNATION_RE.finditer(html):
+        name = m.lastgroup
+        if name not in found:
+            found[name] = m.group(name)
+            if len(found) == 3:
+                return found["user_id"], found["module_id"], found["domain"]
+    return None
+
+
+def load_fixture_bodies(match: Callable[[Dict], bool]) -> List[str]:
+    bodies = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.json"))):
+        with open(path) as f:
+            fixture = json.load(f)
+        if match(fixture):
+            bodies.append(fixture["response"]["body"])
+    return bodies
+
+
+def get_hrefs() -> List[str]:
+    """href of every anchor in the listContent.jsp fixtures"""
+    hrefs = []
+    for body in load_fixture_bodies(
+        lambda f: f["request"]["request_path"].endswith("listContent.jsp")
+    ):
+        root = lxml.html.document_fromstring(body)
+        hrefs.extend(a.get("href") for a in root.iter("a") if a.get("href"))
+    return hrefs
+
+
+def get_acustudio_pages() -> List[str]:
+    return load_fixture_bodies(lambda f: "gsUserId" in f["response"].get("body", ""))
+
+
+def time_per_call(fn: Callable, inputs: List, number: int) -> float:
+    """best of three runs, in nanoseconds per call"""
+
+    def run():
+        for value in inputs:
+            fn(value)
+
+    best = min(timeit.repeat(run, number=number, repeat=3))
+    return 1e9 * best / (number * len(inputs))
+
+
+def run_microbenchmark(number: int = 20) -> Dict:
+    hrefs = get_hrefs()
+    pages = get_acustudio_pages()
+    onclicks = [
+        "javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_{}_1&url='); return false;".format(
+            i
+        )
+        for i in range(100)
+    ]
+    cases: List[Tuple[str, Callable, Callable, List]] = [
+        ("is_download_link", urls.is_download_link, legacy_is_download_link, hrefs),
+        (
+            "get_content_id_from_listContent_url",
+            urls.get_content_id_from_listContent_url,
+            legacy_get_content_id_from_listContent_url,
+            hrefs,
+        ),
+        (
+            "get_course_id_from_link",
+            urls.get_course_id_from_link,
+            legacy_get_course_id_from_link,
+            onclicks,
+        ),
+        (
+            "parse_acustudio_page",
+            urls.parse_acustudio_page,
+            legacy_parse_acustudio_page,
+            pages,
+        ),
+        (
+            "parse_acustudio_page_alternation",
+            alternation_parse_acustudio_page,
+            legacy_parse_acustudio_page,
+            pages,
+        ),
+    ]
+    results = {}
+    for name, fn, legacy_fn, inputs in cases:
+        if [fn(v) for v in inputs] != [legacy_fn(v) for v in inputs]:
+            raise Exception("{} does not match its legacy implementation".format(name))
+        ns = time_per_call(fn, inputs, number)
+        legacy_ns = time_per_call(legacy_fn, inputs, number)
+        results[name] = {
+            "inputs": len(inputs),
+            "ns_per_call": ns,
+            "legacy_ns_per_call": legacy_ns,
+            "speedup": legacy_ns / ns if ns else 0.0,
+        }
+    return {"number": number, "functions": results}
+
+
+def compare(result: Dict, baseline: Dict) -> List[str]:
+    """describe how each function of result compares to baseline"""
+    lines = []
+    for name, stats in result["functions"].items():
+        base = baseline["functions"].get(name)
+        if not base or not base["ns_per_call"]:
+            continue
+        lines.append(
+            "{:<36} {:10.1f}ns vs {:10.1f}ns ({:+.1f}%)".format(
+                name,
+                stats["ns_per_call"],
+                base["ns_per_call"],
+                100 * (stats["ns_per_call"] - base["ns_per_call"]) / base["ns_per_call"],
+            )
+        )
+    return lines
+
+
+parser = argparse.ArgumentParser(description="Time link classification and AcuStudio parsing")
+parser.add_argument("--number", type=int, default=20, help="Runs over the inputs per timing")
+parser.add_argument("--out", type=str, help="Write results as JSON to this file")
+parser.add_argument("--baseline", type=str, help="JSON results of an earlier run to compare with")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    result = run_microbenchmark(args.number)
+    print(json.dumps(result, indent=4))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=4)
+    if args.baseline:
+        with open(args.baseline) as f:
+            print("\n".join(compare(result, json.load(f))))
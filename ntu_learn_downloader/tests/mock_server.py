@@ -1,9 +1,10 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
 import re
 import socket
 from threading import Thread
 import os
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from urllib.parse import urlparse, parse_qsl
 import requests
@@ -28,46 +29,118 @@ for root, _subdirs, files in os.walk(FIXTURES_PATH):
             fixtures.append(json.load(json_file))
 
 
-class MockServerRequestHandler(BaseHTTPRequestHandler):
-    def handle_HEAD_GET_request(self, method=str):
-        def match(request_handler: BaseHTTPRequestHandler, fixture) -> bool:
-            parsed_url = urlparse(request_handler.path)
-            query_params = dict(parse_qsl(parsed_url.query))
+# synthetic bodies repeat bytes 0..250, a period that is not a power of two so that misplaced byte
+# ranges do not go unnoticed
+SYNTHETIC_PERIOD = 251
+CHUNK_SIZE = 64 * 1024
+SYNTHETIC_BLOCK = bytes(range(SYNTHETIC_PERIOD)) * (CHUNK_SIZE // SYNTHETIC_PERIOD + 2)
 
-            request = fixture["request"]
 
-            return (
-                request_handler.command == request["method"]
-                and parsed_url.path == request["request_path"]
-                and query_params == request.get("query", {})
-            )
+def get_synthetic_body(size: int, start: int = 0, end: Optional[int] = None) -> bytes:
+    """content of a fixture with "synthetic_size": size, from byte start to end (inclusive)"""
+    end = size - 1 if end is None else end
+    return b"".join(iter_synthetic_body(start, end))
+
+
+def iter_synthetic_body(start: int, end: int) -> Iterator[bytes]:
+    offset = start
+    while offset <= end:
+        length = min(CHUNK_SIZE, end - offset + 1)
+        block_start = offset % SYNTHETIC_PERIOD
+        yield SYNTHETIC_BLOCK[block_start : block_start + length]
+        offset += length
+
+
+def get_fixture_key(method: str, path: str, query: Dict[str, str]) -> Tuple:
+    return (method, path, frozenset(query.items()))
+
+
+def index_fixtures(fixtures: List[Dict]) -> Dict[Tuple, Dict]:
+    """index fixture responses by (method, path, query), the first of duplicate fixtures wins"""
+    index: Dict[Tuple, Dict] = {}
+    for fixture in fixtures:
+        request = fixture["request"]
+        key = get_fixture_key(
+            request["method"], request["request_path"], request.get("query", {})
+        )
+        index.setdefault(key, fixture["response"])
+    return index
+
+
+def parse_range(range_header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    # only single byte ranges of the form bytes=start-[end] are supported
+    m = re.match(r"bytes=(\d+)-(\d*)$", range_header or "")
+    if m is None:
+        return None
+    start = int(m.groups()[0])
+    end = int(m.groups()[1]) if m.groups()[1] else size - 1
+    return (start, min(end, size - 1))
+
+
+class MockServerRequestHandler(BaseHTTPRequestHandler):
+    # keep connections alive so clients can reuse them, every response sets Content-Length
+    protocol_version = "HTTP/1.1"
+    # subclass and override to serve other fixtures, e.g. generated by benchmark.py
+    index = index_fixtures(fixtures)
+
+    def handle_HEAD_GET_request(self, method=str):
+        parsed_url = urlparse(self.path)
+        query_params = dict(parse_qsl(parsed_url.query))
 
         # DEBUGGING
-        # parsed_url = urlparse(self.path)
-        # query_params = dict(parse_qsl(parsed_url.query))
         # print(self.command, parsed_url.path, query_params)
 
-        try:
-            response = next(fix["response"] for fix in fixtures if match(self, fix))
-        except StopIteration:
+        response = self.index.get(get_fixture_key(self.command, parsed_url.path, query_params))
+        if response is None:
             raise Exception("Not fixture found for request: {}".format(self.path))
 
+        if "synthetic_size" in response:
+            self.send_synthetic_response(response, method)
+            return
+
+        response_content = response["body"].encode("utf-8")
         # Add response content.
         self.send_response(response["status_code"])
         # Add response headers if present in captured response
-        if response.get('headers', None):
-            for key, val in response['headers'].items():
-                self.send_header(key, val)
-        else:
-            self.send_header("Content-Type", "application/json; charset=utf-8")
+        headers = response.get("headers", None) or {
+            "Content-Type": "application/json; charset=utf-8"
+        }
+        for key, val in headers.items():
+            self.send_header(key, val)
+        if "Content-Length" not in headers:
+            self.send_header("Content-Length", str(len(response_content)))
         if 'url' in response:
             self.send_header("Location", response['url'])
         self.end_headers()
         # only include response content if GET method
         if method == "GET":
-            response_content = response["body"]
-            self.wfile.write(response_content.encode("utf-8"))
-        
+            self.wfile.write(response_content)
+
+    def send_synthetic_response(self, response: Dict, method: str):
+        """stream a generated body of response["synthetic_size"] bytes, honouring Range headers"""
+        size = response["synthetic_size"]
+        byte_range = parse_range(self.headers.get("Range"), size)
+        if byte_range is not None and byte_range[0] >= size:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(size))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if byte_range is None:
+            start, end = 0, size - 1
+            self.send_response(response.get("status_code", 200))
+        else:
+            start, end = byte_range
+            self.send_response(206)
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(start, end, size))
+        for key, val in response.get("headers", {}).items():
+            self.send_header(key, val)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        if method == "GET":
+            for chunk in iter_synthetic_body(start, end):
+                self.wfile.write(chunk)
 
     def do_HEAD(self):
         self.handle_HEAD_GET_request(method="HEAD")
@@ -76,6 +149,43 @@ class MockServerRequestHandler(BaseHTTPRequestHandler):
         self.handle_HEAD_GET_request(method="GET")
 
 
+class ChangingFileHandler(BaseHTTPRequestHandler):
+    """serves body with an ETag, honouring Range and If-Range. With misaligned set a range is
+    answered from the first byte"""
+
+    protocol_version = "HTTP/1.1"
+    body = b"version 2 of the file"
+    etag = '"v2"'
+    misaligned = False
+
+    def do_GET(self):
+        m = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+        if_range = self.headers.get("If-Range")
+        start = int(m.group(1)) if m and (if_range is None or if_range == self.etag) else None
+        if start is not None and start >= len(self.body):
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */{}".format(len(self.body)))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if start is None:
+            self.send_response(200)
+            start = 0
+        else:
+            start = 0 if self.misaligned else start
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", "bytes {}-{}/{}".format(start, len(self.body) - 1, len(self.body))
+            )
+        self.send_header("Content-Length", str(len(self.body) - start))
+        self.send_header("ETag", self.etag)
+        self.end_headers()
+        self.wfile.write(self.body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
 def get_free_port():
     s = socket.socket(socket.AF_INET, type=socket.SOCK_STREAM)
     s.bind(("localhost", 0))
@@ -84,8 +194,13 @@ def get_free_port():
     return port
 
 
-def start_mock_server(port):
-    mock_server = HTTPServer(("localhost", port), MockServerRequestHandler)
+class MockServer(ThreadingHTTPServer):
+    # accept bursts of concurrent connections instead of leaving clients to retry their SYN
+    request_queue_size = 128
+
+
+def start_mock_server(port, handler=MockServerRequestHandler):
+    mock_server = MockServer(("localhost", port), handler)
     mock_server_thread = Thread(target=mock_server.serve_forever)
     mock_server_thread.setDaemon(True)
     mock_server_thread.start()
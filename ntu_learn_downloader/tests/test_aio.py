@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ntu_learn_downloader.tests.mock_server import (
+    MOCK_CONSTANTS,
+    ChangingFileHandler,
+    get_free_port,
+    get_synthetic_body,
+    start_mock_server,
+)
+from ntu_learn_downloader import aio
+from ntu_learn_downloader.api import get_contents
+from ntu_learn_downloader.models import Folder
+
+BbRouter = "expires:1583963361,id:1A633268311FA435A6HT7K968346A658,signature:bqguvcoi0nh434robmpzervdtpomolh17rk3m9kxhiy0ozd5tzquhd0e4igldygm,site:5ecaf6aa-60ca-4431-89e7-6ed4c720440d,timeout:10800,user:6itk73437hq6tbcznl60t354qc2vn2py,v:2,xsrf:y3d3nzrg-c301-4455-a5a3-hpjdect1jyil"
+
+
+def run(coroutine_function, *args):
+    async def main():
+        async with aio.AsyncClient(limit_per_host=4) as client:
+            return await coroutine_function(client, *args)
+
+    return asyncio.run(main())
+
+
+@unittest.skipIf(aio.aiohttp is None, "aiohttp is not installed")
+class TestAio(unittest.TestCase):
+    def test_no_total_timeout(self):
+        async def get_timeout(client):
+            return client.session.timeout
+
+        timeout = run(get_timeout)
+        # downloads of long lectures must not be aborted
+        self.assertIsNone(timeout.total)
+        self.assertEqual(aio.DEFAULT_SOCK_READ_TIMEOUT, timeout.sock_read)
+
+    def test_get_content_ids(self):
+        expected = {("Content", "_1643678_1"), ("19S1 Recorded Lectures", "_1643676_1")}
+        with patch.dict("ntu_learn_downloader.aio.__dict__", MOCK_CONSTANTS):
+            result = run(aio.get_content_ids, BbRouter, "_302242_1")
+        self.assertSetEqual(expected, set(result))
+
+    def test_get_contents_matches_api(self):
+        with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
+            expected = get_contents(BbRouter, "_306327_1", "_1790226_1")
+        with patch.dict("ntu_learn_downloader.aio.__dict__", MOCK_CONSTANTS):
+            result = run(aio.get_contents, BbRouter, "_306327_1", "_1790226_1")
+        self.assertListEqual(expected, result)
+
+    def test_load_folder_matches_serialize(self):
+        def make_folder():
+            return Folder(
+                name="Tutorials",
+                link="/webapps/blackboard/content/listContent.jsp?course_id=_306327_1&content_id=_1875198_1",
+                details="",
+                children=None,
+            )
+
+        with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
+            expected = make_folder().serialize(BbRouter)
+        folder = make_folder()
+        with patch.dict("ntu_learn_downloader.aio.__dict__", MOCK_CONSTANTS):
+            run(aio.load_folder, BbRouter, folder)
+        self.assertDictEqual(expected, folder.serialize(BbRouter))
+
+    def test_get_recorded_lecture_download_link(self):
+        expected_url = "https://ntucee.ntu.edu.sg/content/0090842a4023a822af16c4160f6a4e95/s2001140130007cad14c2533d8829926b8e1847e39b41/media/1.mp4"
+        predownload_link = "/webapps/Acu-AcuLe@rn-BB5dcb73f79ba4c/am/start_play_studio.jsp?sn=s2001140130007cad14c2533d8829926b8e1847e39b41&parent_id=_1790232_1&course_id=_306329_1&am_course_id=189561&ver=7&content_id=_1924894_1"
+        with patch.dict("ntu_learn_downloader.aio.__dict__", MOCK_CONSTANTS):
+            url = run(aio.get_recorded_lecture_download_link, BbRouter, predownload_link)
+        self.assertEqual(expected_url, url)
+
+    def test_download(self):
+        url = "http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "Tut2_CE2003_soln.pdf")
+            self.assertTrue(run(aio.download, BbRouter, url, destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(b"%PDF-1.4 Tut2_CE2003_soln", f.read())
+
+    def test_download_writes_in_executor(self):
+        url = "http://localhost:8082/content/synthetic/media/1.mp4"
+        content = get_synthetic_body(5242887)
+        written = []
+
+        async def download(client, *args):
+            loop = asyncio.get_running_loop()
+            run_in_executor = loop.run_in_executor
+
+            def record(executor, func, *func_args):
+                written.append(func)
+                return run_in_executor(executor, func, *func_args)
+
+            with patch.object(loop, "run_in_executor", side_effect=record):
+                return await aio.download(client, *args)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "1.mp4")
+            with open(destination + ".part", "wb") as f:
+                f.write(content[:1000])
+            self.assertTrue(run(download, BbRouter, url, destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(content, f.read())
+        # opened, written in buffered chunks and closed off the event loop
+        names = [getattr(func, "__name__", None) for func in written]
+        self.assertIn("open", names)
+        self.assertIn("close", names)
+        self.assertEqual(5, names.count("write"))
+
+    def test_download_does_not_resume_changed_or_misaligned_file(self):
+        port = get_free_port()
+        server = start_mock_server(port, ChangingFileHandler)
+        url = "http://localhost:{}/Tut1.pdf".format(port)
+        body = ChangingFileHandler.body
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                destination = os.path.join(tmp_dir, "Tut1.pdf")
+                with open(destination + ".part", "wb") as f:
+                    f.write(b"version 1")
+                with open(destination + ".part.json", "w") as f:
+                    json.dump({"etag": '"v1"'}, f)
+                self.assertTrue(run(aio.download, BbRouter, url, destination))
+                with open(destination, "rb") as f:
+                    self.assertEqual(body, f.read())
+
+                os.remove(destination)
+                ChangingFileHandler.misaligned = True
+                with open(destination + ".part", "wb") as f:
+                    f.write(body[:9])
+                self.assertTrue(run(aio.download, BbRouter, url, destination))
+                with open(destination, "rb") as f:
+                    self.assertEqual(body, f.read())
+                self.assertEqual(["Tut1.pdf"], os.listdir(tmp_dir))
+        finally:
+            ChangingFileHandler.misaligned = False
+            server.shutdown()
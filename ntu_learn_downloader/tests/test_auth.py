@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import stat
+import tempfile
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from threading import Lock
+
+from ntu_learn_downloader.auth import (
+    TokenCache,
+    TokenManager,
+    get_token_expiry,
+    parse_bbrouter,
+)
+from ntu_learn_downloader.client import Client, get_client, set_client
+from ntu_learn_downloader.tests.mock_server import get_free_port, start_mock_server
+from ntu_learn_downloader.utils import make_GET_request
+
+
+def make_token(user: str, expires: float, timeout: int = 10800) -> str:
+    return "expires:{},id:1,signature:abc,site:site,timeout:{},user:{},v:2,xsrf:x".format(
+        int(expires), timeout, user
+    )
+
+
+class LoginRequestHandler(BaseHTTPRequestHandler):
+    """serves /data only to requests with the token of user "fresh", redirecting others to the
+    login page"""
+
+    protocol_version = "HTTP/1.1"
+    logged_out = 0
+    lock = Lock()
+
+    def do_GET(self):
+        if self.path.startswith("/webapps/login"):
+            self.send_body(b"login")
+        elif "user:fresh" in self.headers.get("Cookie", ""):
+            self.send_body(b"data")
+        else:
+            with LoginRequestHandler.lock:
+                LoginRequestHandler.logged_out += 1
+            self.send_response(302)
+            self.send_header("Location", "/webapps/login/?action=relogin")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+    def send_body(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestTokenCache(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, "auth", "tokens.json")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_parse_bbrouter(self):
+        fields = parse_bbrouter(make_token("u1", 1590000000))
+        self.assertEqual("1590000000", fields["expires"])
+        self.assertEqual("10800", fields["timeout"])
+        self.assertEqual("u1", fields["user"])
+
+    def test_get_token_expiry(self):
+        token = make_token("u1", 1590000000, timeout=600)
+        self.assertEqual(1590000000, get_token_expiry(token, 1589999500))
+        self.assertEqual(1589999000 + 600, get_token_expiry(token, 1589999000))
+        # expires in milliseconds
+        self.assertEqual(
+            1590000000, get_token_expiry(make_token("u1", 1590000000000), 1589999500)
+        )
+        self.assertIsNone(get_token_expiry("id:1,user:u1", time.time()))
+
+    def test_file_is_only_readable_by_owner(self):
+        TokenCache(self.path).put("u1", make_token("u1", time.time() + 3600))
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.path).st_mode))
+        self.assertEqual(0o700, stat.S_IMODE(os.stat(os.path.dirname(self.path)).st_mode))
+
+    def test_reuse_until_close_to_expiry(self):
+        now = time.time()
+        cache = TokenCache(self.path, margin=300)
+        cache.put("valid", make_token("valid", now + 3600))
+        cache.put("expiring", make_token("expiring", now + 60))
+        cache.put("idle", make_token("idle", now + 3600, timeout=600))
+        cache.entries["idle"]["used_at"] = now - 500
+        cache.touch("valid")
+
+        cache = TokenCache(self.path, margin=300)
+        self.assertEqual(make_token("valid", now + 3600), cache.get("valid"))
+        self.assertIsNone(cache.get("expiring"))
+        self.assertIsNone(cache.get("idle"))
+        self.assertIsNone(cache.get("unknown"))
+
+    def test_unreadable_cache_is_ignored(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, "w") as f:
+            f.write("{")
+        self.assertIsNone(TokenCache(self.path).get("u1"))
+
+
+class TestTokenManager(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache = TokenCache(os.path.join(self.temp_dir, "tokens.json"))
+        self.authenticated = []
+        set_client(Client())
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+        set_client(Client())
+
+    def authenticate(self, username: str, password: str) -> str:
+        self.authenticated.append(username)
+        return make_token("fresh", time.time() + 3600)
+
+    def test_reuses_cached_token(self):
+        token = make_token("cached", time.time() + 3600)
+        self.cache.put("u1", token)
+        manager = TokenManager("u1", "password", self.cache, self.authenticate)
+        self.assertEqual(token, manager.get_token())
+        self.assertEqual([], self.authenticated)
+
+    def test_authenticates_without_cached_token(self):
+        manager = TokenManager("u1", "password", self.cache, self.authenticate)
+        token = manager.get_token()
+        self.assertEqual(["u1"], self.authenticated)
+        with open(self.cache.path) as f:
+            self.assertEqual(token, json.load(f)["u1"]["BbRouter"])
+
+    def test_reauthenticates_when_logged_out(self):
+        port = get_free_port()
+        server = start_mock_server(port, LoginRequestHandler)
+        try:
+            LoginRequestHandler.logged_out = 0
+            stale = make_token("stale", time.time() + 3600)
+            self.cache.put("u1", stale)
+            manager = TokenManager("u1", "password", self.cache, self.authenticate)
+            self.assertEqual(stale, manager.get_token())
+
+            url = "http://localhost:{}/data".format(port)
+            response = make_GET_request(stale, url)
+            self.assertEqual(b"data", response.content)
+            self.assertEqual(["u1"], self.authenticated)
+            self.assertEqual(1, LoginRequestHandler.logged_out)
+            fresh = manager.get_token()
+            self.assertEqual(fresh, TokenCache(self.cache.path).get("u1"))
+
+            # callers still holding the stale token use the fresh one straight away
+            self.assertEqual(fresh, get_client().current_token(stale))
+            self.assertEqual(b"data", make_GET_request(stale, url).content)
+            self.assertEqual(1, LoginRequestHandler.logged_out)
+            self.assertEqual(["u1"], self.authenticated)
+        finally:
+            server.shutdown()
+
+    def test_unregistered_token_is_not_refreshed(self):
+        port = get_free_port()
+        server = start_mock_server(port, LoginRequestHandler)
+        try:
+            response = make_GET_request(
+                make_token("other", time.time() + 3600), "http://localhost:{}/data".format(port)
+            )
+            self.assertEqual(b"login", response.content)
+            self.assertEqual([], self.authenticated)
+        finally:
+            server.shutdown()
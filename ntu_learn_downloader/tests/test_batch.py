@@ -0,0 +1,129 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ntu_learn_downloader.batch import Account, batch_sync, mirror_tree, read_accounts
+from ntu_learn_downloader.scheduler import get_download_jobs
+from ntu_learn_downloader.storage import LinkCache, Storage
+
+DOWNLOAD_URL = "http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf"
+PREDOWNLOAD_LINK = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/xid-9478994_1"
+
+
+def get_course_folder():
+    return {
+        "type": "folder",
+        "name": "19S2-CE2003-DIGITAL SYSTEMS DESIGN",
+        "children": [
+            {
+                "type": "folder",
+                "name": "Tutorials",
+                "children": [
+                    {"type": "file", "name": "Tut2", "predownload_link": PREDOWNLOAD_LINK}
+                ],
+            },
+            {
+                "type": "folder",
+                "name": "Tutorial solutions",
+                "children": [
+                    {"type": "file", "name": "Tut2", "predownload_link": PREDOWNLOAD_LINK}
+                ],
+            },
+        ],
+    }
+
+
+def iter_course_folder(BbRouter, course_name, course_id, download_path, max_workers):
+    for job in get_download_jobs(get_course_folder(), download_path):
+        yield job.download_path, job.node
+
+
+class TestBatch(unittest.TestCase):
+    def test_read_accounts(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "accounts.csv")
+            with open(path, "w") as f:
+                f.write("# username,password,download_to\n")
+                f.write("a@student.main.ntu.edu.sg, password1, NTU/a\n")
+            self.assertEqual(
+                [Account("a@student.main.ntu.edu.sg", "password1", "NTU/a")],
+                read_accounts(path),
+            )
+
+    def test_mirror_tree_skips_partial_and_dummy_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src, dst = os.path.join(tmp_dir, "src"), os.path.join(tmp_dir, "dst")
+            os.makedirs(os.path.join(src, "Tutorials"))
+            for name in ["Tut1.pdf", "Tut2.pdf.part", ".Lecture1.mp4"]:
+                open(os.path.join(src, "Tutorials", name), "w").close()
+            mirror_tree(src, dst)
+            self.assertEqual(["Tut1.pdf"], os.listdir(os.path.join(dst, "Tutorials")))
+
+    def test_batch_sync_downloads_shared_files_once(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            accounts = [
+                Account("a", "password", os.path.join(tmp_dir, "a")),
+                Account("b", "password", os.path.join(tmp_dir, "b")),
+            ]
+            with patch(
+                "ntu_learn_downloader.batch.authenticate",
+                side_effect=lambda username, password: "BbRouter-" + username,
+            ), patch(
+                "ntu_learn_downloader.batch.get_courses",
+                return_value=[("19S2-CE2003-DIGITAL SYSTEMS DESIGN", "306327_1")],
+            ), patch(
+                "ntu_learn_downloader.batch.iter_download_dir", side_effect=iter_course_folder
+            ) as iter_download_dir, patch(
+                "ntu_learn_downloader.scheduler.get_file_download_link",
+                return_value=DOWNLOAD_URL,
+            ):
+                stats = batch_sync(accounts, file_workers=2)
+
+            iter_download_dir.assert_called_once()
+            self.assertEqual(1, stats.files)
+            for account in accounts:
+                for folder in ["Tutorials", "Tutorial solutions"]:
+                    path = os.path.join(
+                        account.download_to,
+                        "19S2-CE2003-DIGITAL SYSTEMS DESIGN",
+                        folder,
+                        "Tut2_CE2003_soln.pdf",
+                    )
+                    with open(path, "rb") as f:
+                        self.assertEqual(b"%PDF-1.4 Tut2_CE2003_soln", f.read())
+
+    def test_batch_sync_reuses_storage_and_link_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            accounts = [Account("a", "password", os.path.join(tmp_dir, "a"))]
+
+            def sync():
+                with patch(
+                    "ntu_learn_downloader.batch.authenticate",
+                    side_effect=lambda username, password: "BbRouter-" + username,
+                ), patch(
+                    "ntu_learn_downloader.batch.get_courses",
+                    return_value=[("19S2-CE2003-DIGITAL SYSTEMS DESIGN", "306327_1")],
+                ), patch(
+                    "ntu_learn_downloader.batch.get_download_dir",
+                    side_effect=lambda *args, **kwargs: get_course_folder(),
+                ), patch(
+                    "ntu_learn_downloader.scheduler.get_file_download_link",
+                    return_value=DOWNLOAD_URL,
+                ) as get_file_download_link:
+                    batch_sync(
+                        accounts,
+                        link_cache=LinkCache(accounts[0].download_to),
+                        storage_backend="json",
+                    )
+                return get_file_download_link
+
+            sync().assert_called_once()
+            saved = Storage(accounts[0].download_to).download_dir
+            self.assertEqual(
+                ["19S2-CE2003-DIGITAL SYSTEMS DESIGN"], [node["name"] for node in saved]
+            )
+            self.assertIsNotNone(LinkCache(accounts[0].download_to).get(PREDOWNLOAD_LINK))
+
+            # links saved by the previous sync are reused
+            sync().assert_not_called()
@@ -0,0 +1,30 @@
+import unittest
+
+from ntu_learn_downloader.tests.benchmark import compare, run_benchmark
+from ntu_learn_downloader.tests.microbenchmark import compare as compare_micro
+from ntu_learn_downloader.tests.microbenchmark import run_microbenchmark
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_run_benchmark(self):
+        result = run_benchmark(width=2, depth=1, files=2, file_size=1024, parser="lxml")
+        self.assertEqual(6, result["folders"])
+        self.assertEqual(12, result["files"])
+        stages = result["stages"]
+        # content ids page and every folder
+        self.assertEqual(7, stages["crawl"]["requests"])
+        # predownload link redirects to download link
+        self.assertEqual(24, stages["resolve"]["requests"])
+        self.assertEqual(12, stages["download"]["requests"])
+        self.assertEqual(12 * 1024, stages["download"]["bytes"])
+        self.assertEqual(12 * 1024, stages["stream"]["bytes"])
+        self.assertEqual(4, len(compare(result, result)))
+        self.assertGreater(result["peak_rss_kb"], 0)
+
+    def test_run_microbenchmark(self):
+        result = run_microbenchmark(number=1)
+        functions = result["functions"]
+        self.assertEqual(5, len(functions))
+        self.assertGreater(functions["is_download_link"]["inputs"], 0)
+        self.assertEqual(1, functions["parse_acustudio_page"]["inputs"])
+        self.assertEqual(5, len(compare_micro(result, result)))
@@ -0,0 +1,34 @@
+import unittest
+
+from ntu_learn_downloader.client import Client, configure_client, get_client, set_client
+
+
+class TestClient(unittest.TestCase):
+    def tearDown(self):
+        set_client(Client())
+
+    def test_get_client_is_shared(self):
+        self.assertIs(get_client(), get_client())
+
+    def test_configure_client(self):
+        client = configure_client(pool_size=4)
+        self.assertIs(client, get_client())
+        self.assertEqual(4, client.adapter._pool_maxsize)
+
+    def test_shared_session_does_not_store_cookies(self):
+        client = Client()
+        response = client.get(
+            "http://localhost:8082/webapps/blackboard/execute/globalCourseNavMenuSection",
+            params={
+                "cmd": "view",
+                "serviceLevel": "blackboard.data.course.Course$ServiceLevel:FULL",
+            },
+            cookies={"BbRouter": "token"},
+        )
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(0, len(client.session.cookies))
+
+    def test_new_session_shares_adapter(self):
+        client = Client()
+        session = client.new_session()
+        self.assertIs(client.adapter, session.get_adapter("https://ntulearn.ntu.edu.sg"))
@@ -0,0 +1,112 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from ntu_learn_downloader.api import (
+    get_download_dir,
+    iter_course_download_dirs,
+    iter_download_dir,
+)
+from ntu_learn_downloader.tests.benchmark import (
+    COURSE_ID,
+    COURSE_NAME,
+    generate_course,
+    get_handler,
+    get_mock_constants,
+)
+from ntu_learn_downloader.tests.mock_server import (
+    MOCK_CONSTANTS,
+    get_free_port,
+    start_mock_server,
+)
+from ntu_learn_downloader.crawler import load_folder_tree
+from ntu_learn_downloader.models import Folder
+from ntu_learn_downloader.scheduler import get_download_jobs
+
+BbRouter = "expires:1583963361,id:1A633268311FA435A6HT7K968346A658,signature:bqguvcoi0nh434robmpzervdtpomolh17rk3m9kxhiy0ozd5tzquhd0e4igldygm,site:5ecaf6aa-60ca-4431-89e7-6ed4c720440d,timeout:10800,user:6itk73437hq6tbcznl60t354qc2vn2py,v:2,xsrf:y3d3nzrg-c301-4455-a5a3-hpjdect1jyil"
+
+
+def make_tutorials_folder():
+    return Folder(
+        name="Tutorials",
+        link="/webapps/blackboard/content/listContent.jsp?course_id=_306327_1&content_id=_1875198_1",
+        details="",
+        children=None,
+    )
+
+
+class TestCrawler(unittest.TestCase):
+    def test_load_folder_tree_matches_serial_serialize(self):
+        with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
+            expected = make_tutorials_folder().serialize(BbRouter)
+
+            folder = make_tutorials_folder()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                load_folder_tree(BbRouter, folder, executor)
+            self.assertIsNotNone(folder.children)
+            self.assertDictEqual(expected, folder.serialize(BbRouter))
+
+    def test_iter_download_dir_matches_get_download_dir(self):
+        port = get_free_port()
+        constants = get_mock_constants(port)
+        fixtures, num_files = generate_course(constants["NTULEARN_URL"], 2, 2, 2, 16)
+        server = start_mock_server(port, get_handler(fixtures))
+        try:
+            with patch.dict("ntu_learn_downloader.api.__dict__", constants):
+                course = get_download_dir(BbRouter, COURSE_NAME, COURSE_ID, max_workers=4)
+                expected = [
+                    (j.download_path, j.node) for j in get_download_jobs(course, "NTU")
+                ]
+                nodes = list(
+                    iter_download_dir(BbRouter, COURSE_NAME, COURSE_ID, "NTU", max_workers=4)
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(num_files, len(nodes))
+        key = lambda path_node: (path_node[0], path_node[1]["name"])
+        self.assertEqual(sorted(expected, key=key), sorted(nodes, key=key))
+
+    def test_iter_download_dir_with_course_id_from_get_courses(self):
+        # get_courses returns ids without the leading underscore of the ids in listContent links
+        course_id = "900000_1"
+        port = get_free_port()
+        constants = get_mock_constants(port)
+        fixtures, num_files = generate_course(
+            constants["NTULEARN_URL"], 2, 1, 2, 16, course_id=course_id
+        )
+        server = start_mock_server(port, get_handler(fixtures))
+        try:
+            with patch.dict("ntu_learn_downloader.api.__dict__", constants):
+                course = get_download_dir(BbRouter, COURSE_NAME, course_id, max_workers=2)
+                nodes = list(
+                    iter_download_dir(BbRouter, COURSE_NAME, course_id, "NTU", max_workers=2)
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(num_files, len(nodes))
+        self.assertEqual(num_files, len(get_download_jobs(course, "NTU")))
+
+    def test_iter_course_download_dirs_keeps_course_order(self):
+        port = get_free_port()
+        constants = get_mock_constants(port)
+        fixtures, _num_files = generate_course(constants["NTULEARN_URL"], 2, 1, 2, 16)
+        server = start_mock_server(port, get_handler(fixtures))
+        courses = [("{} {}".format(COURSE_NAME, i), COURSE_ID) for i in range(5)]
+        try:
+            with patch.dict("ntu_learn_downloader.api.__dict__", constants):
+                expected = get_download_dir(BbRouter, COURSE_NAME, COURSE_ID)
+                results = list(
+                    iter_course_download_dirs(BbRouter, courses, max_workers=2, course_workers=3)
+                )
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(courses, [(name, course_id) for name, course_id, _ in results])
+        for name, _course_id, course in results:
+            self.assertEqual(name, course["name"])
+            self.assertEqual(expected["children"], course["children"])
@@ -0,0 +1,83 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from ntu_learn_downloader.api import get_contents
+from ntu_learn_downloader.metrics import (
+    BLOB_DOWNLOAD,
+    LIST_CONTENT,
+    Metrics,
+    get_metrics,
+    set_metrics,
+)
+from ntu_learn_downloader.tests.mock_server import MOCK_CONSTANTS
+from ntu_learn_downloader.utils import download
+
+BbRouter = "expires:1583963361,id:1A633268311FA435A6HT7K968346A658,signature:bqguvcoi0nh434robmpzervdtpomolh17rk3m9kxhiy0ozd5tzquhd0e4igldygm,site:5ecaf6aa-60ca-4431-89e7-6ed4c720440d,timeout:10800,user:6itk73437hq6tbcznl60t354qc2vn2py,v:2,xsrf:y3d3nzrg-c301-4455-a5a3-hpjdect1jyil"
+
+DOWNLOAD_URL = "http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf"
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.previous = get_metrics()
+        self.metrics = Metrics()
+        set_metrics(self.metrics)
+
+    def tearDown(self):
+        set_metrics(self.previous)
+
+    def test_record_request(self):
+        self.metrics.record_request(LIST_CONTENT, 0.2, 200, 100, retries=1)
+        self.metrics.record_request(LIST_CONTENT, 0.4, 503)
+        self.metrics.record_request(LIST_CONTENT, 3.0, None)
+        m = self.metrics.to_dict()["requests"][LIST_CONTENT]
+        self.assertEqual(3, m["count"])
+        self.assertEqual(2, m["errors"])
+        self.assertEqual(1, m["retries"])
+        self.assertEqual(100, m["bytes"])
+        self.assertAlmostEqual(3.0, m["max_seconds"])
+        self.assertEqual({"0": 1, "200": 1, "503": 1}, m["statuses"])
+
+    def test_to_prometheus(self):
+        self.metrics.record_request(LIST_CONTENT, 0.2, 200, 100)
+        self.metrics.record_request(LIST_CONTENT, 0.4, 200, 50)
+        self.metrics.record_parse(LIST_CONTENT, 0.01)
+        text = self.metrics.to_prometheus()
+        self.assertIn('ntu_learn_requests_total{category="list_content",status="200"} 2', text)
+        self.assertIn(
+            'ntu_learn_request_duration_seconds_bucket{category="list_content",le="0.25"} 1',
+            text,
+        )
+        self.assertIn(
+            'ntu_learn_request_duration_seconds_bucket{category="list_content",le="+Inf"} 2',
+            text,
+        )
+        self.assertIn('ntu_learn_response_bytes_total{category="list_content"} 150', text)
+        self.assertIn('ntu_learn_parse_duration_seconds_count{page="list_content"} 1', text)
+
+    def test_requests_are_recorded_by_category(self):
+        with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
+            get_contents(BbRouter, "_306327_1", "_1875198_1")
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            download(BbRouter, DOWNLOAD_URL, os.path.join(tmp_dir, "Tut2_CE2003_soln.pdf"))
+
+            data = self.metrics.to_dict()
+            self.assertEqual(1, data["requests"][LIST_CONTENT]["count"])
+            self.assertEqual({"200": 1}, data["requests"][LIST_CONTENT]["statuses"])
+            self.assertGreater(data["requests"][LIST_CONTENT]["bytes"], 0)
+            self.assertEqual(1, data["parses"][LIST_CONTENT]["count"])
+            self.assertEqual(25, data["requests"][BLOB_DOWNLOAD]["bytes"])
+
+            path = os.path.join(tmp_dir, "metrics.json")
+            self.metrics.dump(path)
+            with open(path) as f:
+                self.assertEqual(data, json.load(f))
+
+    def test_disabled(self):
+        set_metrics(None)
+        with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
+            self.assertTrue(get_contents(BbRouter, "_306327_1", "_1875198_1"))
+        self.assertEqual({}, self.metrics.to_dict()["requests"])
@@ -5,7 +5,8 @@ from ntu_learn_downloader.tests.mock_server import MOCK_CONSTANTS
 from ntu_learn_downloader import get_courses, get_content_ids
 
 from ntu_learn_downloader.api import parse_content_page
-from ntu_learn_downloader.models import Folder, Doc, RecordedLecture
+from ntu_learn_downloader.models import Folder, Doc, RecordedLecture, to_model
+from ntu_learn_downloader.smodels import SDoc, SFolder, SLecture
 
 BbRouter = "expires:1583963361,id:1A633268311FA435A6HT7K968346A658,signature:bqguvcoi0nh434robmpzervdtpomolh17rk3m9kxhiy0ozd5tzquhd0e4igldygm,site:5ecaf6aa-60ca-4431-89e7-6ed4c720440d,timeout:10800,user:6itk73437hq6tbcznl60t354qc2vn2py,v:2,xsrf:y3d3nzrg-c301-4455-a5a3-hpjdect1jyil"
 
@@ -312,3 +313,28 @@ class TestModels(unittest.TestCase):
         with patch.dict("ntu_learn_downloader.api.__dict__", MOCK_CONSTANTS):
             result = folder.serialize(BbRouter)
             self.assertDictEqual(expected, result)
+
+    def test_to_model(self):
+        smodel = SFolder(
+            "Tutorials",
+            None,
+            "",
+            [SDoc("Tut1", "/bbcswebdav/pid-1-dt-content-rid-2_1/xid-2_1"), SLecture("Lec1", "/lec")],
+        )
+        folder = to_model(smodel)
+        expected = Folder(
+            name="Tutorials",
+            link=None,
+            details="",
+            children=[
+                Doc(name="Tut1", link="/bbcswebdav/pid-1-dt-content-rid-2_1/xid-2_1"),
+                RecordedLecture(name="Lec1", predownload_link="/lec"),
+            ],
+        )
+        self.assertEqual(expected, folder)
+        self.assertNotEqual(Folder("Tutorials", None, "", expected.children[:1]), folder)
+        self.assertNotEqual(Doc(name="Lec1", link="/lec"), folder.children[1])
+        # nodes keep their attributes in slots
+        for node in [folder] + folder.children:
+            self.assertFalse(hasattr(node, "__dict__"))
+        self.assertIn("name= 'Tut1'", repr(folder.children[0]))
@@ -0,0 +1,79 @@
+import glob
+import json
+import os
+import unittest
+
+import lxml.html
+from bs4 import BeautifulSoup
+
+from ntu_learn_downloader import parsing
+from ntu_learn_downloader.parsing import (
+    lxml_parse_content_ids_page,
+    lxml_parse_content_page,
+    lxml_parse_courses_page,
+    parse_content_html,
+    parse_content_ids_page,
+    parse_content_page,
+    parse_courses_page,
+    set_parser_backend,
+)
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+COURSES_HTML = """
+<ul class="portletList-img courseListing coursefakeclass">
+  <li><a href=" /webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url=" onclick="javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url='); return false;" target="_top">19S2-CE2003-LEC</a></li>
+  <li><a href=" /webapps/blackboard/execute/launcher?type=Course&id=_306327_1&url=" onclick="javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_306327_1&url='); return false;" target="_top"><span class="hideoff">(Unavailable) </span>19S2-CE2006-SSP</a></li>
+  <li><a href="#" onclick="javascript:void(0);">Broken</a></li>
+</ul>
+"""
+
+
+def get_listContent_fixtures():
+    for path in sorted(glob.glob(os.path.join(FIXTURES_DIR, "*.json"))):
+        with open(path) as f:
+            fixture = json.load(f)
+        if fixture["request"]["request_path"].endswith("listContent.jsp"):
+            yield os.path.basename(path), fixture["response"]["body"]
+
+
+class TestParsing(unittest.TestCase):
+    def tearDown(self):
+        set_parser_backend("bs4")
+
+    def test_lxml_content_page_matches_bs4(self):
+        fixtures = list(get_listContent_fixtures())
+        self.assertTrue(fixtures)
+        for name, html in fixtures:
+            with self.subTest(fixture=name):
+                expected = parse_content_page(BeautifulSoup(html, features="lxml"))
+                actual = lxml_parse_content_page(lxml.html.document_fromstring(html))
+                self.assertEqual(expected, actual)
+
+    def test_lxml_content_ids_page_matches_bs4(self):
+        for name, html in get_listContent_fixtures():
+            if "courseMenuPalette_contents" not in html:
+                continue
+            with self.subTest(fixture=name):
+                expected = parse_content_ids_page(BeautifulSoup(html, features="lxml"))
+                actual = lxml_parse_content_ids_page(lxml.html.document_fromstring(html))
+                self.assertTrue(expected)
+                self.assertEqual(expected, actual)
+
+    def test_lxml_courses_page_matches_bs4(self):
+        expected = parse_courses_page(BeautifulSoup(COURSES_HTML, features="lxml"))
+        actual = lxml_parse_courses_page(lxml.html.document_fromstring(COURSES_HTML))
+        self.assertEqual(expected, actual)
+        self.assertEqual(
+            [("19S2-CE2003-LEC", "302242_1"), ("(Unavailable) ", "306327_1")], actual
+        )
+
+    def test_set_parser_backend(self):
+        _name, html = next(get_listContent_fixtures())
+        expected = parse_content_html(html)
+        set_parser_backend("lxml")
+        self.assertEqual("lxml", parsing.parser_backend)
+        self.assertEqual(expected, parse_content_html(html))
+        with self.assertRaises(ValueError):
+            set_parser_backend("html5lib")
+        self.assertEqual("lxml", parsing.parser_backend)
@@ -0,0 +1,144 @@
+import time
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler
+from threading import Lock
+
+import requests
+
+from ntu_learn_downloader.client import Client
+from ntu_learn_downloader.ratelimit import HostLimiter, RateLimiter, get_retry_after
+from ntu_learn_downloader.tests.mock_server import get_free_port, start_mock_server
+
+
+def make_response(status_code: int, headers=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return response
+
+
+class ThrottlingRequestHandler(BaseHTTPRequestHandler):
+    """responds 503 with Retry-After to the first `throttled` requests, then 200"""
+
+    protocol_version = "HTTP/1.1"
+    throttled = 0
+    served = []
+    lock = Lock()
+
+    def do_GET(self):
+        with ThrottlingRequestHandler.lock:
+            ThrottlingRequestHandler.served.append(time.monotonic())
+            throttle = len(ThrottlingRequestHandler.served) <= ThrottlingRequestHandler.throttled
+        if throttle:
+            self.send_response(503)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        else:
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestRateLimit(unittest.TestCase):
+    def test_get_retry_after(self):
+        self.assertEqual(5, get_retry_after(make_response(429, {"Retry-After": "5"})))
+        self.assertIsNone(get_retry_after(make_response(429)))
+        self.assertIsNone(get_retry_after(make_response(429, {"Retry-After": "soon"})))
+        date = formatdate(time.time() + 30, usegmt=True)
+        self.assertAlmostEqual(30, get_retry_after(make_response(503, {"Retry-After": date})), delta=2)
+
+    def test_token_bucket(self):
+        limiter = HostLimiter(rate=50, burst=5, max_concurrency=10)
+        start = time.monotonic()
+        for _ in range(15):
+            limiter.release(limiter.acquire(), make_response(200))
+        # 5 requests in the burst, then 10 at 50 per second
+        self.assertGreaterEqual(time.monotonic() - start, 0.18)
+
+    def test_additive_increase_multiplicative_decrease(self):
+        limiter = HostLimiter(rate=None, max_concurrency=8, backoff=0)
+        # requests in flight when the first throttled response arrives only halve the limit once
+        started = [limiter.acquire() for _ in range(4)]
+        for s in started:
+            limiter.release(s, make_response(503))
+        self.assertEqual(4, limiter.limit)
+
+        limiter.release(limiter.acquire(), make_response(429))
+        self.assertEqual(2, limiter.limit)
+
+        for _ in range(10):
+            limiter.release(limiter.acquire(), make_response(200))
+        self.assertGreater(limiter.limit, 4)
+        self.assertLessEqual(limiter.limit, 8)
+
+    def test_concurrency_limit(self):
+        limiter = HostLimiter(rate=None, max_concurrency=2)
+        limiter.acquire()
+        limiter.acquire()
+        self.assertIsNone(limiter.get_wait(time.monotonic()))
+
+    def test_hosts_are_limited_separately(self):
+        rate_limiter = RateLimiter()
+        a = rate_limiter.get_host_limiter("https://ntulearn.ntu.edu.sg/webapps/portal")
+        self.assertIs(a, rate_limiter.get_host_limiter("https://NTULEARN.ntu.edu.sg/bbcswebdav/x"))
+        self.assertIsNot(a, rate_limiter.get_host_limiter("https://loginfs.ntu.edu.sg/adfs/ls/"))
+
+    def test_client_honours_retry_after(self):
+        port = get_free_port()
+        server = start_mock_server(port, ThrottlingRequestHandler)
+        try:
+            ThrottlingRequestHandler.throttled = 1
+            ThrottlingRequestHandler.served = []
+            client = Client(rate_limiter=RateLimiter(rate=None))
+            response = client.get("http://localhost:{}/".format(port))
+            self.assertEqual(200, response.status_code)
+            served = ThrottlingRequestHandler.served
+            self.assertEqual(2, len(served))
+            self.assertGreaterEqual(served[1] - served[0], 0.9)
+        finally:
+            server.shutdown()
+
+    def test_client_gives_up_after_throttle_retries(self):
+        port = get_free_port()
+        server = start_mock_server(port, ThrottlingRequestHandler)
+        try:
+            ThrottlingRequestHandler.throttled = 10
+            ThrottlingRequestHandler.served = []
+            client = Client(rate_limiter=RateLimiter(rate=None), throttle_retries=1)
+            response = client.get("http://localhost:{}/".format(port))
+            self.assertEqual(503, response.status_code)
+            self.assertEqual(2, len(ThrottlingRequestHandler.served))
+        finally:
+            server.shutdown()
+
+    def test_streamed_response_holds_slot_until_closed(self):
+        client = Client(rate_limiter=RateLimiter(rate=None, max_concurrency=2))
+        url = "http://localhost:8082/content/synthetic/media/1.mp4"
+        limiter = client.rate_limiter.get_host_limiter(url)
+        with client.get(url, stream=True):
+            self.assertEqual(1, limiter.active)
+        self.assertEqual(0, limiter.active)
+        client.get(url, headers={"Range": "bytes=0-0"})
+        self.assertEqual(0, limiter.active)
+
+    def test_client_limits_requests_of_a_new_session(self):
+        port = get_free_port()
+        server = start_mock_server(port, ThrottlingRequestHandler)
+        try:
+            ThrottlingRequestHandler.throttled = 1
+            ThrottlingRequestHandler.served = []
+            client = Client(rate_limiter=RateLimiter(rate=None))
+            # e.g. the authentication flow, which keeps cookies in its own session
+            response = client.get(
+                "http://localhost:{}/".format(port), session=client.new_session()
+            )
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(2, len(ThrottlingRequestHandler.served))
+        finally:
+            server.shutdown()
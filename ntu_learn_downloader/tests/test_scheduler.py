@@ -0,0 +1,423 @@
+import os
+import tempfile
+import time
+import unittest
+from typing import List
+from http.server import BaseHTTPRequestHandler
+from unittest.mock import patch
+
+from ntu_learn_downloader.scheduler import (
+    DownloadJob,
+    DownloadScheduler,
+    FileIndex,
+    LectureResolver,
+    ResolvedLecture,
+    get_download_jobs,
+)
+from ntu_learn_downloader.storage import BlobStore, LinkCache, Storage
+from ntu_learn_downloader.tests.mock_server import get_free_port, start_mock_server
+
+download_dir = {
+    "type": "folder",
+    "name": "CE2003",
+    "children": [
+        {
+            "type": "folder",
+            "name": "Tutorials",
+            "children": [
+                {
+                    "type": "file",
+                    "name": "Tut1_CE2003_soln",
+                    "predownload_link": "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875202-dt-content-rid-9478989_1/xid-9478989_1",
+                },
+                {
+                    "type": "recorded_lecture",
+                    "name": "tut4: intro",
+                    "predownload_link": "/webapps/Acu-AcuLe@rn-BB5dcb73f79ba4c/am/start_play_studio.jsp?sn=1",
+                },
+            ],
+        }
+    ],
+}
+
+
+class TestScheduler(unittest.TestCase):
+    def test_get_download_jobs(self):
+        jobs = get_download_jobs(download_dir, "NTU")
+        self.assertEqual(["file", "recorded_lecture"], [j.node["type"] for j in jobs])
+        expected_path = os.path.join("NTU", "CE2003", "Tutorials", "")
+        self.assertTrue(all(j.download_path == expected_path for j in jobs))
+
+        jobs = get_download_jobs(download_dir, "NTU", ignore_recorded_lectures=True)
+        self.assertEqual(["file"], [j.node["type"] for j in jobs])
+
+    def test_declined_recorded_lecture_creates_dummy_file(self):
+        prompts = []
+
+        def confirm(video_name, video_size):
+            prompts.append((video_name, video_size))
+            return False
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = get_download_jobs(download_dir, tmp_dir, ignore_files=True)
+            scheduler = DownloadScheduler("BbRouter", confirm=confirm)
+            with patch(
+                "ntu_learn_downloader.scheduler.get_recorded_lecture_download_link",
+                return_value="http://localhost:8082/1.mp4",
+            ), patch(
+                "ntu_learn_downloader.scheduler.get_download_info",
+                return_value=(7634575, True),
+            ):
+                scheduler.run(jobs)
+
+            self.assertEqual([("tut4 intro.mp4", "7.28 MB")], prompts)
+            dummy_file = os.path.join(tmp_dir, "CE2003", "Tutorials", ".tut4 intro.mp4")
+            self.assertTrue(os.path.exists(dummy_file))
+            self.assertEqual(0, scheduler.stats.files)
+
+    def test_stored_download_link_skips_head_request(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = get_download_jobs(download_dir, tmp_dir, ignore_recorded_lectures=True)
+            node = jobs[0].node
+            node["download_link"] = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875202-dt-content-rid-9478989_1/courses/19S2-CE2003-LEC/Tut1_CE2003_soln.pdf"
+            node["filename"] = "Tut1_CE2003_soln.pdf"
+            os.makedirs(jobs[0].download_path)
+            open(os.path.join(jobs[0].download_path, "Tut1_CE2003_soln.pdf"), "w").close()
+
+            scheduler = DownloadScheduler("BbRouter")
+            with patch(
+                "ntu_learn_downloader.scheduler.get_file_download_link"
+            ) as get_file_download_link:
+                scheduler.run(jobs)
+                get_file_download_link.assert_not_called()
+            del node["download_link"], node["filename"]
+
+
+    def test_blob_store_downloads_same_rid_once(self):
+        predownload_link = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/xid-9478994_1"
+        tree = {
+            "type": "folder",
+            "name": "CE2003",
+            "children": [
+                {
+                    "type": "folder",
+                    "name": folder,
+                    "children": [
+                        {"type": "file", "name": "Tut2", "predownload_link": predownload_link}
+                    ],
+                }
+                for folder in ["Tutorials", "Solutions"]
+            ],
+        }
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = BlobStore(tmp_dir)
+            scheduler = DownloadScheduler("BbRouter", blob_index=store)
+            with patch(
+                "ntu_learn_downloader.scheduler.get_file_download_link",
+                return_value="http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf",
+            ):
+                scheduler.run(get_download_jobs(tree, tmp_dir))
+
+            self.assertEqual(1, scheduler.stats.files)
+            paths = [
+                os.path.join(tmp_dir, "CE2003", folder, "Tut2_CE2003_soln.pdf")
+                for folder in ["Tutorials", "Solutions"]
+            ]
+            self.assertTrue(os.path.samefile(paths[0], paths[1]))
+            self.assertTrue(os.path.samefile(paths[0], store.get("9478994_1")))
+
+    def test_interrupted_sync_keeps_completed_downloads(self):
+        download_link = "http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf"
+        predownload_link = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/xid-9478994_1"
+
+        def get_tree():
+            return {
+                "type": "folder",
+                "name": "CE2003",
+                "children": [{"type": "file", "name": "Tut2", "predownload_link": predownload_link}],
+            }
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            scheduler = DownloadScheduler("BbRouter", storage=Storage(tmp_dir))
+            with patch(
+                "ntu_learn_downloader.scheduler.get_file_download_link",
+                return_value=download_link,
+            ):
+                scheduler.run(get_download_jobs(get_tree(), tmp_dir))
+            # killed before the course was saved, the next sync replays the journal
+            tree = get_tree()
+            Storage(tmp_dir).merge_download_dir([tree])
+            self.assertEqual(download_link, tree["children"][0]["download_link"])
+            self.assertEqual("Tut2_CE2003_soln.pdf", tree["children"][0]["filename"])
+
+    def test_same_destination_is_downloaded_once(self):
+        nodes = [
+            {
+                "type": "file",
+                "name": "Tut1",
+                "predownload_link": "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-{}-dt-content-rid-{}_1/xid-{}_1".format(i, i, i),
+                "download_link": "http://localhost:8082/{}/Tut1.pdf".format(i),
+                "filename": "Tut1.pdf",
+            }
+            for i in range(4)
+        ]
+        started = []
+
+        def download(BbRouter, url, destination, **kwargs):
+            started.append(destination)
+            time.sleep(0.05)
+            open(destination, "w").close()
+            return True
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = [DownloadJob(node, tmp_dir, None, None, False) for node in nodes]
+            with patch("ntu_learn_downloader.scheduler.download", side_effect=download):
+                DownloadScheduler("BbRouter", file_workers=4).run(jobs)
+        self.assertEqual([os.path.join(tmp_dir, "Tut1.pdf")], started)
+
+
+class TestFileIndex(unittest.TestCase):
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            folder = os.path.join(tmp_dir, "CE2003", "Tutorials")
+            os.makedirs(folder)
+            with open(os.path.join(folder, "Tut1.pdf"), "w") as f:
+                f.write("abc")
+            open(os.path.join(folder, ".tut4 intro.mp4"), "w").close()
+
+            index = FileIndex()
+            index.scan(os.path.join(tmp_dir, "CE2003"))
+            self.assertTrue(index.exists(os.path.join(folder, "Tut1.pdf")))
+            self.assertTrue(index.exists(os.path.join(folder, ".tut4 intro.mp4")))
+            self.assertTrue(index.exists(folder))
+            self.assertFalse(index.exists(os.path.join(folder, "Tut2.pdf")))
+            self.assertEqual(3, index.get_size(os.path.join(folder, "Tut1.pdf")))
+            self.assertIsNone(index.get_size(os.path.join(folder, "Tut2.pdf")))
+
+            # answered from the index, files created since the scan are only seen once added
+            new_file = os.path.join(tmp_dir, "CE2003", "Labs", "Lab1.pdf")
+            os.makedirs(os.path.dirname(new_file))
+            open(new_file, "w").close()
+            with patch("os.path.exists") as exists:
+                self.assertFalse(index.exists(new_file))
+                exists.assert_not_called()
+            index.add(new_file, 0)
+            self.assertTrue(index.exists(new_file))
+            self.assertTrue(index.exists(os.path.dirname(new_file)))
+
+            # outside of the scanned directory
+            self.assertTrue(index.exists(os.path.join(tmp_dir, "CE2003")))
+            self.assertFalse(index.exists(os.path.join(tmp_dir, "CE2004")))
+
+    def test_scheduler_skips_existing_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            jobs = get_download_jobs(download_dir, tmp_dir)
+            jobs[0].node["download_link"] = "http://localhost:8082/Tut1_CE2003_soln.pdf"
+            jobs[0].node["filename"] = "Tut1_CE2003_soln.pdf"
+            os.makedirs(jobs[0].download_path)
+            open(os.path.join(jobs[0].download_path, "Tut1_CE2003_soln.pdf"), "w").close()
+            open(os.path.join(jobs[0].download_path, ".tut4 intro.mp4"), "w").close()
+
+            index = FileIndex()
+            index.scan(tmp_dir)
+            scheduler = DownloadScheduler("BbRouter", file_index=index)
+            with patch("ntu_learn_downloader.scheduler.download") as download, patch(
+                "ntu_learn_downloader.scheduler.get_recorded_lecture_download_link"
+            ) as get_link, patch("os.path.exists") as exists:
+                scheduler.run(jobs)
+                download.assert_not_called()
+                get_link.assert_not_called()
+                exists.assert_not_called()
+            del jobs[0].node["download_link"], jobs[0].node["filename"]
+
+
+
+class VersionedFileHandler(BaseHTTPRequestHandler):
+    """serves body with an ETag derived from version, counting requests by method"""
+
+    protocol_version = "HTTP/1.1"
+    body = b"version 1"
+    version = 1
+    requests = []
+
+    def do_HEAD(self):
+        self.send_file(False)
+
+    def do_GET(self):
+        self.send_file(True)
+
+    def send_file(self, send_body: bool):
+        VersionedFileHandler.requests.append(self.command)
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(self.body)))
+        self.send_header("ETag", '"v{}"'.format(self.version))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestVerify(unittest.TestCase):
+    def setUp(self):
+        self.port = get_free_port()
+        self.server = start_mock_server(self.port, VersionedFileHandler)
+        VersionedFileHandler.body, VersionedFileHandler.version = b"version 1", 1
+        VersionedFileHandler.requests = []
+        self.node = {
+            "type": "file",
+            "name": "Tut1",
+            "predownload_link": "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1-dt-content-rid-2_1/xid-2_1",
+            "download_link": "http://localhost:{}/Tut1.pdf".format(self.port),
+            "filename": "Tut1.pdf",
+        }
+
+    def tearDown(self):
+        self.server.shutdown()
+
+    def sync(self, download_path: str, verify: bool = True) -> List[str]:
+        VersionedFileHandler.requests = []
+        DownloadScheduler("BbRouter", verify=verify).run(
+            [DownloadJob(self.node, download_path, None, None, False)]
+        )
+        return VersionedFileHandler.requests
+
+    def test_redownloads_truncated_and_updated_files(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "Tut1.pdf")
+            self.assertEqual(["GET"], self.sync(tmp_dir))
+            self.assertEqual(9, self.node["size"])
+            self.assertEqual('"v1"', self.node["etag"])
+
+            # unchanged, checked with a HEAD only
+            self.assertEqual(["HEAD"], self.sync(tmp_dir))
+
+            # truncated, the recorded size differs without asking the server
+            with open(path, "r+b") as f:
+                f.truncate(4)
+            self.assertEqual(["GET"], self.sync(tmp_dir))
+            with open(path, "rb") as f:
+                self.assertEqual(b"version 1", f.read())
+
+            # updated on the server with the same size
+            VersionedFileHandler.body, VersionedFileHandler.version = b"version 2", 2
+            self.assertEqual([], self.sync(tmp_dir, verify=False))
+            self.assertEqual(["HEAD", "GET"], self.sync(tmp_dir))
+            with open(path, "rb") as f:
+                self.assertEqual(b"version 2", f.read())
+            self.assertEqual('"v2"', self.node["etag"])
+
+    def test_redownloaded_file_replaces_blob_of_its_rid(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            store = BlobStore(tmp_dir)
+            tutorials = os.path.join(tmp_dir, "Tutorials")
+            DownloadScheduler("BbRouter", blob_index=store).run(
+                [DownloadJob(self.node, tutorials, None, None, False)]
+            )
+
+            VersionedFileHandler.body, VersionedFileHandler.version = b"version 2", 2
+            DownloadScheduler("BbRouter", blob_index=store, verify=True).run(
+                [DownloadJob(self.node, tutorials, None, None, False)]
+            )
+            with open(store.get("2_1"), "rb") as f:
+                self.assertEqual(b"version 2", f.read())
+
+            # another folder linking the same rid gets the new content
+            solutions = os.path.join(tmp_dir, "Solutions")
+            node = {key: self.node[key] for key in ("type", "name", "predownload_link")}
+            node.update(download_link=self.node["download_link"], filename="Tut1.pdf")
+            DownloadScheduler("BbRouter", blob_index=store).run(
+                [DownloadJob(node, solutions, None, None, False)]
+            )
+            with open(os.path.join(solutions, "Tut1.pdf"), "rb") as f:
+                self.assertEqual(b"version 2", f.read())
+
+    def test_validators_are_saved_with_the_course(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            self.sync(tmp_dir, verify=False)
+            storage = Storage(tmp_dir)
+            storage.save_download_dir([{"type": "folder", "name": "CE2003", "children": [self.node]}])
+            node = dict(self.node)
+            for field in ("download_link", "filename", "size", "etag"):
+                del node[field]
+            Storage(tmp_dir).merge_download_dir([{"type": "folder", "name": "CE2003", "children": [node]}])
+            self.assertEqual(9, node["size"])
+            self.assertEqual('"v1"', node["etag"])
+
+
+def make_lectures(n):
+    return [
+        {
+            "type": "recorded_lecture",
+            "name": "Lecture {}".format(i),
+            "predownload_link": "/webapps/Acu-AcuLe@rn-BB5dcb73f79ba4c/am/start_play_studio.jsp?sn={}".format(i),
+        }
+        for i in range(n)
+    ]
+
+
+def get_download_link(BbRouter, predownload_link):
+    return "http://localhost:8082/{}/1.mp4".format(predownload_link.rsplit("=", 1)[1])
+
+
+class TestLectureResolver(unittest.TestCase):
+    def test_prefetches_within_lookahead(self):
+        lectures = make_lectures(6)
+        resolver = LectureResolver("BbRouter", lookahead=2)
+        with patch(
+            "ntu_learn_downloader.scheduler.get_recorded_lecture_download_link",
+            side_effect=get_download_link,
+        ) as get_link, patch(
+            "ntu_learn_downloader.scheduler.get_download_info", return_value=(1024, True)
+        ):
+            for node in lectures:
+                resolver.add(node)
+            self.assertEqual(2, len(resolver.prefetched))
+            self.assertEqual(
+                ResolvedLecture("http://localhost:8082/0/1.mp4", 1024, True),
+                resolver.get(lectures[0]),
+            )
+            # claiming a lecture moves the window along
+            self.assertEqual(2, len(resolver.prefetched))
+            self.assertEqual(3, len(resolver.queue))
+            # lectures outside the window are resolved when claimed
+            resolver.get(lectures[5])
+            resolver.discard(lectures[1])
+            resolver.shutdown()
+
+        # lecture 1 may have been resolved before it was discarded, lecture 4 was never in the window
+        resolved = {call[0][1][-1] for call in get_link.call_args_list}
+        self.assertTrue({"0", "2", "3", "5"} <= resolved)
+        self.assertNotIn("4", resolved)
+        self.assertEqual("http://localhost:8082/5/1.mp4", lectures[5]["download_link"])
+        self.assertEqual("Lecture 5.mp4", lectures[5]["filename"])
+        self.assertEqual(1024, lectures[5]["size"])
+        self.assertNotIn("download_link", lectures[4])
+
+    def test_link_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            link_cache = LinkCache(tmp_dir)
+            with patch(
+                "ntu_learn_downloader.scheduler.get_recorded_lecture_download_link",
+                side_effect=get_download_link,
+            ), patch(
+                "ntu_learn_downloader.scheduler.get_download_info", return_value=(1024, True)
+            ):
+                LectureResolver("BbRouter", link_cache=link_cache).get(make_lectures(1)[0])
+
+            # the download link is reused, the size is HEADed again as the video may have changed
+            with patch(
+                "ntu_learn_downloader.scheduler.get_recorded_lecture_download_link"
+            ) as get_link, patch(
+                "ntu_learn_downloader.scheduler.get_download_info", return_value=(2048, True)
+            ) as get_download_info:
+                resolved = LectureResolver("BbRouter", link_cache=link_cache).get(
+                    make_lectures(1)[0]
+                )
+                get_link.assert_not_called()
+                get_download_info.assert_called_once_with("http://localhost:8082/0/1.mp4")
+            self.assertEqual(ResolvedLecture("http://localhost:8082/0/1.mp4", 2048, True), resolved)
+            entry = link_cache.get_entry(make_lectures(1)[0]["predownload_link"])
+            self.assertEqual(2048, entry["size"])
+
@@ -3,9 +3,10 @@ import shutil
 import os
 import json
 from pathlib import Path
+from unittest.mock import patch
 
 from typing import Dict, List
-from ntu_learn_downloader import Storage
+from ntu_learn_downloader import BlobStore, LinkCache, SQLiteStorage, Storage
 
 temp_dir = "test/temp/"  # TODO this path should be absolute
 storage_dir = os.path.join(temp_dir, ".ntu_learn_downloader", "")
@@ -132,8 +133,352 @@ class TestExistingStorage(BaseTestStorage):
         result = next_storage.download_dir
         self.assertObjEquals(expected, result, is_saved=True)
 
-            
-        
 
+class TestIncrementalStorage(BaseTestStorage):
+    @classmethod
+    def setup_class(cls):
+        remove_test_files()
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_test_files()
+
+    def load_fixture(self, filename):
+        with open(os.path.join(FIXTURES_PATH, filename)) as f:
+            return json.load(f)
+
+    def get_zip_node(self, download_dir):
+        folder = download_dir[0]
+        for name in ["Content", "Part 1 - Chng Eng Siong", "Content (Lab, Tut and Lectures)"]:
+            folder = next(c for c in folder["children"] if c["name"] == name)
+        return folder["children"][0]
+
+    def load_incoming(self):
+        incoming = self.load_fixture("CE3007_download_subset.json")
+        zip_node = self.get_zip_node(incoming)
+        del zip_node["download_link"], zip_node["filename"]
+        return incoming
+
+    def test_changed_links(self):
+        storage = Storage(temp_dir)
+        storage.save_download_dir(self.load_fixture("CE3007_expected_download_subset.json"))
+
+        # unchanged files reuse stored download links
+        incoming = self.load_incoming()
+        storage.merge_download_dir(incoming)
+        self.assertEqual(
+            "Part1_ForStudentsOnly(1).zip", self.get_zip_node(incoming)["filename"]
+        )
+
+        # file now points to a different link, stored download link is stale
+        incoming = self.load_incoming()
+        self.get_zip_node(incoming)["predownload_link"] += "0"
+        storage.merge_download_dir(incoming)
+        self.assertIsNone(self.get_zip_node(incoming).get("filename"))
+
+    def test_recorded_lecture_size_is_reused(self):
+        lecture = {
+            "type": "recorded_lecture",
+            "name": "Lecture 1",
+            "predownload_link": "/webapps/Acu-AcuLe@rn-BB5dcb73f79ba4c/am/start_play_studio.jsp?sn=1",
+        }
+        storage = Storage(temp_dir)
+        storage.save_course(
+            {
+                "type": "folder",
+                "name": "CE2003",
+                "children": [
+                    dict(
+                        lecture,
+                        download_link="https://example.com/1.mp4",
+                        filename="Lecture 1.mp4",
+                        size=1024,
+                        accepts_ranges=True,
+                    )
+                ],
+            }
+        )
+        incoming = {"type": "folder", "name": "CE2003", "children": [dict(lecture)]}
+        storage.merge_download_dir([incoming])
+        self.assertEqual(1024, incoming["children"][0]["size"])
+        self.assertTrue(incoming["children"][0]["accepts_ranges"])
+
+    def test_save_course_keeps_other_courses(self):
+        storage = Storage(temp_dir)
+        storage.save_download_dir(self.load_fixture("CE3007_expected_download_subset.json"))
+        storage.save_course({"type": "folder", "name": "CE2003", "children": []})
+        next_storage = Storage(temp_dir)
+        self.assertEqual(
+            ["19S2-CE3007-DIGITAL SIGNAL PROCESSING", "CE2003"],
+            [node["name"] for node in next_storage.download_dir],
+        )
+
+
+class TestStorageJournal(BaseTestStorage):
+    def setUp(self):
+        remove_test_files()
+
+    def tearDown(self):
+        remove_test_files()
+
+    def get_course(self):
+        return {
+            "type": "folder",
+            "name": "CE2003",
+            "children": [
+                {"type": "file", "name": "Tut{}".format(i), "predownload_link": "pre{}".format(i)}
+                for i in range(3)
+            ],
+        }
+
+    def record(self, storage, i):
+        storage.record_download(
+            {
+                "type": "file",
+                "name": "Tut{}".format(i),
+                "predownload_link": "pre{}".format(i),
+                "download_link": "https://download/Tut{}.pdf".format(i),
+                "filename": "Tut{}.pdf".format(i),
+            }
+        )
+
+    def test_replay_skips_torn_line(self):
+        storage = Storage(temp_dir)
+        self.record(storage, 0)
+        self.record(storage, 1)
+        with open(os.path.join(storage_dir, "journal.jsonl"), "a") as f:
+            f.write('{"predownload_link": "pre2", "download')
+
+        course = self.get_course()
+        storage = Storage(temp_dir)
+        storage.merge_download_dir([course])
+        self.assertEqual(
+            ["Tut0.pdf", "Tut1.pdf", None], [c.get("filename") for c in course["children"]]
+        )
+
+        # recorded after the torn line, survives the next load
+        self.record(storage, 2)
+        self.assertEqual({"pre0", "pre1", "pre2"}, set(Storage(temp_dir).journal))
+
+    def test_save_compacts_journal(self):
+        storage = Storage(temp_dir)
+        self.record(storage, 0)
+        course = self.get_course()
+        storage.merge_download_dir([course])
+        storage.save_course(course)
+        self.record(storage, 1)
+
+        self.assertEqual({"pre1"}, set(Storage(temp_dir).journal))
+        # snapshot plus journal
+        saved = Storage(temp_dir).download_dir[0]["children"]
+        self.assertEqual(["Tut0.pdf", "Tut1.pdf", None], [c.get("filename") for c in saved])
+        self.assertFalse(os.path.exists(os.path.join(storage_dir, "download_dir.json.tmp")))
+
+    def test_sqlite_journal(self):
+        storage = SQLiteStorage(temp_dir)
+        storage.save_course(self.get_course())
+        self.record(storage, 2)
+        course = self.get_course()
+        SQLiteStorage(temp_dir).merge_download_dir([course])
+        self.assertEqual("Tut2.pdf", course["children"][2]["filename"])
+        storage.save_course(course)
+        self.assertEqual({}, storage.get_journal())
+
+
+class TestSQLiteStorage(BaseTestStorage):
+    def setUp(self):
+        remove_test_files()
+
+    def tearDown(self):
+        remove_test_files()
+
+    def load_fixture(self, filename):
+        with open(os.path.join(FIXTURES_PATH, filename)) as f:
+            return json.load(f)
+
+    def test_save_and_merge(self):
+        storage = SQLiteStorage(temp_dir)
+        self.assertEqual([], storage.download_dir)
+        storage.save_download_dir(self.load_fixture("CE3007_download_subset.json"))
+        expected = self.load_fixture("CE3007_expected_download_subset.json")
+        self.assertObjEquals(expected, SQLiteStorage(temp_dir).download_dir, is_saved=True)
+
+        incoming = self.load_fixture("CE3007_predownload_subset_2.json")
+        storage.merge_download_dir(incoming)
+        self.assertObjEquals(
+            self.load_fixture("CE3007_expected_merged_predownload_subset_2.json"), incoming
+        )
 
+    def test_siblings_with_the_same_name(self):
+        def get_course():
+            return {
+                "type": "folder",
+                "name": "CE2003",
+                "children": [
+                    {"type": "file", "name": "T0", "predownload_link": "pre{}".format(i)}
+                    for i in range(3)
+                ]
+                + [{"type": "folder", "name": "T0", "children": []}],
+            }
+
+        course = get_course()
+        for i, child in enumerate(course["children"][:3]):
+            child["download_link"] = "https://download/{}".format(i)
+            child["filename"] = "{}.pdf".format(i)
+        SQLiteStorage(temp_dir).save_download_dir([course])
+
+        saved = SQLiteStorage(temp_dir).download_dir[0]["children"]
+        self.assertEqual(["file", "file", "file", "folder"], [c["type"] for c in saved])
+        self.assertEqual(["pre0", "pre1", "pre2"], [c["predownload_link"] for c in saved[:3]])
+
+        incoming = get_course()
+        SQLiteStorage(temp_dir).merge_download_dir([incoming])
+        self.assertEqual(
+            ["0.pdf", "1.pdf", "2.pdf"], [c["filename"] for c in incoming["children"][:3]]
+        )
+
+    def test_imports_json_storage(self):
+        Path(storage_dir).mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(
+            os.path.join(FIXTURES_PATH, "CE3007_expected_download_subset.json"),
+            os.path.join(storage_dir, "download_dir.json"),
+        )
+        storage = SQLiteStorage(temp_dir)
+        expected = self.load_fixture("CE3007_expected_download_subset.json")
+        self.assertObjEquals(expected, storage.download_dir, is_saved=True)
+        self.assertEqual(
+            "folder", storage.get_node(["19S2-CE3007-DIGITAL SIGNAL PROCESSING", "Content"])["type"]
+        )
+        self.assertIsNone(storage.get_node(["19S2-CE3007-DIGITAL SIGNAL PROCESSING", "missing"]))
+
+    def test_save_course_only_writes_changes(self):
+        storage = SQLiteStorage(temp_dir)
+        course_dir = self.load_fixture("CE3007_download_subset.json")[0]
+        storage.save_course(course_dir)
+        storage.save_course({"type": "folder", "name": "CE2003", "children": []})
+
+        changes = storage.conn.total_changes
+        storage.save_course(course_dir)
+        self.assertEqual(changes, storage.conn.total_changes)
+
+        # one file changed: only its row is written
+        folder = next(c for c in course_dir["children"] if c["type"] == "folder")
+        while not any(c["type"] == "file" for c in folder["children"]):
+            folder = next(c for c in folder["children"] if c["type"] == "folder")
+        file_node = next(c for c in folder["children"] if c["type"] == "file")
+        file_node["filename"] = "renamed.pdf"
+        storage.save_course(course_dir)
+        self.assertEqual(changes + 1, storage.conn.total_changes)
+
+        # removed children are deleted, other courses are kept
+        folder["children"].remove(file_node)
+        storage.save_course(course_dir)
+        self.assertEqual(
+            ["19S2-CE3007-DIGITAL SIGNAL PROCESSING", "CE2003"],
+            [node["name"] for node in SQLiteStorage(temp_dir).download_dir],
+        )
+        self.assertObjEquals([course_dir], SQLiteStorage(temp_dir).download_dir[:1])
+
+
+class TestLinkCache(unittest.TestCase):
+    @classmethod
+    def setup_class(cls):
+        remove_test_files()
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_test_files()
+
+    def test_link_cache(self):
+        cache = LinkCache(temp_dir)
+        self.assertIsNone(cache.get("predownload"))
+        cache.put("predownload", "https://download/Tut1.pdf", "Tut1.pdf")
+        cache.save()
+
+        next_cache = LinkCache(temp_dir)
+        self.assertEqual(("https://download/Tut1.pdf", "Tut1.pdf"), next_cache.get("predownload"))
+
+        expired_cache = LinkCache(temp_dir, ttl=-1)
+        self.assertIsNone(expired_cache.get("predownload"))
+
+    def test_link_cache_evicts_oldest(self):
+        cache = LinkCache(temp_dir, max_entries=2)
+        for i in range(3):
+            cache.put("predownload{}".format(i), "https://download/{}".format(i), str(i))
+        cache.save()
+        next_cache = LinkCache(temp_dir)
+        self.assertIsNone(next_cache.get("predownload0"))
+        self.assertIsNotNone(next_cache.get("predownload2"))
+
+
+
+class TestBlobStore(unittest.TestCase):
+    @classmethod
+    def setup_class(cls):
+        remove_test_files()
+
+    @classmethod
+    def tearDownClass(cls):
+        remove_test_files()
+
+    def write(self, name, content):
+        path = os.path.join(temp_dir, name)
+        Path(os.path.dirname(path)).mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    def test_blob_store(self):
+        store = BlobStore(temp_dir)
+        self.assertIsNone(store.get("9478986_1"))
+
+        tut1 = self.write("Tutorials/Tut1.pdf", b"Tut1")
+        store.add("9478986_1", tut1)
+        self.assertTrue(os.path.samefile(tut1, store.get("9478986_1")))
+
+        # same content under a different rid (or no rid) shares the stored blob
+        tut1_copy = self.write("Solutions/Tut1.pdf", b"Tut1")
+        store.add("9478987_1", tut1_copy)
+        self.assertTrue(os.path.samefile(tut1, tut1_copy))
+        lecture = self.write("Lectures/Tut1.mp4", b"Tut1")
+        store.add(None, lecture)
+        self.assertTrue(os.path.samefile(tut1, lecture))
+
+        # blobs persist even if the visible file is removed
+        os.remove(tut1)
+        next_store = BlobStore(temp_dir)
+        with open(next_store.get("9478986_1"), "rb") as f:
+            self.assertEqual(b"Tut1", f.read())
+
+    def test_prune(self):
+        remove_test_files()
+        store = BlobStore(temp_dir)
+        tut1 = self.write("Tutorials/Tut1.pdf", b"Tut1")
+        store.add("9478986_1", tut1)
+        tut2 = self.write("Tutorials/Tut2.pdf", b"Tut2")
+        store.add("9478987_1", tut2)
+        lecture = self.write("Lectures/Lec1.mp4", b"Lec1")
+        store.add(None, lecture)
+
+        self.assertEqual(0, store.prune())
+        os.remove(tut1)
+        os.remove(lecture)
+        self.assertEqual(2, store.prune())
+        self.assertIsNone(store.get("9478986_1"))
+        self.assertTrue(os.path.samefile(tut2, store.get("9478987_1")))
+        self.assertEqual(1, len(os.listdir(store.hash_dir)))
+
+    def test_blob_store_without_hard_links(self):
+        remove_test_files()
+        store = BlobStore(temp_dir)
+        tut1 = self.write("Tutorials/Tut1.pdf", b"Tut1")
+        with patch("os.link", side_effect=OSError("hard links not supported")):
+            store.add("9478986_1", tut1)
+            tut1_copy = self.write("Solutions/Tut1.pdf", b"Tut1")
+            store.add("9478987_1", tut1_copy)
 
+        # nothing is copied into the store, files are still found by rid within the sync
+        self.assertEqual([], os.listdir(store.hash_dir))
+        self.assertEqual([], os.listdir(store.rid_dir))
+        self.assertEqual(tut1, store.get("9478986_1"))
+        self.assertFalse(os.path.samefile(tut1, tut1_copy))
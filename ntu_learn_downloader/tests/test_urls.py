@@ -0,0 +1,49 @@
+import unittest
+
+from ntu_learn_downloader.urls import (
+    get_blob_id,
+    get_content_id_from_listContent_url,
+    get_course_id_from_link,
+    get_ids_from_listContent_url,
+    is_download_link,
+    parse_acustudio_page,
+)
+
+ACUSTUDIO_PAGE = """
+<script>
+var gsUserId    = "u123";
+var gsModuleId  = "m456";
+addStreamInfo("stream", "https://ntuvod.acustudio.com", "", "", "", "as");
+</script>
+"""
+
+
+class TestUrls(unittest.TestCase):
+    def test_download_link(self):
+        link = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478986_1/xid-9478986_1"
+        self.assertTrue(is_download_link(link))
+        self.assertEqual("9478986_1", get_blob_id(link))
+        self.assertFalse(is_download_link("https://ntulearn.ntu.edu.sg/bbcswebdav/pid-x"))
+        self.assertIsNone(get_blob_id("/webapps/blackboard/execute/content/file?cmd=view"))
+
+    def test_list_content_url(self):
+        url = "/webapps/blackboard/content/listContent.jsp?course_id=_375935_1&content_id=_1875178_1"
+        self.assertEqual(("_375935_1", "_1875178_1"), get_ids_from_listContent_url(url))
+        self.assertEqual("_1875178_1", get_content_id_from_listContent_url(url))
+        self.assertIsNone(get_content_id_from_listContent_url("/webapps/blackboard/content/listContent.jsp"))
+        self.assertIsNone(get_ids_from_listContent_url("https://ntulearn.ntu.edu.sg/"))
+
+    def test_course_link(self):
+        onclick = "javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url='); return false;"
+        self.assertEqual("302242_1", get_course_id_from_link(onclick))
+        self.assertIsNone(get_course_id_from_link(None))
+        self.assertIsNone(get_course_id_from_link("javascript:void(0)"))
+
+    def test_parse_acustudio_page(self):
+        self.assertEqual(
+            ("u123", "m456", "https://ntuvod.acustudio.com"), parse_acustudio_page(ACUSTUDIO_PAGE)
+        )
+        # a mention of the variable before its assignment is skipped
+        page = "// var gsUserId is set below\n" + ACUSTUDIO_PAGE
+        self.assertEqual("u123", parse_acustudio_page(page)[0])
+        self.assertIsNone(parse_acustudio_page(ACUSTUDIO_PAGE.replace("gsModuleId", "moduleId")))
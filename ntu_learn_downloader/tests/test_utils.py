@@ -1,7 +1,38 @@
+import json
+import os
+import tempfile
 import unittest
 
-from ntu_learn_downloader.tests.mock_server import MOCK_CONSTANTS
-from ntu_learn_downloader.utils import get_video_download_size, get_filename_from_url, sanitise_filename
+from ntu_learn_downloader.tests.mock_server import (
+    MOCK_CONSTANTS,
+    ChangingFileHandler,
+    get_free_port,
+    get_synthetic_body,
+    start_mock_server,
+)
+from ntu_learn_downloader.utils import (
+    PART_VALIDATORS_SUFFIX,
+    SEGMENT_JOURNAL_SUFFIX,
+    SEGMENTED_PART_FILE_SUFFIX,
+    covers_range,
+    download,
+    download_segmented,
+    get_blob_id,
+    get_content_range_start,
+    get_download_info,
+    get_part_file_path,
+    get_remote_validators,
+    get_segments,
+    get_video_download_size,
+    get_filename_from_url,
+    sanitise_filename,
+)
+
+DOWNLOAD_URL = "http://localhost:8082/bbcswebdav/pid-1875203-dt-content-rid-9478994_1/courses/19S2-CE2003-LEC/Tut2_CE2003_soln.pdf"
+DOWNLOAD_CONTENT = b"%PDF-1.4 Tut2_CE2003_soln"
+# served by the mock server with byte range support
+SYNTHETIC_URL = "http://localhost:8082/content/synthetic/media/1.mp4"
+SYNTHETIC_SIZE = 5242887
 
 
 class TestUtils(unittest.TestCase):
@@ -19,4 +50,158 @@ class TestUtils(unittest.TestCase):
 
     def test_sanitise_filename(self):
         name = 'Week 1: Tutorial (1/2).mp4'
-        self.assertEqual('Week 1 Tutorial (1-2).mp4', sanitise_filename(name))
\ No newline at end of file
+        self.assertEqual('Week 1 Tutorial (1-2).mp4', sanitise_filename(name))
+
+    def test_download(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "Tutorials", "Tut2_CE2003_soln.pdf")
+            self.assertTrue(download("BbRouter", DOWNLOAD_URL, destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(DOWNLOAD_CONTENT, f.read())
+            self.assertFalse(os.path.exists(get_part_file_path(destination)))
+            # existing files are not downloaded again
+            self.assertFalse(download("BbRouter", DOWNLOAD_URL, destination))
+
+    def test_download_restarts_if_range_ignored(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "Tut2_CE2003_soln.pdf")
+            with open(get_part_file_path(destination), "wb") as f:
+                f.write(b"stale")
+            self.assertTrue(download("BbRouter", DOWNLOAD_URL, destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(DOWNLOAD_CONTENT, f.read())
+
+    def test_get_segments(self):
+        self.assertEqual([(0, 3), (4, 7), (8, 9)], get_segments(10, 3))
+        self.assertEqual([(0, 9)], get_segments(10, 1))
+
+    def test_download_segmented_small_file_falls_back(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "Tut2_CE2003_soln.pdf")
+            self.assertTrue(
+                download_segmented(
+                    "BbRouter", DOWNLOAD_URL, destination, size=25, accepts_ranges=True
+                )
+            )
+            with open(destination, "rb") as f:
+                self.assertEqual(DOWNLOAD_CONTENT, f.read())
+
+    def test_download_resumes_with_range(self):
+        content = get_synthetic_body(SYNTHETIC_SIZE)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "1.mp4")
+            with open(get_part_file_path(destination), "wb") as f:
+                f.write(content[:1000])
+            self.assertTrue(download("BbRouter", SYNTHETIC_URL, destination))
+            with open(destination, "rb") as f:
+                self.assertEqual(content, f.read())
+
+    def test_download_segmented(self):
+        self.assertEqual((SYNTHETIC_SIZE, True), get_download_info(SYNTHETIC_URL))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "1.mp4")
+            self.assertTrue(download_segmented("BbRouter", SYNTHETIC_URL, destination, 4))
+            with open(destination, "rb") as f:
+                self.assertEqual(get_synthetic_body(SYNTHETIC_SIZE), f.read())
+            self.assertFalse(os.path.exists(destination + SEGMENTED_PART_FILE_SUFFIX))
+            self.assertFalse(os.path.exists(destination + SEGMENT_JOURNAL_SUFFIX))
+
+    def test_download_segmented_resumes_unfinished_segments(self):
+        content = get_synthetic_body(SYNTHETIC_SIZE)
+        segments = get_segments(SYNTHETIC_SIZE, 4)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "1.mp4")
+            # first segment was completed by an earlier, interrupted download
+            start, end = segments[0]
+            with open(destination + SEGMENTED_PART_FILE_SUFFIX, "wb") as f:
+                f.truncate(SYNTHETIC_SIZE)
+                f.write(content[start : end + 1])
+            with open(destination + SEGMENT_JOURNAL_SUFFIX, "w") as f:
+                json.dump(
+                    {"size": SYNTHETIC_SIZE, "segments": segments, "completed": [[start, end]]},
+                    f,
+                )
+            self.assertTrue(
+                download_segmented(
+                    "BbRouter", SYNTHETIC_URL, destination, 4, SYNTHETIC_SIZE, True
+                )
+            )
+            with open(destination, "rb") as f:
+                self.assertEqual(content, f.read())
+
+    def test_download_segmented_discards_part_of_another_size(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            destination = os.path.join(tmp_dir, "1.mp4")
+            # left over from a version of the video that was larger
+            with open(destination + SEGMENTED_PART_FILE_SUFFIX, "wb") as f:
+                f.truncate(SYNTHETIC_SIZE + 4096)
+            with open(destination + SEGMENT_JOURNAL_SUFFIX, "w") as f:
+                json.dump({"size": SYNTHETIC_SIZE + 4096, "segments": [], "completed": []}, f)
+            self.assertTrue(
+                download_segmented(
+                    "BbRouter", SYNTHETIC_URL, destination, 4, SYNTHETIC_SIZE, True
+                )
+            )
+            with open(destination, "rb") as f:
+                self.assertEqual(get_synthetic_body(SYNTHETIC_SIZE), f.read())
+            self.assertFalse(os.path.exists(destination + SEGMENTED_PART_FILE_SUFFIX))
+            self.assertFalse(os.path.exists(destination + SEGMENT_JOURNAL_SUFFIX))
+
+    def test_covers_range(self):
+        self.assertTrue(covers_range([[4, 9], [0, 3]], 10))
+        self.assertFalse(covers_range([[0, 3], [5, 9]], 10))
+        self.assertFalse(covers_range([[0, 3]], 10))
+        self.assertTrue(covers_range([], 0))
+
+    def test_get_content_range_start(self):
+        self.assertEqual(100, get_content_range_start("bytes 100-199/1000"))
+        self.assertIsNone(get_content_range_start("bytes */1000"))
+        self.assertIsNone(get_content_range_start(None))
+
+    def test_download_does_not_resume_changed_or_misaligned_file(self):
+        port = get_free_port()
+        server = start_mock_server(port, ChangingFileHandler)
+        url = "http://localhost:{}/Tut1.pdf".format(port)
+        body = ChangingFileHandler.body
+        try:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                destination = os.path.join(tmp_dir, "Tut1.pdf")
+
+                # the part file was started from another version of the file
+                with open(get_part_file_path(destination), "wb") as f:
+                    f.write(b"version 1")
+                with open(destination + PART_VALIDATORS_SUFFIX, "w") as f:
+                    json.dump({"etag": '"v1"'}, f)
+                self.assertTrue(download("BbRouter", url, destination))
+                with open(destination, "rb") as f:
+                    self.assertEqual(body, f.read())
+                self.assertFalse(os.path.exists(destination + PART_VALIDATORS_SUFFIX))
+
+                # the server answers the range from another position
+                os.remove(destination)
+                ChangingFileHandler.misaligned = True
+                with open(get_part_file_path(destination), "wb") as f:
+                    f.write(body[:9])
+                self.assertTrue(download("BbRouter", url, destination))
+                with open(destination, "rb") as f:
+                    self.assertEqual(body, f.read())
+
+                # a complete part file is renamed, its size still recorded
+                os.remove(destination)
+                with open(get_part_file_path(destination), "wb") as f:
+                    f.write(body)
+                validators = {}
+
+                def on_response(response):
+                    validators.update(get_remote_validators(response))
+
+                self.assertTrue(download("BbRouter", url, destination, on_response=on_response))
+                self.assertEqual(len(body), validators["size"])
+        finally:
+            ChangingFileHandler.misaligned = False
+            server.shutdown()
+
+    def test_get_blob_id(self):
+        url = "https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478986_1/xid-9478986_1"
+        self.assertEqual("9478986_1", get_blob_id(url))
+        self.assertIsNone(get_blob_id("https://ntulearn.ntu.edu.sg/webapps/login/"))
@@ -0,0 +1,133 @@
+"""
+URLs: classification of NTULearn links and extraction of the ids they carry.
+
+Every pattern is compiled once at import, and each function first checks for a literal substring
+the pattern requires, so the many anchors of a large crawl that are not of the kind asked about are
+rejected without running the regex. AcuStudio pages are searched for the literal start of each value
+needed to build the video link, and only those positions are matched (see parse_acustudio_page).
+"""
+import re
+from typing import Optional, Tuple
+
+DOWNLOAD_LINK_MARKER = "bbcswebdav/pid-"
+DOWNLOAD_LINK_RE = re.compile(r"bbcswebdav/pid-\d+-dt-content-rid-(\d+_\d+)")
+
+LIST_CONTENT_MARKER = "listContent.jsp"
+LIST_CONTENT_RE = re.compile(
+    r"/webapps/blackboard/content/listContent\.jsp\?course_id=(_\d+_\d+)&content_id=(_\d+_\d+)"
+)
+
+COURSE_LINK_MARKER = "type=Course&id=_"
+COURSE_LINK_RE = re.compile(r"type=Course&id=_(\S+)&url=")
+
+# (literal every match starts with, pattern) of gsUserId, gsModuleId and the streaming domain. A
+# single alternation of the three is slower, it cannot skip ahead to a literal prefix (see
+# parse_acustudio_page_alternation in tests/microbenchmark.py)
+ACUSTUDIO_PATTERNS = [
+    ("var gsUserId", re.compile(r'var gsUserId\s+= "(\S+)";')),
+    ("var gsModuleId", re.compile(r'var gsModuleId\s+= "(\S+)";')),
+    ('addStreamInfo("', re.compile(r'addStreamInfo\("\S+", "(\S+)", "", "", "", "as"\)')),
+]
+
+
+def is_download_link(url):
+    """
+    Examples of download links:
+    https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478986_1/xid-9478986_1 Tut1_CE2003
+    https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478990_1/xid-9478990_1 Tut2_CE2003
+    """
+    return DOWNLOAD_LINK_MARKER in url and DOWNLOAD_LINK_RE.search(url) is not None
+
+
+def get_blob_id(url: str) -> Optional[str]:
+    """get the content rid of a bbcswebdav link, which identifies the uploaded file. The same file
+    linked from several folders or courses has the same rid
+
+    Arguments:
+        url {str} -- download link, e.g. https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478986_1/xid-9478986_1
+
+    Returns:
+        Optional[str] -- rid, e.g. 9478986_1
+    """
+    if DOWNLOAD_LINK_MARKER not in url:
+        return None
+    m = DOWNLOAD_LINK_RE.search(url)
+    return m.group(1) if m is not None else None
+
+
+def get_ids_from_listContent_url(url: str) -> Optional[Tuple[str, str]]:
+    """return the course id and content id from the list content url in the form of a tuple
+
+    Arguments:
+        url {str} -- list content url
+
+    Returns:
+        Optional[Tuple[str, str]] -- tuple of course id and content id
+    """
+    if LIST_CONTENT_MARKER not in url:
+        return None
+    m = LIST_CONTENT_RE.search(url)
+    if m is None:
+        return None
+    return m.group(1), m.group(2)
+
+
+def get_content_id_from_listContent_url(url: str) -> Optional[str]:
+    """get content id from list content url. The url contains the course id and the content id. Only
+    return the content id
+
+    Arguments:
+        url {str} --
+
+    Returns:
+        Optional[str] -- content id
+    """
+    ids = get_ids_from_listContent_url(url)
+    return ids[1] if ids is not None else None
+
+
+def get_course_id_from_link(link: Optional[str]) -> Optional[str]:
+    """get course id from the onclick of a course link, e.g.
+    javascript:globalNavMenu.goToUrl('/webapps/blackboard/execute/launcher?type=Course&id=_302242_1&url='); return false;
+
+    Arguments:
+        link {Optional[str]} -- onclick attribute
+
+    Returns:
+        Optional[str] -- course id, e.g. 302242_1
+    """
+    if not link or COURSE_LINK_MARKER not in link:
+        return None
+    m = COURSE_LINK_RE.search(link)
+    return m.group(1) if m is not None else None
+
+
+def find_anchored(html: str, literal: str, pattern) -> Optional[str]:
+    """first group of the first match of pattern, which starts with literal. The page is searched
+    for literal and the pattern only matched where it occurs"""
+    pos = html.find(literal)
+    while pos != -1:
+        m = pattern.match(html, pos)
+        if m is not None:
+            return m.group(1)
+        pos = html.find(literal, pos + 1)
+    return None
+
+
+def parse_acustudio_page(html: str) -> Optional[Tuple[str, str, str]]:
+    """find gsUserId, gsModuleId and the streaming domain of an AcuStudio page, stopping at the
+    first one missing. The first occurrence of each is used
+
+    Arguments:
+        html {str} -- AcuStudio page
+
+    Returns:
+        Optional[Tuple[str, str, str]] -- (user id, module id, domain), None if any is missing
+    """
+    values = []
+    for literal, pattern in ACUSTUDIO_PATTERNS:
+        value = find_anchored(html, literal, pattern)
+        if value is None:
+            return None
+        values.append(value)
+    return values[0], values[1], values[2]
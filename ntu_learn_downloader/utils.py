@@ -1,81 +1,63 @@
+import json
 import math
 import os
 import re
 import shutil
 import unicodedata
 import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Tuple, Callable
+from threading import Lock
+from typing import Dict, Optional, Tuple, Callable, List
 
 import requests
-from requests.adapters import HTTPAdapter
-from requests.packages.urllib3.util.retry import Retry
 
+from ntu_learn_downloader.client import get_client
+from ntu_learn_downloader.metrics import BLOB_DOWNLOAD, HEAD_REDIRECT, OTHER, record_bytes
+# re-exported, classification of links used to live here
+from ntu_learn_downloader.urls import (
+    get_blob_id,
+    get_content_id_from_listContent_url,
+    get_ids_from_listContent_url,
+    is_download_link,
+)
 
-def is_download_link(url):
-    """ 
-    Examples of download links:
-    https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478986_1/xid-9478986_1 Tut1_CE2003
-    https://ntulearn.ntu.edu.sg/bbcswebdav/pid-1875199-dt-content-rid-9478990_1/xid-9478990_1 Tut2_CE2003
-    """
-    pattern = r"bbcswebdav\/pid-\d+-dt-content-rid-\d+"
-    return re.search(pattern, url) is not None
-
-
-def get_content_id_from_listContent_url(url: str) -> Optional[str]:
-    """get content id from list content url. The url contains the course id and the content id. Only
-    return the content id
-
-    Arguments:
-        url {str} -- 
-
-    Returns:
-        Optional[str] -- content id
-    """
-    m = re.search(
-        r"\/webapps\/blackboard\/content\/listContent\.jsp\?course_id=(_\d+_\d+)&content_id=(_\d+_\d+)",
-        url,
-    )
-    if m is None:
-        return None
-    g = m.groups()
-    return g[1]
 
-
-def get_ids_from_listContent_url(url: str) -> Optional[Tuple[str, str]]:
-    """return the course id and content id from the list content url in the form of a tuple
+def link_file(src: str, dst: str):
+    """hard link src to dst, falling back to copying if hard links are not supported (e.g. dst is
+    on another filesystem)
 
     Arguments:
-        url {str} -- list content url
-
-    Returns:
-        Optional[Tuple[str, str]] -- tuple of course id and content id
+        src {str} -- existing file
+        dst {str} -- new file, parent directories are created if needed
     """
-    m = re.search(
-        r"\/webapps\/blackboard\/content\/listContent\.jsp\?course_id=(_\d+_\d+)&content_id=(_\d+_\d+)",
-        url,
-    )
-    if m is None:
-        return None
-    g = m.groups()
-    return (g[0], g[1])
-
-
-def make_GET_request(BbRouter, path, params=None):
+    dir_path = os.path.dirname(dst)
+    if dir_path and not os.path.isdir(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+GET_REQUEST_HEADERS = {
+    "Connection": "keep-alive",
+    "Accept": "text/javascript, text/html, application/xml, text/xml, */*",
+    "X-Prototype-Version": "1.7",  # type: ignore
+    "X-Requested-With": "XMLHttpRequest",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.113 Safari/537.36",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Dest": "empty",
+    "Accept-Language": "en-US,en;q=0.9",
+}
+
+
+def make_GET_request(BbRouter, path, params=None, category=OTHER):
     cookies = {"BbRouter": BbRouter}
-    headers = {
-        "Connection": "keep-alive",
-        "Accept": "text/javascript, text/html, application/xml, text/xml, */*",
-        "X-Prototype-Version": "1.7",  # type: ignore
-        "X-Requested-With": "XMLHttpRequest",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.113 Safari/537.36",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Dest": "empty",
-        "Accept-Language": "en-US,en;q=0.9",
-    }
-
-    return requests.get(path, headers=headers, cookies=cookies, params=params)
+    return get_client().get(
+        path, category=category, headers=GET_REQUEST_HEADERS, cookies=cookies, params=params
+    )
 
 
 def get_predownload_link(url: str) -> str:
@@ -116,6 +98,10 @@ def dummy_file_exists(target_dir: str, name: str) -> bool:
     return os.path.exists(get_dummy_file_path(target_dir, name))
 
 
+SLASHES_RE = re.compile(r"[\\/]")
+UNSAFE_FILENAME_CHARS_RE = re.compile(r"[^\.()\w\s-]")
+
+
 def sanitise_filename(value):
     """Sanitise filename by 
     1. replace slashes with hypens
@@ -128,74 +114,236 @@ def sanitise_filename(value):
     value = (
         unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii")
     )
-    value = re.sub(r"[\\/]", "-", value)
-    value = re.sub(r"[^\.()\w\s-]", "", value)
+    value = SLASHES_RE.sub("-", value)
+    value = UNSAFE_FILENAME_CHARS_RE.sub("", value)
     value = value.strip("-_")
     return value
 
 
+PART_FILE_SUFFIX = ".part"
+# ETag and Last-Modified of the response a part file was started from
+PART_VALIDATORS_SUFFIX = ".part.json"
+SEGMENTED_PART_FILE_SUFFIX = ".segmented.part"
+SEGMENT_JOURNAL_SUFFIX = ".segments.json"
+DEFAULT_SEGMENTS = 4
+# files smaller than this are not worth splitting
+MIN_SEGMENT_SIZE = 1024 * 1024
+
+DOWNLOAD_HEADERS = {
+    "Connection": "keep-alive",
+    "Pragma": "no-cache",
+    "Cache-Control": "no-cache",
+    "Upgrade-Insecure-Requests": "1",
+    "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.138 Safari/537.36",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Dest": "document",
+    "Accept-Language": "en-SG,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
+}
+
+
+def get_part_file_path(destination: str) -> str:
+    return destination + PART_FILE_SUFFIX
+
+
+def read_part_validators(validators_path: str) -> Dict:
+    """validators saved when a part file was started, empty if missing or unreadable"""
+    try:
+        with open(validators_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_part_validators(validators_path: str, validators: Dict):
+    """save the ETag and Last-Modified in validators (see get_remote_validators) of the response a
+    part file is started from"""
+    with open(validators_path, "w") as f:
+        json.dump(
+            {key: validators[key] for key in ("etag", "last_modified") if key in validators}, f
+        )
+
+
+def get_if_range(validators: Dict) -> Optional[str]:
+    """If-Range header value for validators, a weak ETag can not be used in If-Range"""
+    etag = validators.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return validators.get("last_modified")
+
+
+def get_content_range_total(content_range: Optional[str]) -> Optional[int]:
+    """return the complete length from a Content-Range header, e.g. "bytes 0-99/1000" or "bytes */1000"
+
+    Arguments:
+        content_range {Optional[str]} -- Content-Range header value
+
+    Returns:
+        Optional[int] -- complete length, None if not available
+    """
+    if not content_range or "/" not in content_range:
+        return None
+    total = content_range.rsplit("/", 1)[1].strip()
+    return int(total) if total.isdigit() else None
+
+
+def get_content_range_start(content_range: Optional[str]) -> Optional[int]:
+    """return the first byte position from a Content-Range header, e.g. 0 for "bytes 0-99/1000"
+
+    Arguments:
+        content_range {Optional[str]} -- Content-Range header value
+
+    Returns:
+        Optional[int] -- first byte position, None if not available (e.g. "bytes */1000")
+    """
+    if not content_range:
+        return None
+    match = re.match(r"\s*bytes\s+(\d+)-", content_range)
+    return int(match.group(1)) if match else None
+
+
+def get_remote_validators(response: requests.Response) -> Dict:
+    """size, ETag and Last-Modified of the file served by response (a HEAD, a GET, a ranged GET or
+    a 416 to a range past the end), only those the server sent
+
+    Arguments:
+        response {requests.Response} -- response
+
+    Returns:
+        Dict -- with keys size (complete length in bytes), etag and last_modified
+    """
+    validators: Dict = {}
+    size = None
+    if response.status_code in (206, 416):
+        size = get_content_range_total(response.headers.get("content-range"))
+    elif response.headers.get("content-length", "").isdigit():
+        size = int(response.headers["content-length"])
+    if size is not None:
+        validators["size"] = size
+    if response.headers.get("etag"):
+        validators["etag"] = response.headers["etag"]
+    if response.headers.get("last-modified"):
+        validators["last_modified"] = response.headers["last-modified"]
+    return validators
+
+
+def get_file_validators(BbRouter: str, url: str) -> Dict:
+    """HEAD the download link for its size, ETag and Last-Modified, see get_remote_validators"""
+    res = get_client().head(
+        url, category=HEAD_REDIRECT, allow_redirects=True, cookies={"BbRouter": BbRouter}
+    )
+    res.raise_for_status()
+    return get_remote_validators(res)
+
+
 def download(
-    BbRouter: str, url: str, destination: str, callback: Callable[[int, Optional[int]], None] = None
+    BbRouter: str,
+    url: str,
+    destination: str,
+    callback: Callable[[int, Optional[int]], None] = None,
+    overwrite: bool = False,
+    on_response: Callable[[requests.Response], None] = None,
 ) -> bool:
     """download file, redirects will be involved. Even though download is invokes from a file object
     that has a name, the downloaded file name will be used instead
 
+    The file is written to {destination}.part and only renamed to destination once complete. If a
+    part file is left over from an interrupted download, the download resumes from its end with a
+    Range request, falling back to a full download if the server ignores the range. The ETag (or
+    Last-Modified) of the response the part file was started from is saved next to it and sent as
+    If-Range, so a file changed since is downloaded in full instead of appended to the old part.
+
     Arguments:
         BbRouter {str} -- authentication token
         url {str} -- url
         destination {str} -- target file
         callback {int, Optional[int] -> None} -- callback hook to report progress, inputs to are
             bytes downloaded so far, and total file size, None if not available 
+        overwrite {bool} -- download even if destination exists, replacing it once complete. A
+            left over part file is discarded (default: {False})
+        on_response {requests.Response -> None} -- called with the response the file is read
+            from, e.g. to record its validators (see get_remote_validators)
 
     Returns:
-        bool -- [description]
+        bool -- True if file was downloaded, False if destination already exists
     """
     cookies = {"BbRouter": BbRouter}
-    headers = {
-        "Connection": "keep-alive",
-        "Pragma": "no-cache",
-        "Cache-Control": "no-cache",
-        "Upgrade-Insecure-Requests": "1",
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_14_6) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.138 Safari/537.36",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Dest": "document",
-        "Accept-Language": "en-SG,en-GB;q=0.9,en-US;q=0.8,en;q=0.7",
-    }
+    headers = dict(DOWNLOAD_HEADERS)
 
     # if directory does not exist then create it
     dir_path = os.path.dirname(destination)
     if not os.path.isdir(dir_path):
         os.makedirs(dir_path, exist_ok=True)
 
+    part_path = get_part_file_path(destination)
+    validators_path = destination + PART_VALIDATORS_SUFFIX
     if os.path.isfile(destination):
-        return False
-
-
-    session = requests.Session()
-    retry = Retry(connect=5, backoff_factor=0.5)
-    adapter = HTTPAdapter(max_retries=retry)
-    session.mount('http://', adapter)
-    session.mount('https://', adapter)
-
-    with open(destination, "wb") as f:
-        with session.get(
-            url, allow_redirects=True, stream=True, cookies=cookies, headers=headers
-        ) as response:
+        if not overwrite:
+            return False
+        remove_part_files(part_path, validators_path)
+
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if offset:
+        headers["Range"] = "bytes={}-".format(offset)
+        if_range = get_if_range(read_part_validators(validators_path))
+        if if_range:
+            headers["If-Range"] = if_range
+
+    with get_client().get(
+        url,
+        category=BLOB_DOWNLOAD,
+        allow_redirects=True,
+        stream=True,
+        cookies=cookies,
+        headers=headers,
+    ) as response:
+        if offset and response.status_code == 416:
+            # nothing left to fetch if the part file already has every byte, otherwise the part
+            # file is stale so start over
+            if get_content_range_total(response.headers.get("content-range")) == offset:
+                if on_response:
+                    on_response(response)
+                os.replace(part_path, destination)
+                remove_part_files(validators_path)
+                return True
+            # closed before starting over, it holds one of the host's connection slots
+            response.close()
+            remove_part_files(part_path, validators_path)
+            return download(BbRouter, url, destination, callback, overwrite, on_response)
+        response.raise_for_status()
+        if response.status_code == 206 and (
+            get_content_range_start(response.headers.get("content-range")) != offset
+        ):
+            # not the rest of the part file, start over
+            response.close()
+            remove_part_files(part_path, validators_path)
+            return download(BbRouter, url, destination, callback, overwrite, on_response)
+        if on_response:
+            on_response(response)
+        if response.status_code != 206:
+            # server ignored the range request or the file changed (If-Range did not match),
+            # download the whole file again
+            offset = 0
+            write_part_validators(validators_path, get_remote_validators(response))
+
+        total_length_str = response.headers.get("content-length")
+        total_length = (
+            int(total_length_str) + offset if total_length_str is not None else None
+        )
+        with open(part_path, "ab" if offset else "wb") as f:
             if callback:
-                total_length_str = response.headers.get("content-length")
-                total_length = int(total_length_str) if total_length_str is not None else None
-                dl = 0
-                with open(destination, "wb") as f:
-                    for data in response.iter_content(chunk_size=1024):
-                        dl += len(data)
-                        f.write(data)
-                        callback(dl, total_length)
-
+                dl = offset
+                for data in response.iter_content(chunk_size=1024):
+                    dl += len(data)
+                    f.write(data)
+                    callback(dl, total_length)
             else:
                 shutil.copyfileobj(response.raw, f)
 
+    record_bytes(BLOB_DOWNLOAD, os.path.getsize(part_path) - offset)
+    os.replace(part_path, destination)
+    remove_part_files(validators_path)
     return True
 
 
@@ -223,15 +371,184 @@ def has_ext(url: str) -> bool:
     return len(ext) > 0
 
 
-def get_video_download_size(url: str) -> Optional[str]:
-    res = requests.head(url, allow_redirects=True)
+def get_download_info(url: str) -> Tuple[Optional[int], bool]:
+    """HEAD the url to get the size of the file and whether the server supports byte ranges
+
+    Arguments:
+        url {str} -- download link
+
+    Returns:
+        Tuple[Optional[int], bool] -- size in bytes (None if not available), accepts byte ranges
+    """
+    res = get_client().head(url, category=HEAD_REDIRECT, allow_redirects=True)
 
-    size = res.headers["Content-Length"]
+    size = res.headers.get("Content-Length")
+    accepts_ranges = res.headers.get("Accept-Ranges", "").lower() == "bytes"
+    return (int(size) if size else None, accepts_ranges)
+
+
+def get_video_download_size(url: str) -> Optional[str]:
+    size, _accepts_ranges = get_download_info(url)
     if size:
-        return convert_size(int(size))
+        return convert_size(size)
     return None
 
 
+def get_segments(size: int, num_segments: int) -> List[Tuple[int, int]]:
+    """split size bytes into num_segments contiguous inclusive byte ranges
+
+    Arguments:
+        size {int} -- total size in bytes
+        num_segments {int} -- number of segments
+
+    Returns:
+        List[Tuple[int, int]] -- list of (first byte, last byte)
+    """
+    segment_size = math.ceil(size / num_segments)
+    return [
+        (start, min(start + segment_size, size) - 1)
+        for start in range(0, size, segment_size)
+    ]
+
+
+def read_segment_journal(journal_path: str) -> Optional[Dict]:
+    """segment journal of download_segmented, None if missing or unreadable"""
+    try:
+        with open(journal_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_part_files(*paths: str):
+    """remove the part file and journal (or validators) of an interrupted download, if present"""
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def covers_range(segments: List[List[int]], size: int) -> bool:
+    """whether the inclusive byte ranges cover every byte of [0, size)"""
+    end = 0
+    for first, last in sorted(segments):
+        if first > end:
+            return False
+        end = max(end, last + 1)
+    return end >= size
+
+
+def download_segmented(
+    BbRouter: str,
+    url: str,
+    destination: str,
+    num_segments: int = DEFAULT_SEGMENTS,
+    size: Optional[int] = None,
+    accepts_ranges: bool = False,
+    overwrite: bool = False,
+) -> bool:
+    """download file over several connections at once, each fetching a byte range into a
+    preallocated {destination}.segmented.part file. Completed segments are recorded in
+    {destination}.segments.json so an interrupted download only refetches unfinished segments.
+    Falls back to download if the size is unknown, the file is small or ranges are not supported.
+
+    Arguments:
+        BbRouter {str} -- authentication token
+        url {str} -- url
+        destination {str} -- target file
+        num_segments {int} -- number of parallel connections
+        size {Optional[int]} -- size in bytes, if None the url is HEADed to find it
+        accepts_ranges {bool} -- whether server supports byte ranges, ignored if size is None
+        overwrite {bool} -- download even if destination exists, see download
+
+    Returns:
+        bool -- True if file was downloaded, False if destination already exists
+    """
+    if os.path.isfile(destination) and not overwrite:
+        return False
+    if size is None:
+        size, accepts_ranges = get_download_info(url)
+    if (
+        not size
+        or not accepts_ranges
+        or num_segments <= 1
+        or size < 2 * MIN_SEGMENT_SIZE
+    ):
+        return download(BbRouter, url, destination, overwrite=overwrite)
+
+    dir_path = os.path.dirname(destination)
+    if not os.path.isdir(dir_path):
+        os.makedirs(dir_path, exist_ok=True)
+
+    part_path = destination + SEGMENTED_PART_FILE_SUFFIX
+    journal_path = destination + SEGMENT_JOURNAL_SUFFIX
+    if overwrite and os.path.isfile(destination) and os.path.isfile(journal_path):
+        # segments left over from an earlier attempt may be of the previous version
+        os.remove(journal_path)
+    segments = get_segments(size, num_segments)
+    completed: List[List[int]] = []
+    journal = read_segment_journal(journal_path) if os.path.isfile(part_path) else None
+    if journal is not None and journal.get("size") == size:
+        completed = journal["completed"]
+        segments = [(start, end) for start, end in journal["segments"]]
+    else:
+        # no journal, or one of another version of the file, start over with a part of this size
+        remove_part_files(part_path, journal_path)
+        with open(part_path, "wb") as f:
+            f.truncate(size)
+
+    journal_lock = Lock()
+
+    def save_journal():
+        with journal_lock, open(journal_path, "w") as f:
+            json.dump({"size": size, "segments": segments, "completed": completed}, f)
+
+    save_journal()
+    cookies = {"BbRouter": BbRouter}
+
+    def fetch(segment: Tuple[int, int]):
+        start, end = segment
+        headers = dict(DOWNLOAD_HEADERS)
+        headers["Range"] = "bytes={}-{}".format(start, end)
+        written = 0
+        with get_client().get(
+            url,
+            category=BLOB_DOWNLOAD,
+            allow_redirects=True,
+            stream=True,
+            cookies=cookies,
+            headers=headers,
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise ValueError("server ignored range request for {}".format(url))
+            with open(part_path, "r+b") as f:
+                f.seek(start)
+                for data in response.iter_content(chunk_size=64 * 1024):
+                    f.write(data)
+                    written += len(data)
+        record_bytes(BLOB_DOWNLOAD, written)
+        if written != end - start + 1:
+            raise ValueError(
+                "segment {}-{} of {} is {} bytes".format(start, end, url, written)
+            )
+        with journal_lock:
+            completed.append([start, end])
+        save_journal()
+
+    remaining = [s for s in segments if list(s) not in completed]
+    with ThreadPoolExecutor(max_workers=num_segments) as executor:
+        # list() to raise the first exception from any segment
+        list(executor.map(fetch, remaining))
+
+    # the part file is preallocated, only the journal tells whether every byte was written
+    if not covers_range(completed, size):
+        remove_part_files(part_path, journal_path)
+        raise ValueError("segments downloaded for {} do not cover its {} bytes".format(url, size))
+    os.replace(part_path, destination)
+    os.remove(journal_path)
+    return True
+
+
 def convert_size(size_bytes):
     if size_bytes == 0:
         return "0B"
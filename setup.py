@@ -20,5 +20,6 @@ setuptools.setup(
     ],
     python_requires=">=3.6",
     install_requires=["beautifulsoup4==4.7.1", "requests==2.22.0", "lxml==4.5.1"],
+    extras_require={"async": ["aiohttp>=3.6"]},
 )
 